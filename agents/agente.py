@@ -1,21 +1,41 @@
 import sys
 import os
+import json
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, Iterator, List, Callable
 from dotenv import load_dotenv
 
 os.environ["LLAMA_LOG_LEVEL"] = "NONE" # Puede ser: "ERROR", "WARN", "INFO", "DEBUG"
 
+# Solo se cachean respuestas de agentes con temperatura baja
+CACHE_TEMPERATURA_MAXIMA = float(os.getenv("CACHE_RESPUESTAS_TEMPERATURA_MAX", 0.5))
+
+# Modo resumen del historial: mensajes recientes que van literales al prompt (0 = desactivado)
+RESUMEN_VENTANA = int(os.getenv("HISTORIAL_RESUMEN_VENTANA", 0))
+RUTA_PROMPT_RESUMEN = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts", "resumen_historial.txt"
+)
+
 from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableWithMessageHistory
-from langchain_community.llms import LlamaCpp
-from utils.conversation import Conversation
-from transformers import AutoTokenizer
+from utils.conversation import cache_conversaciones, historial_instantaneo
+from utils.modelos import registro_modelos, parametros_generacion, STOP_POR_DEFECTO, PARAMETROS_MUESTREO
+from utils.ejecutores import en_ejecutor
+from utils.cache_respuestas import cache_respuestas
+from utils.gramaticas import gramatica_json
+from utils.tokenizacion import obtener_tokenizador
+from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
 
  
 
+def ruta_historial(session_id: str) -> str:
+    """Archivo del historial de una sesión (compartido por todos los agentes)."""
+    return f"historiales/{session_id}.jsonl"
+
+
 class Agente(ABC):
     def __init__(self, config: dict, model_config: dict, system_prompt_path: str, tools=None):
         self.config = config
@@ -26,6 +46,9 @@ class Agente(ABC):
         with open(system_prompt_path, encoding="utf-8") as f:
             self.system_prompt = f.read()
 
+        # Parte del prompt que no cambia entre peticiones
+        self.prefijo_estatico = f"{self.system_prompt}\n\nHistorial de conversación:\n"
+
         self.prompt_template = PromptTemplate(
             input_variables=["history", "input"],
             template=(
@@ -36,31 +59,56 @@ class Agente(ABC):
         )
 
         self.chain = None  # Se inicializa cuando se use
+        self._prompt_resumen = None  # Se lee al primer resumen
 
-        self.history_factory = lambda session_id: Conversation(
-            file_path=f"historiales/{session_id}.json",
-            max_context_tokens=self.model_config.get("n_ctx", 768),  # Coincide con el modelo
-            token_buffer=self.model_config.get("token_buffer", 256),  # Espacio para respuestas
-            max_messages=self.model_config.get("max_messages", 10),  # Límite opcional
-            tokenizer=self.model_config.get("tokenizer", lambda x: len(x.split()))
-        )
+        # Presupuesto del historial en tokens del propio modelo (ver utils/tokenizacion.py),
+        # salvo que la configuración traiga su tokenizador
+        tokenizer = self.model_config.get("tokenizer")
+        tokenizer_name = self.model_config.get("tokenizer_name")
+        if tokenizer is None and self.model_config.get("model_path"):
+            tokenizer = obtener_tokenizador(self.model_config["model_path"])
+
+        # Conversación viva en memoria por sesión, con escritura diferida (ver utils/conversation.py)
+        def history_factory(session_id: str):
+            file_path = ruta_historial(session_id)
+            # Dentro de una instantánea (varios agentes a la vez) se lee una copia y no se escribe
+            copia = historial_instantaneo(file_path)
+            if copia is not None:
+                return copia
+            return cache_conversaciones.obtener(
+                file_path=file_path,
+                max_context_tokens=self.model_config.get("n_ctx", 768),  # Coincide con el modelo
+                token_buffer=self.model_config.get("token_buffer", 256),  # Espacio para respuestas
+                max_messages=self.model_config.get("max_messages", 10),  # Límite opcional
+                tokenizer=tokenizer,
+                # El del GGUF cambia de nombre al pasar de estimar a contar exacto
+                tokenizer_name=getattr(tokenizer, "nombre", tokenizer_name),
+                # Los turnos que salen de la ventana se resumen en segundo plano
+                summary_window=self.model_config.get("resumen_ventana", RESUMEN_VENTANA),
+                summarizer=self.resumir_historial
+            )
+        self.history_factory = history_factory
 
         self.agente = None  # Se inicializa cuando se use
 
+    def _parametros_llm(self) -> Dict[str, Any]:
+        params = parametros_generacion(
+            self.model_config,
+            temperature=0.5,
+            max_tokens=256,
+            stop=STOP_POR_DEFECTO,
+        )
+        # Estado KV del prompt de sistema evaluado una vez y restaurado en cada llamada
+        if self.model_config.get("kv_prefijo", True):
+            params["prefijo_kv"] = self.prefijo_estatico
+        return params
+
     def _ensure_llm(self):
         if self.llm is None:
-            self.llm = LlamaCpp(
-                model_path=self.model_config.get("model_path"),
-                n_ctx=self.model_config.get("n_ctx", 768),
-                n_threads=self.model_config.get("n_threads", 8),
-                n_batch=self.model_config.get("n_batch", 256),
-                temperature=self.model_config.get("temperature", 0.5),
-                max_tokens=self.model_config.get("max_tokens", 256),
-                stop=self.model_config.get("stop", ["Usuario:", "Paciente:", "Human:", "AI:", "Asistente:"]),
-                verbose=self.model_config.get("verbose", True),
-            )
+            # Modelo compartido por todos los agentes; el muestreo viaja en cada llamada
+            modelo = registro_modelos.obtener(self.model_config)
+            self.llm = modelo.bind(**self._parametros_llm())
             self.chain = self.prompt_template | self.llm
-            from langchain_core.runnables import RunnableWithMessageHistory
             self.agente = RunnableWithMessageHistory(
                 self.chain,
                 get_session_history=self.history_factory,
@@ -68,6 +116,186 @@ class Agente(ABC):
                 history_messages_key="history",
             )
 
+    def resumir_historial(self, resumen: str, mensajes: List[BaseMessage]) -> str:
+        """
+        Integra en el resumen de la sesión los mensajes que salen de la ventana
+        reciente (modo resumen de Conversation). Se ejecuta en segundo plano.
+        
+        Args:
+            resumen: Resumen acumulado hasta ahora (vacío la primera vez)
+            mensajes: Mensajes a incorporar, del más antiguo al más reciente
+            
+        Returns:
+            Resumen actualizado
+        """
+        if self._prompt_resumen is None:
+            with open(RUTA_PROMPT_RESUMEN, encoding="utf-8") as f:
+                self._prompt_resumen = f.read()
+        turnos = "\n".join(
+            f"{'Paciente' if m.type == 'human' else 'Asistente'}: {m.content}" for m in mensajes
+        )
+        prompt = self._prompt_resumen.format(resumen=resumen or "(ninguno)", mensajes=turnos)
+        # Sin historial ni prefijo KV: una llamada suelta al modelo compartido
+        return registro_modelos.obtener(self.model_config).invoke(
+            prompt,
+            temperature=0.1,
+            max_tokens=self.model_config.get("resumen_max_tokens", 160),
+            stop=STOP_POR_DEFECTO,
+        )
+
+    def precargar_prefijo(self):
+        """Evalúa por adelantado el prefijo estático del prompt (ver utils/prefijos.py)."""
+        if not self.model_config.get("kv_prefijo", True):
+            return
+        self._ensure_llm()
+        registro_modelos.obtener(self.model_config).precargar_prefijo(self.prefijo_estatico)
+
+    def _agente_con_gramatica(self, gramatica: str) -> RunnableWithMessageHistory:
+        """Cadena del agente con historial cuya generación está restringida por una gramática GBNF."""
+        self._ensure_llm()
+        return RunnableWithMessageHistory(
+            self.prompt_template | self.llm.bind(gramatica=gramatica),
+            get_session_history=self.history_factory,
+            input_messages_key="input",
+            history_messages_key="history",
+        )
+
+    def preguntar_con_gramatica(self, session_id: str, pregunta: str, gramatica: str) -> str:
+        """
+        Como `preguntar`, pero el modelo solo puede emitir texto que cumpla la
+        gramática GBNF (ver utils/gramaticas.py) y se detiene al completarla.
+        No pasa por la caché de respuestas.
+        
+        Args:
+            session_id: ID de la sesión
+            pregunta: Pregunta del usuario
+            gramatica: Gramática GBNF de la respuesta
+            
+        Returns:
+            Texto generado, siempre conforme a la gramática
+        """
+        os.makedirs("historiales", exist_ok=True)
+        return self._agente_con_gramatica(gramatica).invoke(
+            {"input": pregunta},
+            config={"configurable": {"session_id": session_id}}
+        )
+
+    async def preguntar_con_gramatica_async(self, session_id: str, pregunta: str, gramatica: str) -> str:
+        """Versión asíncrona de `preguntar_con_gramatica`."""
+        if self.agente is None:
+            await en_ejecutor("llm", self._ensure_llm)
+        os.makedirs("historiales", exist_ok=True)
+        return await self._agente_con_gramatica(gramatica).ainvoke(
+            {"input": pregunta},
+            config={"configurable": {"session_id": session_id}}
+        )
+
+    def preguntar_json(self, session_id: Optional[str], pregunta: str, esquema: Dict[str, Any]) -> Any:
+        """
+        Pide al modelo un JSON que cumpla el esquema y lo devuelve ya parseado.
+        
+        Args:
+            session_id: ID de la sesión, o None para no usar historial (ver `preguntar_sin_historial`)
+            pregunta: Pregunta del usuario
+            esquema: Esquema JSON de la respuesta
+        """
+        gramatica = gramatica_json(esquema)
+        if session_id is None:
+            return json.loads(self.preguntar_sin_historial(pregunta, gramatica))
+        return json.loads(self.preguntar_con_gramatica(session_id, pregunta, gramatica))
+
+    def _prompt_sin_historial(self, pregunta: str) -> str:
+        # Mismo prompt que con historial, con el historial vacío: el prefijo KV sigue sirviendo
+        return self.prompt_template.format(history="", input=pregunta)
+
+    def preguntar_sin_historial(self, pregunta: str, gramatica: Optional[str] = None,
+                                al_encolar: Optional[Callable[[], Any]] = None) -> str:
+        """
+        Llamada suelta para tareas de un solo paso (clasificar, extraer datos):
+        no lee ni escribe historial ni toca el disco, así que el prompt mide
+        siempre lo mismo y no mezcla mensajes de distintos usuarios.
+        No pasa por la caché de respuestas.
+        
+        Args:
+            pregunta: Pregunta o instrucción
+            gramatica: Gramática GBNF opcional de la respuesta (ver utils/gramaticas.py)
+            al_encolar: Se llama cuando la petición ya está en la cola del modelo
+            
+        Returns:
+            Texto generado
+        """
+        self._ensure_llm()
+        llm = self.llm.bind(gramatica=gramatica) if gramatica else self.llm
+        extra = {"al_encolar": al_encolar} if al_encolar else {}
+        return llm.invoke(self._prompt_sin_historial(pregunta), **extra)
+
+    async def preguntar_sin_historial_async(self, pregunta: str, gramatica: Optional[str] = None,
+                                            al_encolar: Optional[Callable[[], Any]] = None) -> str:
+        """Versión asíncrona de `preguntar_sin_historial`."""
+        if self.llm is None:
+            await en_ejecutor("llm", self._ensure_llm)
+        llm = self.llm.bind(gramatica=gramatica) if gramatica else self.llm
+        extra = {"al_encolar": al_encolar} if al_encolar else {}
+        return await llm.ainvoke(self._prompt_sin_historial(pregunta), **extra)
+
+    def prellenar(self, session_id: str) -> Optional[Future]:
+        """
+        Encola en el modelo la evaluación del prompt de la sesión hasta la
+        pregunta (prompt de sistema e historial), sin generar. Si la siguiente
+        petición de la sesión llega a este agente, solo se evalúa la pregunta.
+        Los agentes que no responden con el LLM lo desactivan con
+        "prellenado": False en model_config.
+        
+        Returns:
+            Future del trabajo en la cola del modelo (ver LlamaCppCompartido.prellenar), o None
+        """
+        if not self.model_config.get("prellenado", True):
+            return None
+        self._ensure_llm()
+        marca = "\x00"
+        # El mismo texto que compone RunnableWithMessageHistory con este historial
+        texto = self.prompt_template.format(history=self.history_factory(session_id).messages, input=marca)
+        prefijo = self.prefijo_estatico if self.model_config.get("kv_prefijo", True) else None
+        return registro_modelos.obtener(self.model_config).prellenar(
+            texto[:texto.index(marca)], prefijo, session_id
+        )
+
+    def _clave_cache(self, session_id: str, pregunta: str) -> Optional[str]:
+        """
+        Clave de la caché de respuestas, o None si esta petición no se puede cachear.
+
+        Solo se cachea en agentes con `cache_respuestas` en model_config, con
+        temperatura baja, y cuando la sesión aún no tiene historial: la respuesta
+        depende entonces solo de la pregunta, el prompt y el muestreo.
+        """
+        if not self.model_config.get("cache_respuestas"):
+            return None
+        params = self._parametros_llm()
+        if params.get("temperature", 0) > CACHE_TEMPERATURA_MAXIMA:
+            return None
+        if self.history_factory(session_id).messages:
+            return None
+
+        model_path = os.path.abspath(self.model_config["model_path"])
+        try:
+            modelo = f"{model_path}:{os.path.getsize(model_path)}"
+        except OSError:
+            modelo = model_path
+        muestreo = {k: v for k, v in params.items() if k in PARAMETROS_MUESTREO}
+        return cache_respuestas.clave(pregunta, f"{modelo}|{self.prompt_template.template}", muestreo)
+
+    def _respuesta_cacheada(self, session_id: str, clave: Optional[str], pregunta: str) -> Optional[str]:
+        """Busca la respuesta en caché y, si existe, registra el turno en el historial."""
+        if clave is None:
+            return None
+        respuesta = cache_respuestas.obtener(clave)
+        if respuesta is not None:
+            print(f"[CACHE] Respuesta de {self.config.get('nombre', 'agente')} servida desde caché")
+            self.history_factory(session_id).add_messages(
+                [HumanMessage(content=pregunta), AIMessage(content=respuesta)]
+            )
+        return respuesta
+
     def iniciar_interaccion(self, session_id: str, mensaje: str) -> Optional[Dict[str, Any]]:
         """
         Método opcional para preparar la interacción antes de preguntar.
@@ -96,17 +324,87 @@ class Agente(ABC):
         """
         self._ensure_llm()
         os.makedirs("historiales", exist_ok=True)
+        clave = self._clave_cache(session_id, pregunta)
+        respuesta = self._respuesta_cacheada(session_id, clave, pregunta)
+        if respuesta is not None:
+            return respuesta
+
         respuesta = self.agente.invoke(
             {"input": pregunta},
             config={"configurable": {"session_id": session_id}}
         )
+        if clave is not None and isinstance(respuesta, str):
+            cache_respuestas.guardar(clave, respuesta)
+        return respuesta
+
+    def preguntar_stream(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Iterator[str]:
+        """
+        Versión en streaming de `preguntar`: entrega la respuesta por fragmentos
+        a medida que el modelo los genera. El mensaje completo se guarda en el
+        historial de la sesión al terminar el stream, igual que con `preguntar`.
+        
+        Args:
+            session_id: ID de la sesión
+            pregunta: Pregunta del usuario
+            metadata: Metadata opcional de iniciar_interaccion
+            
+        Yields:
+            Fragmentos de texto de la respuesta
+        """
+        self._ensure_llm()
+        os.makedirs("historiales", exist_ok=True)
+        clave = self._clave_cache(session_id, pregunta)
+        respuesta = self._respuesta_cacheada(session_id, clave, pregunta)
+        if respuesta is not None:
+            yield respuesta
+            return
+
+        texto = ""
+        for fragmento in self.agente.stream(
+            {"input": pregunta},
+            config={"configurable": {"session_id": session_id}}
+        ):
+            if fragmento:
+                texto += fragmento
+                yield fragmento
+        # Solo llega aquí si el stream se consumió completo
+        if clave is not None:
+            cache_respuestas.guardar(clave, texto)
+
+    async def preguntar_async(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Dict:
+        """
+        Versión asíncrona de `preguntar`. La generación se encola en el planificador
+        del modelo y se espera sin ocupar ningún hilo; solo la primera carga del
+        modelo se hace en el pool "llm" (ver utils/ejecutores.py).
+        
+        Args:
+            session_id: ID de la sesión
+            pregunta: Pregunta del usuario
+            metadata: Metadata opcional de iniciar_interaccion
+            
+        Returns:
+            Respuesta del agente
+        """
+        if self.agente is None:
+            await en_ejecutor("llm", self._ensure_llm)
+        os.makedirs("historiales", exist_ok=True)
+        clave = self._clave_cache(session_id, pregunta)
+        respuesta = self._respuesta_cacheada(session_id, clave, pregunta)
+        if respuesta is not None:
+            return respuesta
+
+        respuesta = await self.agente.ainvoke(
+            {"input": pregunta},
+            config={"configurable": {"session_id": session_id}}
+        )
+        if clave is not None and isinstance(respuesta, str):
+            cache_respuestas.guardar(clave, respuesta)
         return respuesta
 
 
 if __name__ == "__main__":
     # === Cargar variables de entorno y rutas antes de crear la clase ===
     load_dotenv()
-    hf_tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")
     model_config = {
         "model_path": os.getenv("MODEL_PATH"),
         "n_threads": int(os.getenv("LLAMA_N_THREADS", os.cpu_count() or 8)),
@@ -114,7 +412,6 @@ if __name__ == "__main__":
         "n_ctx": int(os.getenv("LLAMA_N_CTX", 2048)),
         "max_messages": 3,
         "token_buffer": 256,
-        "tokenizer": lambda x: len(hf_tokenizer.encode(x)),  # Tokenizer compatible
         # Puedes agregar más parámetros si lo deseas
     }
     config = {
@@ -134,5 +431,7 @@ if __name__ == "__main__":
         pregunta = input("Paciente: ")
         if pregunta.lower() in ("salir", "exit"):
             break
-        respuesta = agenteMedico.preguntar(session_id, pregunta)
-        print(f"Asistente: {respuesta}\n")
\ No newline at end of file
+        print("Asistente: ", end="", flush=True)
+        for fragmento in agenteMedico.preguntar_stream(session_id, pregunta):
+            print(fragmento, end="", flush=True)
+        print("\n")
\ No newline at end of file
@@ -1,8 +1,52 @@
 import os
-from typing import Optional, Dict
+import sys
+from typing import Optional, Dict, Iterator
 from dotenv import load_dotenv
 
 from agents.agente import Agente
+from utils.ejecutores import en_ejecutor
+from utils.calentamiento import Componente
+from utils.memoria import Recurso, gestor_memoria
+
+# Modelos de visión (nombre, módulo), en el orden en que se precargan
+MODELOS_VISION = [
+    ("vision_torax", "vision.chest_x_rays.inference"),
+    ("vision_piel", "vision.skin_disease.inference"),
+    ("vision_quemaduras", "vision.burn.inference"),
+    ("vision_cerebro", "vision.brain_tumor.inference"),
+]
+
+
+def _importar_herramientas():
+    from vision import (
+        analizar_tumor_cerebral,
+        analizar_quemaduras,
+        analizar_radiografia_torax,
+        analizar_enfermedad_piel
+    )
+    return [analizar_tumor_cerebral,
+            analizar_quemaduras,
+            analizar_radiografia_torax,
+            analizar_enfermedad_piel
+            ]
+
+
+def _info_modelo(modulo: str) -> Optional[Dict]:
+    # Sin importar el módulo: si no se ha importado, el modelo no está cargado
+    modulo = sys.modules.get(modulo)
+    return modulo.model_info() if modulo is not None else None
+
+
+def _registrar_modelos_vision() -> None:
+    """Pone los modelos de visión bajo el presupuesto de memoria (ver utils/memoria.py)."""
+    for nombre, modulo in MODELOS_VISION:
+        gestor_memoria.registrar(Recurso(
+            nombre=nombre,
+            descargar=lambda modulo=modulo: sys.modules[modulo].unload_model(),
+            cargado=lambda modulo=modulo: _info_modelo(modulo) is not None,
+            ultimo_uso=lambda modulo=modulo: (_info_modelo(modulo) or {}).get("last_used", 0.0),
+            tamano=lambda modulo=modulo: (_info_modelo(modulo) or {}).get("bytes"),
+        ))
 
 
 class AgenteAnalisisImagenes(Agente):
@@ -29,23 +73,16 @@ class AgenteAnalisisImagenes(Agente):
             "prompts",
             "analisis_imagenes.txt"
         )
-        from vision import (
-            analizar_tumor_cerebral,
-            analizar_quemaduras,
-            analizar_radiografia_torax,
-            analizar_enfermedad_piel
-        )
 
         super().__init__(
             config=config,
             model_config=model_config,
-            system_prompt_path=prompt_path,
-            tools=[analizar_tumor_cerebral,
-                   analizar_quemaduras,
-                   analizar_radiografia_torax,
-                   analizar_enfermedad_piel
-                   ]
+            system_prompt_path=prompt_path
         )
+        # Importar vision carga TensorFlow y PyTorch: se hace al usar las herramientas
+        # o durante el calentamiento, no al construir el agente
+        self.herramientas = Componente("herramientas_vision", _importar_herramientas)
+        _registrar_modelos_vision()
 
     def iniciar_interaccion(self, session_id: str, imagen_path: str) -> Optional[Dict]:
         """Inicia la interacción con el agente de análisis de imágenes"""
@@ -56,24 +93,50 @@ class AgenteAnalisisImagenes(Agente):
             "image_path": imagen_path
         }
     
-    def preguntar(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Dict:
-        self._ensure_llm()
-        os.makedirs("historiales", exist_ok=True)
-
+    def _entradas(self, pregunta: str, metadata: Optional[Dict]) -> Dict:
+        """Prepara la entrada de la cadena, ejecutando las herramientas si hay imagen."""
         # Si metadata contiene la ruta de imagen, usar herramientas directamente
         if metadata and "image_path" in metadata:
             resultados = []
-            for herramienta in self.tools:
+            for herramienta in self.herramientas.obtener():
                 resultados.append(herramienta.run(metadata["image_path"]))
-            respuesta = self.agente.invoke(
-                {"input": pregunta, "results": resultados},
-                config={"configurable": {"session_id": session_id}}
-            )
-            return respuesta
+            # Cada herramienta carga su modelo si no lo estaba
+            gestor_memoria.ajustar()
+            return {"input": pregunta, "results": resultados}
 
         # Caso estándar de conversación LLM
+        return {"input": pregunta}
+
+    def preguntar(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Dict:
+        self._ensure_llm()
+        os.makedirs("historiales", exist_ok=True)
+
         respuesta = self.agente.invoke(
-            {"input": pregunta},
+            self._entradas(pregunta, metadata),
+            config={"configurable": {"session_id": session_id}}
+        )
+        return respuesta
+
+    def preguntar_stream(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Iterator[str]:
+        self._ensure_llm()
+        os.makedirs("historiales", exist_ok=True)
+
+        for fragmento in self.agente.stream(
+            self._entradas(pregunta, metadata),
+            config={"configurable": {"session_id": session_id}}
+        ):
+            if fragmento:
+                yield fragmento
+
+    async def preguntar_async(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Dict:
+        if self.agente is None:
+            await en_ejecutor("llm", self._ensure_llm)
+        os.makedirs("historiales", exist_ok=True)
+
+        # Los modelos de visión van en su propio pool para no frenar las consultas de texto
+        entradas = await en_ejecutor("vision", self._entradas, pregunta, metadata)
+        respuesta = await self.agente.ainvoke(
+            entradas,
             config={"configurable": {"session_id": session_id}}
         )
         return respuesta
@@ -2,12 +2,13 @@ import os
 import re
 import json
 import requests
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Tuple, Iterator
 from dotenv import load_dotenv
 from dataclasses import dataclass
 from math import radians, cos, sin, asin, sqrt
 
 from agents.agente import Agente
+from utils.ejecutores import en_ejecutor
 
 @dataclass
 class CentroMedico:
@@ -40,6 +41,8 @@ class AgenteBusquedaCentros(Agente):
             "n_ctx": int(os.getenv("LLAMA_N_CTX", 2048)),
             "temperature": 0.3, 
             "max_tokens": 512,
+            # La búsqueda responde sin el LLM: prellenar su prompt sería trabajo perdido
+            "prellenado": False,
             "verbose": True
         }
 
@@ -377,6 +380,58 @@ class AgenteBusquedaCentros(Agente):
             }
         }
     
+    def _coordenadas_usuario(self, parametros: Dict) -> Tuple[float, float]:
+        """Coordenadas de la ubicación pedida, o el centro de Medellín si no se indicó o no se encontró"""
+        lat_usuario, lng_usuario = 6.2442, -75.5812  
+        
+        if parametros['ubicacion']:
+            coords = self._obtener_coordenadas_direccion(parametros['ubicacion'])
+            if coords:
+                lat_usuario, lng_usuario = coords
+                print(f"[BUSQUEDA] Coordenadas obtenidas: {lat_usuario}, {lng_usuario}")
+            else:
+                print(f"[BUSQUEDA] No se pudieron obtener coordenadas para: {parametros['ubicacion']}")
+        
+        return lat_usuario, lng_usuario
+    
+    def _responder_busqueda(self, parametros: Dict, lat_usuario: float, lng_usuario: float) -> Dict:
+        """Filtra, ordena y formatea los centros alrededor de las coordenadas del usuario"""
+        # Filtrar centros según criterios
+        centros_filtrados = self._filtrar_centros(self.centros_locales, parametros)
+        
+        # Filtrar por distancia
+        centros_en_radio = []
+        for centro in centros_filtrados:
+            distancia = self._calcular_distancia(lat_usuario, lng_usuario, centro.lat, centro.lng)
+            if distancia <= parametros['radio_km']:
+                centro.distancia_km = distancia
+                centros_en_radio.append(centro)
+        
+        # Ordenar por distancia
+        centros_ordenados = self._ordenar_por_distancia(centros_en_radio, lat_usuario, lng_usuario)
+        
+        # Formatear respuesta
+        respuesta = self._formatear_respuesta(centros_ordenados, parametros)
+        
+        return {
+            "output": respuesta,
+            "metadata": {
+                "tipo": "busqueda_centros",
+                "centros_encontrados": len(centros_ordenados),
+                "parametros_busqueda": parametros,
+                "coordenadas_usuario": [lat_usuario, lng_usuario]
+            }
+        }
+    
+    def _respuesta_error(self, error: Exception) -> Dict:
+        error_msg = f"Error en búsqueda de centros: {str(error)}"
+        print(f"[ERROR BUSQUEDA] {error_msg}")
+        
+        return {
+            "output": f"❌ {error_msg}\n\nPor favor, intenta reformular tu búsqueda.",
+            "metadata": {"tipo": "error", "error": error_msg}
+        }
+    
     def preguntar(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Dict:
         """Procesa consulta de búsqueda de centros médicos"""
         try:
@@ -384,51 +439,26 @@ class AgenteBusquedaCentros(Agente):
             parametros = self._extraer_parametros_busqueda(pregunta)
             
             # Obtener coordenadas del usuario si se especifica ubicación
-            lat_usuario, lng_usuario = 6.2442, -75.5812  
-            
-            if parametros['ubicacion']:
-                coords = self._obtener_coordenadas_direccion(parametros['ubicacion'])
-                if coords:
-                    lat_usuario, lng_usuario = coords
-                    print(f"[BUSQUEDA] Coordenadas obtenidas: {lat_usuario}, {lng_usuario}")
-                else:
-                    print(f"[BUSQUEDA] No se pudieron obtener coordenadas para: {parametros['ubicacion']}")
-            
-            # Filtrar centros según criterios
-            centros_filtrados = self._filtrar_centros(self.centros_locales, parametros)
+            lat_usuario, lng_usuario = self._coordenadas_usuario(parametros)
             
-            # Filtrar por distancia
-            centros_en_radio = []
-            for centro in centros_filtrados:
-                distancia = self._calcular_distancia(lat_usuario, lng_usuario, centro.lat, centro.lng)
-                if distancia <= parametros['radio_km']:
-                    centro.distancia_km = distancia
-                    centros_en_radio.append(centro)
-            
-            # Ordenar por distancia
-            centros_ordenados = self._ordenar_por_distancia(centros_en_radio, lat_usuario, lng_usuario)
-            
-            # Formatear respuesta
-            respuesta = self._formatear_respuesta(centros_ordenados, parametros)
-            
-            return {
-                "output": respuesta,
-                "metadata": {
-                    "tipo": "busqueda_centros",
-                    "centros_encontrados": len(centros_ordenados),
-                    "parametros_busqueda": parametros,
-                    "coordenadas_usuario": [lat_usuario, lng_usuario]
-                }
-            }
+            return self._responder_busqueda(parametros, lat_usuario, lng_usuario)
             
         except Exception as e:
-            error_msg = f"Error en búsqueda de centros: {str(e)}"
-            print(f"[ERROR BUSQUEDA] {error_msg}")
+            return self._respuesta_error(e)
+
+    async def preguntar_async(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Dict:
+        """Igual que `preguntar`, con la consulta a Nominatim en el pool de E/S"""
+        try:
+            parametros = self._extraer_parametros_busqueda(pregunta)
+            lat_usuario, lng_usuario = await en_ejecutor("io", self._coordenadas_usuario, parametros)
+            return self._responder_busqueda(parametros, lat_usuario, lng_usuario)
             
-            return {
-                "output": f"❌ {error_msg}\n\nPor favor, intenta reformular tu búsqueda.",
-                "metadata": {"tipo": "error", "error": error_msg}
-            }
+        except Exception as e:
+            return self._respuesta_error(e)
+
+    def preguntar_stream(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Iterator[str]:
+        """La búsqueda no genera texto con el LLM: se entrega en un solo fragmento"""
+        yield self.preguntar(session_id, pregunta, metadata)["output"]
     
     def buscar_por_especialidad(self, session_id: str, especialidad: str, ubicacion: str = None) -> Dict:
         """Método específico para buscar por especialidad"""
@@ -1,10 +1,24 @@
 import os
-from typing import Optional, Dict
+from typing import Optional, Dict, Iterator
 from dotenv import load_dotenv
 from agents.agente import Agente
+from utils.ejecutores import en_ejecutor, obtener_ejecutor
+from utils.retencion import retencion
+from utils.sesiones import AlmacenSesiones
 import json
 import time
 
+# Datos que se extraen del texto del paciente; todos opcionales
+ESQUEMA_DATOS_PACIENTE = {
+    "type": "object",
+    "properties": {
+        "nombre": {"type": "string"},
+        "edad": {"type": "integer"},
+        "telefono": {"type": "string"},
+        "motivo": {"type": "string"},
+    },
+}
+
 class AgenteContactoMedico(Agente):
     def __init__(self):
         load_dotenv()
@@ -19,6 +33,10 @@ class AgenteContactoMedico(Agente):
             "n_ctx": int(os.getenv("LLAMA_N_CTX", 2048)),
             "temperature": 0.4,
             "max_tokens": 1024,
+            # Decodificación especulativa para los resúmenes largos (ver utils/especulativo.py)
+            "draft_model": os.getenv("LLAMA_DRAFT_MODEL"),
+            # El primer mensaje abre el formulario de datos, sin el LLM
+            "prellenado": False,
             "verbose": True
         }
         prompt_path = os.path.join(
@@ -42,8 +60,8 @@ class AgenteContactoMedico(Agente):
             "horario": "Lunes a Viernes 8:00 AM - 6:00 PM"
         }
         
-        # Estado de sesiones para manejo de flujo
-        self.sesiones_estado = {}
+        # Estado de sesiones para manejo de flujo (caduca solo, ver utils/sesiones.py)
+        self.sesiones_estado = AlmacenSesiones("contacto_medico")
 
     def iniciar_interaccion(self, session_id: str, mensaje: str) -> Dict:
         """Inicia la interacción y determina si necesita datos del paciente"""
@@ -75,8 +93,6 @@ class AgenteContactoMedico(Agente):
                 "timestamp": time.time()
             }
         
-        estado_sesion = self.sesiones_estado[session_id]
-        
         # Manejar diferentes pasos del flujo
         if metadata and metadata.get("accion") == "recopilar_datos":
             return self._manejar_recopilacion_datos(session_id, pregunta, metadata)
@@ -87,6 +103,31 @@ class AgenteContactoMedico(Agente):
         else:
             return self._generar_resumen_medico(session_id, pregunta)
 
+    def preguntar_stream(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Iterator[str]:
+        """Solo el resumen médico se genera con el LLM; los pasos del formulario se entregan completos"""
+        if metadata and metadata.get("accion") in ("recopilar_datos", "confirmar_envio"):
+            yield self.preguntar(session_id, pregunta, metadata)["output"]
+            return
+
+        if session_id not in self.sesiones_estado:
+            self.sesiones_estado[session_id] = {
+                "paso": "generar_resumen",
+                "datos_recopilados": {},
+                "mensaje_original": pregunta,
+                "timestamp": time.time()
+            }
+
+        try:
+            yield "\n📋 **Resumen Médico Generado**\n\n"
+            yield from super().preguntar_stream(session_id, self._prompt_resumen(pregunta))
+            yield self._pie_resumen()
+        except Exception as e:
+            yield f"❌ Error generando resumen médico: {str(e)}"
+
+    async def preguntar_async(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Dict:
+        """El flujo del formulario es síncrono: se ejecuta completo en el pool "llm" """
+        return await en_ejecutor("llm", self.preguntar, session_id, pregunta, metadata)
+
     def _manejar_recopilacion_datos(self, session_id: str, pregunta: str, metadata: Dict) -> Dict:
         """Maneja el proceso de recopilación de datos del paciente"""
         estado = self.sesiones_estado[session_id]
@@ -105,6 +146,7 @@ class AgenteContactoMedico(Agente):
         elif paso == "recopilando":
             datos_extraidos = self._extraer_datos_paciente(pregunta)
             estado["datos_recopilados"].update(datos_extraidos)
+            self.sesiones_estado[session_id] = estado
             
             # Verificar si faltan datos
             campos_faltantes = self._verificar_datos_completos(estado["datos_recopilados"])
@@ -137,29 +179,24 @@ Extrae SOLO la información que esté claramente presente:
 - Teléfono (con formato)
 - Motivo de consulta/síntomas
 
-Responde en formato JSON válido únicamente con los campos encontrados.
+Responde en formato JSON válido únicamente con los campos encontrados (nombre, edad, telefono, motivo).
 """
         
         try:
-            # Usar el LLM para extraer información
-            respuesta_llm = super().preguntar(
-                session_id="extraccion_temp",
-                pregunta=prompt_extraccion
+            # La gramática del esquema obliga al LLM a emitir un JSON válido;
+            # sin historial: cada extracción ve solo el texto de este paciente
+            datos = self.preguntar_json(
+                session_id=None,
+                pregunta=prompt_extraccion,
+                esquema=ESQUEMA_DATOS_PACIENTE
             )
-            
-            # Intentar parsear la respuesta como JSON
-            respuesta_texto = respuesta_llm.get("output", "").strip()
-            
-            import re
-            json_match = re.search(r'\{.*\}', respuesta_texto, re.DOTALL)
-            if json_match:
-                datos = json.loads(json_match.group())
-                return datos
+            # Descartar campos vacíos para que cuenten como faltantes
+            return {campo: valor for campo, valor in datos.items() if valor not in ("", None)}
             
         except Exception as e:
             print(f"[WARNING] Error en extracción automática: {e}")
         
-        # Fallback: extracción manual básica
+        # Sin LLM disponible: extracción manual básica
         return self._extraccion_manual_basica(texto)
 
     def _extraccion_manual_basica(self, texto: str) -> Dict:
@@ -301,9 +338,9 @@ El médico se pondrá en contacto con usted directamente en el teléfono proporc
             }
         }
 
-    def _generar_resumen_medico(self, session_id: str, pregunta: str) -> Dict:
-        """Genera un resumen médico cuando se hace una consulta directa"""
-        prompt_resumen = f"""
+    def _prompt_resumen(self, pregunta: str) -> str:
+        """Prompt para generar el resumen de una consulta directa"""
+        return f"""
 Como asistente médico, genera un resumen profesional del siguiente caso para enviar a un médico:
 
 Consulta del paciente: "{pregunta}"
@@ -316,20 +353,10 @@ Genera un resumen médico estructurado que incluya:
 
 Mantén un tono profesional y médico.
 """
-        
-        try:
-            respuesta_llm = super().preguntar(
-                session_id=session_id,
-                pregunta=prompt_resumen
-            )
-            
-            resumen_generado = respuesta_llm.get("output", "")
-            
-            return {
-                "output": f"""
-📋 **Resumen Médico Generado**
 
-{resumen_generado}
+    def _pie_resumen(self) -> str:
+        """Instrucciones que acompañan al resumen generado"""
+        return f"""
 
 ---
 **Para enviar este caso a un médico para segunda opinión:**
@@ -337,7 +364,20 @@ Mantén un tono profesional y médico.
 - O proporcione más detalles si es necesario
 
 **Médico disponible:** {self.datos_medico['nombre']} ({self.datos_medico['especialidad']})
-""",
+"""
+
+    def _generar_resumen_medico(self, session_id: str, pregunta: str) -> Dict:
+        """Genera un resumen médico cuando se hace una consulta directa"""
+        try:
+            respuesta_llm = super().preguntar(
+                session_id=session_id,
+                pregunta=self._prompt_resumen(pregunta)
+            )
+            
+            resumen_generado = respuesta_llm.get("output", "")
+            
+            return {
+                "output": f"\n📋 **Resumen Médico Generado**\n\n{resumen_generado}{self._pie_resumen()}",
                 "metadata": {
                     "tipo": "resumen_generado",
                     "resumen": resumen_generado,
@@ -373,15 +413,13 @@ Mantén un tono profesional y médico.
 **Nota:** Este caso requiere evaluación médica profesional para diagnóstico y tratamiento adecuado.
 """
 
-    def limpiar_sesiones_expiradas(self, timeout_segundos: int = 3600):
-        """Limpia sesiones que han expirado"""
-        tiempo_actual = time.time()
-        sesiones_expiradas = []
-        
-        for session_id, info in self.sesiones_estado.items():
-            if tiempo_actual - info["timestamp"] > timeout_segundos:
-                sesiones_expiradas.append(session_id)
-        
-        for session_id in sesiones_expiradas:
-            del self.sesiones_estado[session_id]
-            print(f"[CONTACTO_MEDICO] Sesión expirada limpiada: {session_id}")
\ No newline at end of file
+    def limpiar_sesiones_expiradas(self, sesiones_activas=()):
+        """
+        Retira un lote de sesiones expiradas, también su historial en disco.
+        Las que siguen activas en el orquestador (con otro agente) solo pierden
+        el estado de la recogida de datos.
+        """
+        for session_id in self.sesiones_estado.expirar():
+            if session_id not in sesiones_activas:
+                obtener_ejecutor("io").submit(retencion.borrar_sesion, session_id)
+            print(f"[CONTACTO_MEDICO] Sesión expirada limpiada: {session_id}")
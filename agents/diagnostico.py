@@ -1,9 +1,15 @@
 import os
-from typing import Optional, Dict
+from typing import Optional, Dict, Iterator
 from dotenv import load_dotenv
 
 from agents.agente import Agente
 
+ADVERTENCIA_MEDICA = (
+    "\n\n⚠️ Importante: Este es un diagnóstico preliminar basado en la información proporcionada. "
+    "No sustituye una consulta médica profesional. Si los síntomas persisten o empeoran, "
+    "busque atención médica inmediata."
+)
+
 class AgenteDiagnostico(Agente):
     def __init__(self):
         load_dotenv()
@@ -46,9 +52,17 @@ class AgenteDiagnostico(Agente):
         if isinstance(respuesta, str):
             respuesta = {"output": respuesta}
         # Añadir advertencia médica estándar
-        respuesta["output"] += (
-            "\n\n⚠️ Importante: Este es un diagnóstico preliminar basado en la información proporcionada. "
-            "No sustituye una consulta médica profesional. Si los síntomas persisten o empeoran, "
-            "busque atención médica inmediata."
-        )
-        return respuesta
\ No newline at end of file
+        respuesta["output"] += ADVERTENCIA_MEDICA
+        return respuesta
+
+    def preguntar_stream(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Iterator[str]:
+        yield from super().preguntar_stream(session_id, pregunta)
+        yield ADVERTENCIA_MEDICA
+
+    async def preguntar_async(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Dict:
+        respuesta = await super().preguntar_async(session_id, pregunta)
+        if isinstance(respuesta, str):
+            respuesta = {"output": respuesta}
+        # Añadir advertencia médica estándar
+        respuesta["output"] += ADVERTENCIA_MEDICA
+        return respuesta
@@ -14,7 +14,6 @@ from pathlib import Path
 
 import fitz  
 from langchain_core.prompts import PromptTemplate
-from langchain_community.llms import LlamaCpp
 from langchain_core.runnables import RunnableWithMessageHistory
 
 # Agregar el directorio raíz al path
@@ -22,7 +21,25 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 root_dir = os.path.dirname(current_dir)
 sys.path.insert(0, root_dir)
 
-from utils.conversation import Conversation
+from utils.conversation import cache_conversaciones
+from utils.modelos import registro_modelos
+from utils.gramaticas import gramatica_json
+from utils.tokenizacion import obtener_tokenizador
+
+# Extensiones que acepta el agente; se consultan sin tener que cargar el modelo
+FORMATOS_SOPORTADOS = [".pdf"]
+
+# Formato de la clasificación del examen; el clasificador solo puede emitir JSON con esta forma
+ESQUEMA_CLASIFICACION = {
+    "type": "object",
+    "properties": {
+        "tipo_examen": {"type": "string"},
+        "categoria": {"type": "string"},
+        "especialidad": {"type": "string"},
+        "confianza": {"type": "number"},
+    },
+    "required": ["tipo_examen", "categoria", "especialidad", "confianza"],
+}
 
 class MedicalPDFAnalysisAgent:
     """Agente especializado en análisis de PDFs de exámenes médicos"""
@@ -47,19 +64,29 @@ class MedicalPDFAnalysisAgent:
         self.work_dir.mkdir(exist_ok=True)
         
     
+    def _model_path(self) -> str:
+        """Ruta del GGUF: la de model_config o, si no la trae, la de MODEL_PATH"""
+        return self.model_config.get("model_path") or os.getenv("MODEL_PATH")
+
     def _setup_llm(self):
-        """Configura el modelo LLaMA para análisis médico"""
-        self.llm = LlamaCpp(
-            model_path= os.getenv("MODEL_PATH", r"C:\Users\HP\Downloads\llama-2-7b-chat.Q4_K_M.gguf"),
-            n_ctx=self.model_config.get("n_ctx", 4096), 
-            n_threads=self.model_config.get("n_threads", 8),
-            n_batch=self.model_config.get("n_batch", 1024),
-            temperature=0.2, 
-            max_tokens=1024, 
+        """Configura el modelo LLaMA para análisis médico (compartido con los demás agentes)"""
+        # Decodificación especulativa opcional para los informes largos (ver utils/especulativo.py)
+        draft_model = self.model_config.get("draft_model", os.getenv("LLAMA_DRAFT_MODEL"))
+        modelo = registro_modelos.obtener({
+            "model_path": self._model_path(),
+            "n_ctx": self.model_config.get("n_ctx", 4096),
+            "n_threads": self.model_config.get("n_threads", 8),
+            "n_batch": self.model_config.get("n_batch", 1024),
+            "draft_model": draft_model,
+            "verbose": False,
+        })
+        self.llm = modelo.bind(
+            temperature=0.2,
+            max_tokens=1024,
             top_p=0.9,
             repeat_penalty=1.1,
             stop=["Paciente:", "PACIENTE:", "Usuario:", "USUARIO:", "Human:", "HUMAN:"],
-            verbose=False,
+            draft_model=draft_model,
         )
     
     def _setup_prompts(self):
@@ -163,14 +190,20 @@ EXPLICACIÓN PARA EL PACIENTE:"""
     
     def _setup_chains(self):
         """Configura las cadenas de procesamiento"""
-        self.classifier_chain = self.exam_classifier_prompt | self.llm
+        self.classifier_chain = self.exam_classifier_prompt | self.llm.bind(
+            gramatica=gramatica_json(ESQUEMA_CLASIFICACION),
+            max_tokens=256,
+        )
         self.analysis_chain = self.exam_analysis_prompt | self.llm
         self.explanation_chain = self.patient_explanation_prompt | self.llm
         
-        self.history_factory = lambda session_id: Conversation(
-            file_path=f"pdf_analysis/session_{session_id}.json",
-            max_tokens=self.model_config.get("n_ctx", 4096) - 1024,
-            buffer_extra=1024
+        tokenizador = obtener_tokenizador(self._model_path())
+        self.history_factory = lambda session_id: cache_conversaciones.obtener(
+            file_path=f"pdf_analysis/session_{session_id}.jsonl",
+            max_context_tokens=self.model_config.get("n_ctx", 4096),
+            token_buffer=1024,
+            tokenizer=tokenizador,
+            tokenizer_name=tokenizador.nombre
         )
     
     def extract_text_from_pdf(self, pdf_path: str) -> Tuple[str, Dict[str, Any]]:
@@ -251,15 +284,11 @@ EXPLICACIÓN PARA EL PACIENTE:"""
             
             response = self.classifier_chain.invoke({"exam_text": exam_text})
             
-            # Intentar parsear la respuesta como JSON
-            try:
-                classification = json.loads(response.strip())
-                classification["success"] = True
-                classification["timestamp"] = datetime.now().isoformat()
-                return classification
-            except json.JSONDecodeError:
-                # Si no es JSON válido, extraer información manualmente
-                return self._parse_classification_text(response)
+            # La gramática garantiza JSON válido con todos los campos
+            classification = json.loads(response)
+            classification["success"] = True
+            classification["timestamp"] = datetime.now().isoformat()
+            return classification
                 
         except Exception as e:
             return {
@@ -272,38 +301,6 @@ EXPLICACIÓN PARA EL PACIENTE:"""
                 "timestamp": datetime.now().isoformat()
             }
     
-    def _parse_classification_text(self, response_text: str) -> Dict[str, Any]:
-        """Parsea la respuesta de clasificación cuando no es JSON"""
-        classification = {
-            "success": True,
-            "tipo_examen": "examen médico",
-            "categoria": "general",
-            "especialidad": "medicina general",
-            "confianza": 0.5,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        response_lower = response_text.lower()
-        
-        # Tipos de examen comunes
-        exam_types = {
-            "hemograma": ["hemograma", "hematología", "conteo sanguíneo"],
-            "química sanguínea": ["química", "glucosa", "colesterol", "triglicéridos"],
-            "orina": ["orina", "urinálisis", "examen de orina"],
-            "radiografía": ["radiografía", "rayos x", "rx"],
-            "ecografía": ["ecografía", "ultrasonido", "eco"],
-            "tomografía": ["tomografía", "tac", "ct scan"],
-            "resonancia": ["resonancia", "rmn", "mri"]
-        }
-        
-        for exam_type, keywords in exam_types.items():
-            if any(keyword in response_lower for keyword in keywords):
-                classification["tipo_examen"] = exam_type
-                classification["confianza"] = 0.8
-                break
-        
-        return classification
-    
     def analyze_exam(self, exam_text: str, exam_type: str, patient_context: str = "", session_id: str = None) -> Dict[str, Any]:
         """
         Realiza análisis médico completo del examen
@@ -506,7 +503,7 @@ EXPLICACIÓN PARA EL PACIENTE:"""
     
     def get_supported_formats(self) -> List[str]:
         """Obtiene los formatos de archivo soportados"""
-        return [".pdf"]
+        return list(FORMATOS_SOPORTADOS)
     
     def get_system_info(self) -> Dict[str, Any]:
         """Obtiene información del sistema de análisis"""
@@ -1,5 +1,5 @@
 import os
-from typing import Optional, Dict
+from typing import Optional, Dict, Iterator
 from dotenv import load_dotenv
 
 from agents.agente import Agente
@@ -18,6 +18,8 @@ class AgenteExplicacionMedica(Agente):
             "n_ctx": int(os.getenv("LLAMA_N_CTX", 2048)),
             "temperature": 0.5,
             "max_tokens": 256,
+            # Las definiciones se repiten mucho entre pacientes (ver utils/cache_respuestas.py)
+            "cache_respuestas": True,
             "verbose": True
         }
         prompt_path = os.path.join(
@@ -40,6 +42,23 @@ class AgenteExplicacionMedica(Agente):
         if "ejemplo" not in respuesta["output"].lower():
             respuesta["output"] += "\n\nEjemplo: " + self._generar_ejemplo(pregunta)
         return respuesta
+
+    def preguntar_stream(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Iterator[str]:
+        texto = ""
+        for fragmento in super().preguntar_stream(session_id, pregunta):
+            texto += fragmento
+            yield fragmento
+        if "ejemplo" not in texto.lower():
+            yield "\n\nEjemplo: " + self._generar_ejemplo(pregunta)
+
+    async def preguntar_async(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Dict:
+        respuesta = await super().preguntar_async(session_id, pregunta)
+        if isinstance(respuesta, str):
+            respuesta = {"output": respuesta}
+        # Añadir ejemplo si la explicación es muy técnica
+        if "ejemplo" not in respuesta["output"].lower():
+            respuesta["output"] += "\n\nEjemplo: " + self._generar_ejemplo(pregunta)
+        return respuesta
     
     def _generar_ejemplo(self, termino: str) -> str:
         """Genera un ejemplo simple para el término médico."""
@@ -1,9 +1,11 @@
 import os
-from typing import Optional, Dict
+from typing import Optional, Dict, Iterator
 from dotenv import load_dotenv
 
 from agents.agente import Agente
-from agents.exams import create_pdf_analysis_agent
+from utils.ejecutores import en_ejecutor
+from utils.calentamiento import Componente
+from agents.exams import create_pdf_analysis_agent, FORMATOS_SOPORTADOS
 
 class AgenteInterpretacionExamenes(Agente):
     def __init__(self):
@@ -36,10 +38,14 @@ class AgenteInterpretacionExamenes(Agente):
             system_prompt_path=prompt_path
         )
         
-        # Inicializar el agente de análisis de PDFs
-        self.pdf_agent = create_pdf_analysis_agent(model_config)
+        # Agente de análisis de PDFs: se crea al primer uso o durante el calentamiento
+        self._pdf_agent = Componente("analisis_pdf", lambda: create_pdf_analysis_agent(model_config))
         self.pending_files = {}  # Para almacenar archivos pendientes por sesión
     
+    @property
+    def pdf_agent(self):
+        return self._pdf_agent.obtener()
+
     def iniciar_interaccion(self, session_id: str, mensaje: str) -> Optional[Dict]:
         """Inicia la interacción con el agente de interpretación de exámenes"""
         print(f"[INTERPRETACION_EXAMENES] Iniciando interacción para sesión {session_id}")
@@ -49,7 +55,7 @@ class AgenteInterpretacionExamenes(Agente):
             "tipo": "interpretacion_examenes",
             "session_id": session_id,
             "tiene_pdf_pendiente": session_id in self.pending_files,
-            "archivos_soportados": self.pdf_agent.get_supported_formats()
+            "archivos_soportados": list(FORMATOS_SOPORTADOS)
         }
         
         return metadata
@@ -145,20 +151,7 @@ class AgenteInterpretacionExamenes(Agente):
         # Si hay un análisis previo en la sesión, usarlo como contexto
         if session_id in self.pending_files:
             resultado_previo = self.pending_files[session_id]
-            contexto_analisis = self._extraer_contexto_analisis(resultado_previo)
-            
-            # Combinar la pregunta con el contexto del análisis
-            pregunta_completa = f"""
-CONTEXTO DEL ANÁLISIS PREVIO:
-{contexto_analisis}
-
-PREGUNTA DEL USUARIO:
-{pregunta}
-
-Por favor, responde la pregunta basándote en el análisis médico previo.
-"""
-            
-            respuesta = super().preguntar(session_id, pregunta_completa, metadata)
+            respuesta = super().preguntar(session_id, self._pregunta_con_contexto(session_id, pregunta), metadata)
             
             # Agregar metadatos indicando que se usó contexto previo
             if isinstance(respuesta, dict):
@@ -190,6 +183,30 @@ Para analizar un examen médico, puedes:
 ¿Qué examen médico te gustaría que analice?""",
             "metadata": {"tipo": "instrucciones_uso"}
         }
+
+    def preguntar_stream(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Iterator[str]:
+        """Solo las preguntas sobre un análisis previo se generan con el LLM"""
+        if session_id in self.pending_files and not (metadata and metadata.get("pdf_path")):
+            yield from super().preguntar_stream(session_id, self._pregunta_con_contexto(session_id, pregunta), metadata)
+            return
+        yield self.preguntar(session_id, pregunta, metadata)["output"]
+
+    async def preguntar_async(self, session_id: str, pregunta: str, metadata: Optional[Dict] = None) -> Dict:
+        """El análisis de PDF y la conversación sobre él son síncronos: se ejecutan en el pool "llm" """
+        return await en_ejecutor("llm", self.preguntar, session_id, pregunta, metadata)
+
+    def _pregunta_con_contexto(self, session_id: str, pregunta: str) -> str:
+        """Combina la pregunta con el contexto del análisis previo de la sesión"""
+        contexto_analisis = self._extraer_contexto_analisis(self.pending_files[session_id])
+        return f"""
+CONTEXTO DEL ANÁLISIS PREVIO:
+{contexto_analisis}
+
+PREGUNTA DEL USUARIO:
+{pregunta}
+
+Por favor, responde la pregunta basándote en el análisis médico previo.
+"""
     
     def _formatear_respuesta_pdf(self, resultado: Dict) -> str:
         """Formatea la respuesta del análisis de PDF para el usuario"""
@@ -4,9 +4,109 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import time
 import re
-from typing import Dict, Optional
+import asyncio
+import threading
+import functools
+import contextvars
+from datetime import date
+from typing import Dict, List, Optional, Iterator, Any, Callable
 from utils.funcionalidades import FuncionalidadMedica
-from agents.agente import Agente
+from agents.agente import Agente, ruta_historial
+from langchain_core.messages import HumanMessage, AIMessage
+from utils.ejecutores import en_ejecutor, obtener_ejecutor
+from utils.gramaticas import gramatica_opciones
+from utils.retencion import retencion
+from utils.conversation import instantanea_historial
+from utils.sesiones import AlmacenSesiones, TTL as TTL_SESION
+from utils.intenciones import ClasificadorIntenciones
+from utils.clasificador_ngramas import ClasificadorEstadistico
+from utils.cache_clasificacion import CacheClasificacion, SIN_PATRON
+
+# El clasificador LLM solo puede responder con una de estas palabras
+FUNCIONALIDADES_VALIDAS = [f.key for f in FuncionalidadMedica]
+GRAMATICA_FUNCIONALIDAD = gramatica_opciones(FUNCIONALIDADES_VALIDAS)
+
+RUTA_PROMPT_CLASIFICADOR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts", "clasificador.txt"
+)
+
+# Mientras clasifica el LLM, evaluar ya el prompt del agente más probable (ver _prellenado_al_encolar)
+PRELLENADO_ESPECULATIVO = os.getenv("PRELLENADO_ESPECULATIVO", "0").lower() in ("1", "true", "si", "sí")
+
+# Mensajes con varias peticiones ("tengo este hemograma y ¿dónde hay un hospital cerca?")
+# se reparten entre sus agentes en paralelo y las respuestas se unen (ver _procesar_intenciones)
+MULTI_INTENCION = os.getenv("MULTI_INTENCION", "0").lower() in ("1", "true", "si", "sí")
+MAX_INTENCIONES = int(os.getenv("MAX_INTENCIONES", 3))
+# Puntuación de patrones que necesita cada parte del mensaje para contar como petición propia
+MULTI_INTENCION_PUNTUACION = int(os.getenv("MULTI_INTENCION_PUNTUACION", 1))
+# Separadores de las partes de un mensaje: fin de frase o conector entre oraciones
+_CONECTORES = re.compile(r"[.;!?¿¡]+|,?\s+\b(?:y|e|además|ademas|también|tambien|aparte)\b\s+", re.IGNORECASE)
+# Pool de utils/ejecutores.py de cada agente en la versión síncrona; la búsqueda no usa el LLM
+EJECUTOR_FUNCIONALIDAD = {FuncionalidadMedica.BUSCADOR_CENTROS.key: "io"}
+_FUNCIONALIDADES = {f.key: f for f in FuncionalidadMedica}
+
+# Marcas de que un mensaje continúa la conversación (ver _es_pregunta_contextual)
+PATRONES_CONTEXTUALES = [
+    # Empieza con un conector: "y cómo se trata?", "pero duele más de noche", "entonces qué hago"
+    r'^[¿¡]?\s*(y|pero|entonces|además|también|aparte)\b',
+    r'^[¿¡]?\s*(gracias|ok|okay|vale|entendido|perfecto)\b.*\b(y|pero)\b',
+    # Pide seguir con lo mismo
+    r'\b(qué|que)\s*más\b',
+    r'\bexpl[ií]ca(me|lo)?\s*mejor\b',
+    r'\bmás\s*detalles?\b',
+    r'\b(otra|una)\s*pregunta\s*(más|sobre\s*(eso|esto|lo\s*mismo))\b',
+    # Anáforas: se refiere a lo dicho antes
+    r'\b(eso|esto|ese|esa|esos|esas|aquello)\b',
+    r'\blo\s*(anterior|mismo|de\s*antes)\b',
+    r'\blo\s*que\s*(me\s*)?(dijiste|dijo|mencionaste|comentaste|explicaste)\b',
+    r'\b(dicho|dicha|mencionado|mencionada)s?\b',
+]
+# Puntuación de patrones con la que un mensaje contextual cambia igualmente de
+# agente si apunta con claridad a otra funcionalidad ("y ¿dónde hay un hospital cerca?")
+PUNTUACION_CAMBIO_AGENTE = int(os.getenv("PUNTUACION_CAMBIO_AGENTE", 2))
+
+# Días de métricas de enrutamiento que se conservan en memoria
+DIAS_METRICAS = 30
+
+# Patrones para clasificación por palabras clave
+PATRONES_CLASIFICACION = {
+    FuncionalidadMedica.ANALISIS_IMAGENES.key: [
+        r'\b(radiografía|radiografia|rx|rayos?\s*x|tomografía|tomografia|tac|resonancia|rmn|ultrasonido|ecografía|ecografia|imagen|placa)\b',
+        r'\b(scanner|escáner|escaneo)\b',
+        r'\b(imagen\s*médica|imágenes\s*médicas)\b'
+    ],
+    FuncionalidadMedica.INTERPRETACION_EXAMENES.key: [
+        r'\b(examen|análisis|analisis|laboratorio|resultado|prueba)\b',
+        r'\b(sangre|orina|heces|biopsia|cultivo)\b',
+        r'\b(hemograma|glicemia|colesterol|triglicéridos|creatinina|urea)\b',
+        r'\b(examenes?\s*de\s*laboratorio)\b',
+        r'\b(valores?\s*de\s*referencia)\b'
+    ],
+    FuncionalidadMedica.BUSCADOR_CENTROS.key: [
+        r'\b(centro\s*médico|hospital|clínica|clinica|consultorio)\b',
+        r'\b(ubicación|ubicacion|dirección|direccion|dónde|donde)\b',
+        r'\b(cerca|cercano|próximo|proximo)\b',
+        r'\b(buscar|encontrar|localizar)\b.*\b(médico|doctor|hospital|clínica)\b'
+    ],
+    FuncionalidadMedica.CONTACTO_MEDICO.key: [
+        r'\b(contactar|llamar|comunicar|hablar)\b.*\b(médico|doctor)\b',
+        r'\b(segunda\s*opinión|segunda\s*opinion|opinión\s*médica|opinion\s*medica)\b',
+        r'\b(consultar\s*médico|consultar\s*doctor|consulta\s*médica|consulta\s*medica)\b',
+        r'\b(enviar\s*caso|enviar\s*a\s*médico|enviar\s*a\s*doctor)\b',
+        r'\b(necesito\s*médico|necesito\s*doctor|quiero\s*médico|quiero\s*doctor)\b',
+        r'\b(cita|consulta|appointment)\b',
+        r'\b(teléfono|telefono|número|numero)\b.*\b(médico|doctor)\b',
+        r'\b(emergencia|urgente|urgencia)\b',
+        r'\b(derivar|referir|remitir)\b.*\b(médico|doctor|especialista)\b',
+        r'\b(evaluación\s*médica|evaluacion\s*medica|revisión\s*médica|revision\s*medica)\b'
+    ],
+    FuncionalidadMedica.EXPLICACION.key: [
+        r'\b(qué\s*es|que\s*es|explicar|explicación|explicacion)\b',
+        r'\b(significa|significado|definición|definicion)\b',
+        r'\b(cómo\s*funciona|como\s*funciona|mecanismo)\b',
+        r'\b(información|informacion|detalles)\b.*\b(enfermedad|condición|condicion|patología|patologia)\b'
+    ]
+}
 
 class Orquestador:
     def __init__(self):
@@ -30,112 +130,131 @@ class Orquestador:
         self.agentes = {}
         self.agente_clasificador = self._inicializar_agente_clasificador()
 
-        self.sesiones_activas = {}  # {session_id: {"funcionalidad": str, "ultimo_agente": Agente, "timestamp": float}}
-        self.timeout_sesion = 3600  # 1 hora de timeout por defecto
-        
-        # Patrones para clasificación por palabras clave
-        self.patrones_clasificacion = {
-            FuncionalidadMedica.ANALISIS_IMAGENES.key: [
-                r'\b(radiografía|radiografia|rx|rayos?\s*x|tomografía|tomografia|tac|resonancia|rmn|ultrasonido|ecografía|ecografia|imagen|placa)\b',
-                r'\b(scanner|escáner|escaneo)\b',
-                r'\b(imagen\s*médica|imágenes\s*médicas)\b'
-            ],
-            FuncionalidadMedica.INTERPRETACION_EXAMENES.key: [
-                r'\b(examen|análisis|analisis|laboratorio|resultado|prueba)\b',
-                r'\b(sangre|orina|heces|biopsia|cultivo)\b',
-                r'\b(hemograma|glicemia|colesterol|triglicéridos|creatinina|urea)\b',
-                r'\b(examenes?\s*de\s*laboratorio)\b',
-                r'\b(valores?\s*de\s*referencia)\b'
-            ],
-            FuncionalidadMedica.BUSCADOR_CENTROS.key: [
-                r'\b(centro\s*médico|hospital|clínica|clinica|consultorio)\b',
-                r'\b(ubicación|ubicacion|dirección|direccion|dónde|donde)\b',
-                r'\b(cerca|cercano|próximo|proximo)\b',
-                r'\b(buscar|encontrar|localizar)\b.*\b(médico|doctor|hospital|clínica)\b'
-            ],
-             FuncionalidadMedica.CONTACTO_MEDICO.key: [
-                r'\b(contactar|llamar|comunicar|hablar)\b.*\b(médico|doctor)\b',
-                r'\b(segunda\s*opinión|segunda\s*opinion|opinión\s*médica|opinion\s*medica)\b',
-                r'\b(consultar\s*médico|consultar\s*doctor|consulta\s*médica|consulta\s*medica)\b',
-                r'\b(enviar\s*caso|enviar\s*a\s*médico|enviar\s*a\s*doctor)\b',
-                r'\b(necesito\s*médico|necesito\s*doctor|quiero\s*médico|quiero\s*doctor)\b',
-                r'\b(cita|consulta|appointment)\b',
-                r'\b(teléfono|telefono|número|numero)\b.*\b(médico|doctor)\b',
-                r'\b(emergencia|urgente|urgencia)\b',
-                r'\b(derivar|referir|remitir)\b.*\b(médico|doctor|especialista)\b',
-                r'\b(evaluación\s*médica|evaluacion\s*medica|revisión\s*médica|revision\s*medica)\b'
-            ],
-            FuncionalidadMedica.EXPLICACION.key: [
-                r'\b(qué\s*es|que\s*es|explicar|explicación|explicacion)\b',
-                r'\b(significa|significado|definición|definicion)\b',
-                r'\b(cómo\s*funciona|como\s*funciona|mecanismo)\b',
-                r'\b(información|informacion|detalles)\b.*\b(enfermedad|condición|condicion|patología|patologia)\b'
-            ]
+        # {session_id: {"funcionalidad": str, "timestamp": float}}, en memoria o en SQLite (SESIONES_BACKEND)
+        self.timeout_sesion = TTL_SESION  # 1 hora de timeout por defecto
+        self.sesiones_activas = AlmacenSesiones(
+            "orquestador", ttl=self.timeout_sesion, al_expirar=self._al_expirar_sesion
+        )
+        
+        # Patrones para clasificación por palabras clave, indexados por las palabras con
+        # las que empiezan: el mensaje se recorre una vez (ver utils/intenciones.py)
+        self.patrones_clasificacion = {k: list(v) for k, v in PATRONES_CLASIFICACION.items()}
+        self.clasificador_patrones = ClasificadorIntenciones(self.patrones_clasificacion)
+        # Nivel intermedio entre los patrones y el LLM (n-gramas + regresión logística)
+        self.clasificador_estadistico = ClasificadorEstadistico()
+        # Clasificaciones ya decididas, por mensaje normalizado; se invalida si cambian los patrones o el prompt
+        self.cache_clasificacion = CacheClasificacion()
+        self.cache_clasificacion.configurar(self.patrones_clasificacion, [RUTA_PROMPT_CLASIFICADOR])
+
+        # Cómo se decidió el agente de cada mensaje, por día (ver metricas_enrutamiento)
+        self._metricas_enrutamiento: Dict[str, Dict[str, int]] = {}
+        self._lock_metricas = threading.Lock()
+        self._metricas_prellenado = {
+            "lanzados": 0, "aciertos": 0, "fallos": 0, "cancelados": 0, "errores": 0, "tokens": 0,
+            "segundos": 0.0, "segundos_ahorrados": 0.0, "segundos_desperdiciados": 0.0,
         }
     
+    def _al_expirar_sesion(self, session_id: str, datos: Dict):
+        """Borra el historial en disco de una sesión expirada (se ejecuta en el pool "io")"""
+        retencion.borrar_sesion(session_id)
+    
     def _limpiar_sesiones_expiradas(self):
-        """Limpia sesiones que han expirado"""
-        tiempo_actual = time.time()
-        sesiones_expiradas = []
-        
-        for session_id, info in self.sesiones_activas.items():
-            if tiempo_actual - info["timestamp"] > self.timeout_sesion:
-                sesiones_expiradas.append(session_id)
-        
-        for session_id in sesiones_expiradas:
-            del self.sesiones_activas[session_id]
-            print(f"[SESION] Sesión expirada: {session_id}")
+        """Retira un lote de sesiones expiradas; su historial se borra en segundo plano"""
+        self.sesiones_activas.expirar()
+
+        # Estado propio de los agentes que lo guardan por sesión (contacto médico)
+        for agente in self.agentes.values():
+            if hasattr(agente, "limpiar_sesiones_expiradas"):
+                agente.limpiar_sesiones_expiradas(self.sesiones_activas)
     
     def _actualizar_sesion(self, session_id: str, funcionalidad: str, agente: Agente):
-        """Actualiza o crea una sesión activa"""
+        """Actualiza o crea una sesión activa (y renueva su caducidad)"""
         self.sesiones_activas[session_id] = {
             "funcionalidad": funcionalidad,
-            "ultimo_agente": agente,
             "timestamp": time.time()
         }
         print(f"[SESION] Sesión actualizada: {session_id} -> {funcionalidad}")
     
     def _obtener_sesion(self, session_id: str) -> Optional[Dict]:
-        """Obtiene información de una sesión activa"""
+        """Obtiene información de una sesión activa, con el agente que la atendió por última vez"""
         self._limpiar_sesiones_expiradas()
-        return self.sesiones_activas.get(session_id)
+        sesion = self.sesiones_activas.get(session_id)
+        if sesion is None:
+            return None
+        # El almacén guarda solo datos serializables; el agente se resuelve aquí
+        return {**sesion, "ultimo_agente": self.agentes.get(sesion["funcionalidad"])}
+    
+    def _funcionalidad_de_sesion(self, session_id: str, mensaje: str) -> Optional[str]:
+        """
+        Enrutamiento por afinidad: si el mensaje continúa la conversación y la
+        sesión sigue viva con un agente registrado, se le envía directamente a
+        ese agente sin clasificar. None si hay que clasificar.
+        """
+        if not self._es_pregunta_contextual(mensaje):
+            return None
+        sesion = self._obtener_sesion(session_id)
+        if sesion is None or sesion["ultimo_agente"] is None:
+            return None
+        # Los patrones apuntan con claridad a otra funcionalidad: se clasifica
+        coincidencias = self.clasificador_patrones.clasificar(mensaje)
+        if coincidencias and coincidencias[0].intencion != sesion["funcionalidad"] \
+                and coincidencias[0].puntuacion >= PUNTUACION_CAMBIO_AGENTE \
+                and (len(coincidencias) == 1 or coincidencias[1].puntuacion < coincidencias[0].puntuacion):
+            print(f"[SESION] {session_id}: el mensaje apunta a {coincidencias[0].intencion}, "
+                  f"no se mantiene {sesion['funcionalidad']}")
+            return None
+        print(f"[SESION] Continuación de {session_id}: se mantiene {sesion['funcionalidad']}")
+        self._contar_enrutamiento("sesion")
+        return sesion["funcionalidad"]
+    
+    def _contar_enrutamiento(self, via: str):
+        """Cuenta un mensaje enrutado por `via` (sesion, cache, patrones, estadistico, llm, multi) en el día de hoy."""
+        hoy = date.today().isoformat()
+        with self._lock_metricas:
+            dia = self._metricas_enrutamiento.get(hoy)
+            if dia is None:
+                dia = self._metricas_enrutamiento[hoy] = {
+                    "sesion": 0, "cache": 0, "patrones": 0, "estadistico": 0, "llm": 0, "multi": 0
+                }
+                for viejo in sorted(self._metricas_enrutamiento)[:-DIAS_METRICAS]:
+                    del self._metricas_enrutamiento[viejo]
+            dia[via] += 1
+    
+    def metricas_enrutamiento(self) -> Dict[str, Any]:
+        """
+        Mensajes por vía de enrutamiento y día, con las llamadas al LLM
+        clasificador que se ahorró el enrutamiento por sesión. Estas se estiman
+        con la proporción de clasificaciones de ese día que acabaron en el LLM.
+        """
+        with self._lock_metricas:
+            dias = {dia: dict(cuentas) for dia, cuentas in self._metricas_enrutamiento.items()}
+        for cuentas in dias.values():
+            clasificados = cuentas["cache"] + cuentas["patrones"] + cuentas["estadistico"] + cuentas["llm"]
+            proporcion_llm = cuentas["llm"] / clasificados if clasificados else 0.0
+            cuentas["llm_evitadas"] = round(cuentas["sesion"] * proporcion_llm, 1)
+        with self._lock_metricas:
+            prellenado = dict(self._metricas_prellenado)
+        prellenado["activo"] = PRELLENADO_ESPECULATIVO
+        prellenado["proporcion_desperdicio"] = (
+            round(prellenado["segundos_desperdiciados"] / prellenado["segundos"], 3) if prellenado["segundos"] else 0.0
+        )
+        return {
+            "dias": dias,
+            "clasificador_estadistico": self.clasificador_estadistico.metricas(),
+            "cache_clasificacion": self.cache_clasificacion.metricas(),
+            "prellenado": prellenado,
+        }
     
     def _es_pregunta_contextual(self, mensaje: str) -> bool:
         """
-        Determina si el mensaje es una pregunta contextual que debería 
-        continuar con el mismo agente de la sesión anterior.
-        """
-        # Palabras que indican continuidad en la conversación
-        palabras_contextuales = [
-            r'\b(y\s*)?qué\s*más\b',
-            r'\b(y\s*)?además\b',
-            r'\b(y\s*)?también\b',
-            r'\bexplica\s*mejor\b',
-            r'\bmás\s*detalles?\b',
-            r'\by\s*eso\s*qué\s*significa\b',
-            r'\bpero\b',
-            r'\bentonces\b',
-            r'\by\s*si\b',
-            r'\by\s*cómo\b',
-            r'\by\s*por\s*qué\b',
-            r'\by\s*cuándo\b',
-            r'\bgracias.*y\b',
-            r'\bokay.*y\b',
-            r'\bentendido.*y\b'
-        ]
-        
+        Determina si el mensaje continúa la conversación anterior: empieza con
+        un conector ("y...", "pero...", "entonces..."), pide más de lo mismo
+        ("qué más", "explica mejor") o se refiere a lo ya dicho ("eso", "lo
+        anterior", "lo que dijiste"). Una pregunta corta sin esas marcas
+        ("Qué es diabetes") es un tema nuevo y se clasifica.
+        """
         mensaje_lower = mensaje.lower().strip()
-        
-        # Verificar patrones contextuales
-        for patron in palabras_contextuales:
-            if re.search(patron, mensaje_lower):
-                return True
-        
-        # Verificar si es una pregunta muy corta (probablemente contextual)
-        if len(mensaje.split()) <= 3 and any(palabra in mensaje_lower for palabra in ['qué', 'cómo', 'por qué', 'cuándo', 'dónde']):
-            return True
-        
-        return False
+        return any(re.search(patron, mensaje_lower) for patron in PATRONES_CONTEXTUALES)
     
     def _inicializar_agente_clasificador(self) -> Agente:
         """
@@ -154,19 +273,14 @@ class Orquestador:
             "n_threads": self.model_config.get("n_threads", 8),
             "n_ctx": 1024,
             "temperature": 0.1,
-            "max_tokens": 10
+            # La gramática corta la generación al completar la palabra; esto es solo el tope
+            "max_tokens": 16
         }
 
-        prompt_path = os.path.join(
-            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-            "prompts",
-            "clasificador.txt"
-        )
-
         return Agente(
             config=config,
             model_config=clasificador_config,
-            system_prompt_path=prompt_path
+            system_prompt_path=RUTA_PROMPT_CLASIFICADOR
         )
     
     def registrar_agente(self, funcionalidad: FuncionalidadMedica, agente: Agente):
@@ -185,15 +299,66 @@ class Orquestador:
         Returns:
             str: Funcionalidad detectada o None si no se encuentra
         """
-        mensaje_lower = mensaje.lower()
+        # Una sola pasada; gana la intención con más patrones, no la primera del diccionario
+        coincidencias = self.clasificador_patrones.clasificar(mensaje)
+        if not coincidencias:
+            return None
         
-        # Verificar patrones en orden de especificidad
-        for funcionalidad, patrones in self.patrones_clasificacion.items():
-            for patron in patrones:
-                if re.search(patron, mensaje_lower, re.IGNORECASE):
-                    print(f"[CLASIFICADOR] Patrón encontrado: {patron} -> {funcionalidad}")
-                    return funcionalidad
+        funcionalidad = coincidencias[0].intencion
+        print(f"[CLASIFICADOR] Patrones: "
+              f"{', '.join(f'{c.intencion}={c.puntuacion}' for c in coincidencias)} -> {funcionalidad}")
+        return funcionalidad
+    
+    def _clasificar_estadistico(self, mensaje: str) -> Optional[str]:
+        """
+        Clasifica con el modelo de n-gramas. None si su confianza no llega al
+        umbral (CLASIFICADOR_UMBRAL) o si el modelo no está disponible.
+        """
+        try:
+            funcionalidad = self.clasificador_estadistico.clasificar(mensaje)
+        except Exception as e:
+            print(f"[ERROR CLASIFICADOR] Error en clasificación estadística: {str(e)}")
+            return None
+        return funcionalidad if funcionalidad in FUNCIONALIDADES_VALIDAS else None
+    
+    def actualizar_patrones(self, patrones: Dict[str, list]):
+        """Sustituye los patrones de clasificación e invalida la caché de clasificaciones."""
+        self.patrones_clasificacion = {k: list(v) for k, v in patrones.items()}
+        self.clasificador_patrones = ClasificadorIntenciones(self.patrones_clasificacion)
+        self.cache_clasificacion.configurar(self.patrones_clasificacion, [RUTA_PROMPT_CLASIFICADOR])
+    
+    def _registrar_clasificacion(self, mensaje: str, funcionalidad: str, fuente: str):
+        """Cuenta, guarda en caché y registra (para reentrenar) una clasificación decidida."""
+        self._contar_enrutamiento(fuente)
+        self.cache_clasificacion.guardar(mensaje, funcionalidad, fuente)
+        self.clasificador_estadistico.registrar(mensaje, funcionalidad, fuente, self.cache_clasificacion.version)
+    
+    def _clasificar_sin_llm(self, mensaje: str) -> Optional[str]:
+        """
+        Niveles baratos de la clasificación: caché, patrones y modelo estadístico.
+        None si hace falta consultar al LLM.
+        """
+        cacheada = self.cache_clasificacion.obtener(mensaje)
+        if cacheada is not None and cacheada[0] is not None:
+            funcionalidad, fuente = cacheada
+            print(f"[CLASIFICADOR] Caché ({fuente}): {funcionalidad}")
+            self._contar_enrutamiento("cache")
+            return funcionalidad
         
+        # Un negativo en caché (ningún patrón coincide) se salta la búsqueda
+        if cacheada is None:
+            # Paso 1: Intentar clasificación por patrones (más rápido y confiable)
+            funcionalidad_patron = self._clasificar_por_patrones(mensaje)
+            if funcionalidad_patron:
+                self._registrar_clasificacion(mensaje, funcionalidad_patron, "patrones")
+                return funcionalidad_patron
+            self.cache_clasificacion.guardar(mensaje, None, SIN_PATRON)
+        
+        # Paso 2: Clasificador estadístico (< 1 ms); solo responde si está seguro
+        funcionalidad_estadistica = self._clasificar_estadistico(mensaje)
+        if funcionalidad_estadistica:
+            self._registrar_clasificacion(mensaje, funcionalidad_estadistica, "estadistico")
+            return funcionalidad_estadistica
         return None
     
     def _detectar_funcionalidad_directa(self, mensaje: str) -> Optional[Dict]:
@@ -237,25 +402,143 @@ class Orquestador:
                 }
         return None
 
-    def _determinar_funcionalidad(self, mensaje: str) -> str:
+    def _determinar_funcionalidad(self, mensaje: str, session_id: Optional[str] = None) -> str:
         """
         Determina la funcionalidad solicitada por el usuario usando un enfoque híbrido.
         
         Args:
             mensaje: Mensaje del usuario a analizar
+            session_id: Sesión del mensaje (para el prellenado especulativo)
             
         Returns:
             str: Identificador de la funcionalidad detectada
         """
-        # Paso 1: Intentar clasificación por patrones (más rápido y confiable)
-        funcionalidad_patron = self._clasificar_por_patrones(mensaje)
-        if funcionalidad_patron:
-            return funcionalidad_patron
+        # Pasos 1 y 2: caché, patrones y clasificador estadístico
+        funcionalidad = self._clasificar_sin_llm(mensaje)
+        if funcionalidad:
+            return funcionalidad
+        
+        # Paso 3: Si no hay confianza suficiente, usar el LLM clasificador
+        # (sin historial, y con gramática: solo puede emitir una de las palabras válidas).
+        # Con PRELLENADO_ESPECULATIVO, detrás se encola el prompt del agente más probable
+        especulacion: Dict[str, Any] = {}
+        funcionalidad = None
+        try:
+            respuesta = self.agente_clasificador.preguntar_sin_historial(
+                pregunta=self._prompt_clasificacion(mensaje),
+                gramatica=GRAMATICA_FUNCIONALIDAD,
+                al_encolar=self._prellenado_al_encolar(session_id, mensaje, especulacion)
+            )
+            funcionalidad = self._interpretar_clasificacion(respuesta)
+            if funcionalidad:
+                self._registrar_clasificacion(mensaje, funcionalidad, "llm")
+            
+        except Exception as e:
+            print(f"[ERROR CLASIFICADOR] Error en clasificación LLM: {str(e)}")
+        
+        # Paso 4: Si todo falla, usar diagnóstico por defecto
+        if not funcionalidad:
+            print("[CLASIFICADOR] Usando diagnóstico por defecto")
+            funcionalidad = FuncionalidadMedica.DIAGNOSTICO.key
+        self._resolver_prellenado(especulacion, funcionalidad)
+        return funcionalidad
+    
+    async def _determinar_funcionalidad_async(self, mensaje: str, session_id: Optional[str] = None) -> str:
+        """Versión asíncrona de `_determinar_funcionalidad`."""
+        funcionalidad = self._clasificar_sin_llm(mensaje)
+        if funcionalidad:
+            return funcionalidad
         
-        # Paso 2: Si no se encuentra patrón, usar el LLM clasificador
+        especulacion: Dict[str, Any] = {}
+        funcionalidad = None
         try:
-            # Preparar prompt más específico para el clasificador
-            prompt_clasificacion = f"""
+            respuesta = await self.agente_clasificador.preguntar_sin_historial_async(
+                pregunta=self._prompt_clasificacion(mensaje),
+                gramatica=GRAMATICA_FUNCIONALIDAD,
+                al_encolar=self._prellenado_al_encolar(session_id, mensaje, especulacion)
+            )
+            funcionalidad = self._interpretar_clasificacion(respuesta)
+            if funcionalidad:
+                self._registrar_clasificacion(mensaje, funcionalidad, "llm")
+            
+        except Exception as e:
+            print(f"[ERROR CLASIFICADOR] Error en clasificación LLM: {str(e)}")
+        
+        if not funcionalidad:
+            print("[CLASIFICADOR] Usando diagnóstico por defecto")
+            funcionalidad = FuncionalidadMedica.DIAGNOSTICO.key
+        self._resolver_prellenado(especulacion, funcionalidad)
+        return funcionalidad
+    
+    def _prellenado_al_encolar(self, session_id: Optional[str], mensaje: str,
+                               especulacion: Dict[str, Any]) -> Optional[Callable[[], None]]:
+        """
+        Función que lanza el prellenado especulativo en cuanto la petición del
+        clasificador está en la cola del modelo: así el prellenado va detrás y
+        no la retrasa, y la carga del historial se solapa con la clasificación.
+        None si el modo está desactivado.
+        """
+        if not PRELLENADO_ESPECULATIVO or not session_id:
+            return None
+        
+        def lanzar():
+            try:
+                # Agente más probable: el de la sesión o, si es nueva, el del modelo estadístico
+                sesion = self.sesiones_activas.get(session_id)
+                prevista = (sesion["funcionalidad"] if sesion
+                            else self.clasificador_estadistico.modelo().predecir(mensaje)[0])
+                agente = self.agentes.get(prevista)
+                futuro = agente.prellenar(session_id) if hasattr(agente, "prellenar") else None
+            except Exception as e:
+                print(f"[PRELLENADO] No se pudo lanzar: {str(e)}")
+                return
+            if futuro is not None:
+                especulacion.update(funcionalidad=prevista, futuro=futuro)
+                self._contar_prellenado("lanzados")
+        
+        return lanzar
+    
+    def _resolver_prellenado(self, especulacion: Dict[str, Any], funcionalidad: str):
+        """
+        Tras clasificar: si el prellenado era para otro agente se cancela (o, si
+        ya empezó, se cuenta como trabajo perdido). Si acertó, se cuenta como
+        ahorrado lo que llegó a evaluarse antes de enviar la pregunta al agente.
+        """
+        futuro = especulacion.get("futuro")
+        if futuro is None:
+            return
+        acierto = especulacion["funcionalidad"] == funcionalidad
+        if not acierto and futuro.cancel():
+            self._contar_prellenado("cancelados")
+            return
+        momento = time.monotonic()
+        
+        def terminado(f):
+            try:
+                resultado = f.result()
+            except Exception as e:
+                print(f"[PRELLENADO] Error: {str(e)}")
+                self._contar_prellenado("errores")
+                return
+            duracion = resultado["fin"] - resultado["inicio"]
+            self._contar_prellenado("segundos", duracion)
+            if acierto:
+                self._contar_prellenado("aciertos")
+                self._contar_prellenado("tokens", resultado["tokens"])
+                self._contar_prellenado("segundos_ahorrados", max(0.0, min(resultado["fin"], momento) - resultado["inicio"]))
+            else:
+                self._contar_prellenado("fallos")
+                self._contar_prellenado("segundos_desperdiciados", duracion)
+        
+        futuro.add_done_callback(terminado)
+    
+    def _contar_prellenado(self, clave: str, cantidad: float = 1):
+        with self._lock_metricas:
+            self._metricas_prellenado[clave] += cantidad
+    
+    def _prompt_clasificacion(self, mensaje: str) -> str:
+        """Prompt más específico para el clasificador"""
+        return f"""
             Mensaje del usuario: "{mensaje}"
             
             Clasifica ÚNICAMENTE con una de estas palabras exactas:
@@ -267,34 +550,17 @@ class Orquestador:
             - contacto_medico
             
             Respuesta:"""
-            
-            respuesta = self.agente_clasificador.preguntar(
-                session_id="clasificador_temp",
-                pregunta=prompt_clasificacion
-            )
-            
-            # Limpiar y validar respuesta
-            funcionalidad = str(respuesta).strip().lower()
-            
-            # Remover texto extra y quedarse solo con la palabra clave
-            palabras_validas = [
-                "diagnostico", "analisis_imagenes", "interpretacion_examenes",
-                "explicacion", "buscador_centros", "contacto_medico"
-            ]
-            
-            for palabra in palabras_validas:
-                if palabra in funcionalidad:
-                    print(f"[CLASIFICADOR LLM] Clasificado como: {palabra}")
-                    return palabra
-            
-            print(f"[CLASIFICADOR] Respuesta no válida del LLM: '{funcionalidad}'. Usando diagnóstico por defecto.")
-            
-        except Exception as e:
-            print(f"[ERROR CLASIFICADOR] Error en clasificación LLM: {str(e)}")
+    
+    def _interpretar_clasificacion(self, respuesta) -> Optional[str]:
+        """Valida la respuesta del clasificador. None si no es válida."""
+        # La gramática garantiza una palabra exacta; solo puede fallar si se cortó la generación
+        funcionalidad = str(respuesta).strip()
+        if funcionalidad in FUNCIONALIDADES_VALIDAS:
+            print(f"[CLASIFICADOR LLM] Clasificado como: {funcionalidad}")
+            return funcionalidad
         
-        # Paso 3: Si todo falla, usar diagnóstico por defecto
-        print("[CLASIFICADOR] Usando diagnóstico por defecto")
-        return FuncionalidadMedica.DIAGNOSTICO.key
+        print(f"[CLASIFICADOR] Respuesta no válida del LLM: '{funcionalidad}'. Usando diagnóstico por defecto.")
+        return None
     
     def _es_archivo_pdf(self, mensaje_o_ruta: str) -> bool:
         """
@@ -328,43 +594,85 @@ class Orquestador:
         """
         return bool(re.search(r'\.(jpg|jpeg|png|gif|bmp|tiff|webp)$', mensaje.lower()))
     
-    def procesar_mensaje(self, session_id: Optional[str], mensaje_usuario: str, archivo_path: Optional[str] = None) -> Dict:
+    def _enrutar(self, session_id: str, mensaje_usuario: str, archivo_path: Optional[str] = None) -> Dict:
         """
-        Procesa un mensaje del usuario con detección automática de archivos PDF.
+        Decide qué agente atiende el mensaje y ejecuta su preprocesamiento.
+        
+        Returns:
+            Dict con "resultado" si el mensaje ya quedó resuelto (respuesta por defecto,
+            archivo o error), o con "funcionalidad", "agente" y "metadata" listos
+            para preguntar al agente.
         """
-        if not session_id:
-            session_id = self._generar_session_id()
-
         # Detección directa de funcionalidad y respuesta por defecto
         respuesta_directa = self._detectar_funcionalidad_directa(mensaje_usuario)
         if respuesta_directa:
             respuesta_directa["session_id"] = session_id
-            return respuesta_directa
+            return {"resultado": respuesta_directa}
         
         # Verificar si se envió un archivo PDF
         if archivo_path and self._es_archivo_pdf(archivo_path):
             print(f"[ORQUESTADOR] Archivo PDF detectado: {archivo_path}")
-            return self.procesar_archivo_medico(session_id, archivo_path, mensaje_usuario)
+            return {"resultado": self.procesar_archivo_medico(session_id, archivo_path, mensaje_usuario)}
         
         if archivo_path and self.is_image(archivo_path):
             print(f"[ORQUESTADOR] Imagen médica detectada: {archivo_path}")
-            return self.procesar_imagen_medica(session_id, archivo_path, mensaje_usuario)
+            return {"resultado": self.procesar_imagen_medica(session_id, archivo_path, mensaje_usuario)}
         
         # Verificar si el mensaje hace referencia a un PDF
         if self._es_archivo_pdf(mensaje_usuario):
             print("[ORQUESTADOR] Referencia a PDF en el mensaje")
             funcionalidad = FuncionalidadMedica.INTERPRETACION_EXAMENES.key
         else:
-            # Clasificación normal
-            funcionalidad = self._determinar_funcionalidad(mensaje_usuario)
+            # Continuación de la conversación: mismo agente, sin clasificar
+            funcionalidad = self._funcionalidad_de_sesion(session_id, mensaje_usuario)
+            if funcionalidad is None:
+                # Varias intenciones: cada una a su agente
+                intenciones = self._detectar_intenciones(mensaje_usuario)
+                if intenciones:
+                    return {"intenciones": intenciones}
+                # Clasificación normal
+                funcionalidad = self._determinar_funcionalidad(mensaje_usuario, session_id)
+        
+        return self._preparar_agente(session_id, mensaje_usuario, funcionalidad)
+    
+    async def _enrutar_async(self, session_id: str, mensaje_usuario: str, archivo_path: Optional[str] = None) -> Dict:
+        """Versión asíncrona de `_enrutar`."""
+        respuesta_directa = self._detectar_funcionalidad_directa(mensaje_usuario)
+        if respuesta_directa:
+            respuesta_directa["session_id"] = session_id
+            return {"resultado": respuesta_directa}
+        
+        if archivo_path and self._es_archivo_pdf(archivo_path):
+            print(f"[ORQUESTADOR] Archivo PDF detectado: {archivo_path}")
+            return {"resultado": await self.procesar_archivo_medico_async(session_id, archivo_path, mensaje_usuario)}
+        
+        if archivo_path and self.is_image(archivo_path):
+            print(f"[ORQUESTADOR] Imagen médica detectada: {archivo_path}")
+            return {"resultado": await self.procesar_imagen_medica_async(session_id, archivo_path, mensaje_usuario)}
+        
+        if self._es_archivo_pdf(mensaje_usuario):
+            print("[ORQUESTADOR] Referencia a PDF en el mensaje")
+            funcionalidad = FuncionalidadMedica.INTERPRETACION_EXAMENES.key
+        else:
+            funcionalidad = self._funcionalidad_de_sesion(session_id, mensaje_usuario)
+            if funcionalidad is None:
+                intenciones = self._detectar_intenciones(mensaje_usuario)
+                if intenciones:
+                    return {"intenciones": intenciones}
+                funcionalidad = await self._determinar_funcionalidad_async(mensaje_usuario, session_id)
         
+        # iniciar_interaccion puede leer PDFs, historiales o cargar modelos: fuera del event loop
+        return await en_ejecutor("llm", self._preparar_agente, session_id, mensaje_usuario, funcionalidad)
+    
+    def _preparar_agente(self, session_id: str, mensaje_usuario: str, funcionalidad: str) -> Dict:
+        """Busca el agente de la funcionalidad y ejecuta su `iniciar_interaccion`."""
         print(f"[ORQUESTADOR] Funcionalidad detectada: {funcionalidad}")
         
         # Obtener agente correspondiente
         agente = self.agentes.get(funcionalidad, self.agentes.get(FuncionalidadMedica.DIAGNOSTICO.key))
         
         if not agente:
-            return {
+            return {"resultado": {
                 "session_id": session_id,
                 "funcionalidad": funcionalidad,
                 "respuesta": {
@@ -372,9 +680,9 @@ class Orquestador:
                     "metadata": {"tipo": "error_agente"}
                 },
                 "metadata": {"error": "Agente no registrado"}
-            }
+            }}
         
-        # Paso 1: Iniciar interacción (preprocesamiento si es necesario)
+        # Iniciar interacción (preprocesamiento si es necesario)
         metadata = None
         try:
             if hasattr(agente, 'iniciar_interaccion'):
@@ -388,7 +696,289 @@ class Orquestador:
             
             self._notificar_error(f"Fallo en preprocesamiento: {str(e)}")
         
-        # Paso 2: Pregunta principal
+        # Los siguientes mensajes contextuales de la sesión irán a este agente
+        self._actualizar_sesion(session_id, funcionalidad, agente)
+        return {"funcionalidad": funcionalidad, "agente": agente, "metadata": metadata}
+    
+    def _respuesta_error_procesamiento(self, session_id: str, funcionalidad: str, error: Exception) -> Dict:
+        """Respuesta estándar cuando el agente falla al generar la respuesta."""
+        error_msg = f"Error procesando mensaje: {str(error)}"
+        self._notificar_error(error_msg)
+        
+        return {
+            "session_id": session_id,
+            "funcionalidad": funcionalidad,
+            "respuesta": {
+                "output": f"❌ {error_msg}",
+                "metadata": {"tipo": "error_procesamiento"}
+            },
+            "metadata": {"error": error_msg}
+        }
+    
+    def _detectar_intenciones(self, mensaje: str) -> List[str]:
+        """
+        Funcionalidades de un mensaje con varias peticiones, de mayor a menor
+        puntuación (como mucho MAX_INTENCIONES, una por agente registrado).
+
+        Solo cuenta como petición propia una parte del mensaje (separada por
+        fin de frase o por un conector: "y", "además", "también"...) cuya mejor
+        intención llega a MULTI_INTENCION_PUNTUACION sin empatar con otra. Así
+        "qué significa mi resultado de sangre" no se reparte entre la explicación
+        y la interpretación de exámenes: es una sola parte.
+
+        Lista vacía si no hay al menos dos: el mensaje sigue la clasificación normal.
+        """
+        if not MULTI_INTENCION:
+            return []
+        partes = [parte for parte in _CONECTORES.split(mensaje) if parte and parte.strip()]
+        if len(partes) < 2:
+            return []
+        candidatas = []
+        for parte in partes:
+            coincidencias = self.clasificador_patrones.clasificar(parte)
+            if not coincidencias or coincidencias[0].puntuacion < MULTI_INTENCION_PUNTUACION:
+                continue
+            if len(coincidencias) > 1 and coincidencias[1].puntuacion == coincidencias[0].puntuacion:
+                continue
+            candidatas.append(coincidencias[0])
+        
+        funcionalidades, agentes = [], []
+        for coincidencia in sorted(candidatas, key=lambda c: -c.puntuacion):
+            agente = self.agentes.get(coincidencia.intencion)
+            # Sin agente, o el mismo agente atiende ya otra de las peticiones
+            if agente is None or any(agente is otro for otro in agentes):
+                continue
+            funcionalidades.append(coincidencia.intencion)
+            agentes.append(agente)
+            if len(funcionalidades) == MAX_INTENCIONES:
+                break
+        if len(funcionalidades) < 2:
+            return []
+        print(f"[ORQUESTADOR] Varias intenciones: {', '.join(funcionalidades)}")
+        self._contar_enrutamiento("multi")
+        return funcionalidades
+    
+    def _preparar_intenciones(self, session_id: str, mensaje_usuario: str, funcionalidades: List[str]) -> List[Dict]:
+        """
+        `_preparar_agente` de cada intención. Se recorren de la última a la
+        primera para que la sesión quede asignada a la principal.
+        """
+        rutas = [self._preparar_agente(session_id, mensaje_usuario, f) for f in reversed(funcionalidades)]
+        return list(reversed(rutas))
+    
+    @staticmethod
+    def _seccion(funcionalidad: str, respuesta: Any, segundos: float) -> Dict:
+        """Respuesta de un agente como sección de una respuesta con varias intenciones."""
+        if isinstance(respuesta, dict):
+            output, metadata = respuesta.get("output", ""), respuesta.get("metadata", {})
+        else:
+            output, metadata = str(respuesta), {}
+        return {"funcionalidad": funcionalidad, "output": output, "metadata": metadata, "segundos": round(segundos, 3)}
+    
+    @staticmethod
+    def _encabezado_seccion(funcionalidad: str) -> str:
+        info = _FUNCIONALIDADES.get(funcionalidad)
+        return f"### {info.emoji} {info.label}\n\n" if info else f"### {funcionalidad}\n\n"
+    
+    def _ejecutar_seccion(self, session_id: str, mensaje_usuario: str, ruta: Dict) -> Dict:
+        """Pregunta a un agente de la lista y mide cuánto tarda."""
+        if "resultado" in ruta:
+            return self._seccion(ruta["resultado"]["funcionalidad"], ruta["resultado"]["respuesta"], 0.0)
+        inicio = time.perf_counter()
+        try:
+            respuesta = ruta["agente"].preguntar(
+                session_id=session_id,
+                pregunta=mensaje_usuario,
+                metadata=ruta["metadata"]
+            )
+        except Exception as e:
+            respuesta = self._respuesta_error_procesamiento(session_id, ruta["funcionalidad"], e)["respuesta"]
+        return self._seccion(ruta["funcionalidad"], respuesta, time.perf_counter() - inicio)
+    
+    async def _ejecutar_seccion_async(self, session_id: str, mensaje_usuario: str, ruta: Dict) -> Dict:
+        """Versión asíncrona de `_ejecutar_seccion`."""
+        if "resultado" in ruta:
+            return self._seccion(ruta["resultado"]["funcionalidad"], ruta["resultado"]["respuesta"], 0.0)
+        inicio = time.perf_counter()
+        try:
+            respuesta = await ruta["agente"].preguntar_async(
+                session_id=session_id,
+                pregunta=mensaje_usuario,
+                metadata=ruta["metadata"]
+            )
+        except Exception as e:
+            respuesta = self._respuesta_error_procesamiento(session_id, ruta["funcionalidad"], e)["respuesta"]
+        return self._seccion(ruta["funcionalidad"], respuesta, time.perf_counter() - inicio)
+    
+    def _lanzar_secciones(self, session_id: str, mensaje_usuario: str, rutas: List[Dict]) -> List[Any]:
+        """
+        Envía cada agente a su pool (EJECUTOR_FUNCIONALIDAD, "llm" por defecto),
+        con una copia del contexto actual para que vea la instantánea del historial.
+        """
+        return [
+            obtener_ejecutor(EJECUTOR_FUNCIONALIDAD.get(ruta.get("funcionalidad"), "llm")).submit(
+                contextvars.copy_context().run, self._ejecutar_seccion, session_id, mensaje_usuario, ruta
+            )
+            for ruta in rutas
+        ]
+    
+    @staticmethod
+    def _agente_historial(rutas: List[Dict]) -> Optional[Agente]:
+        """Agente (el de la intención principal si puede) con el que se lee y escribe el historial."""
+        for ruta in rutas:
+            if hasattr(ruta.get("agente"), "history_factory"):
+                return ruta["agente"]
+        return None
+    
+    def _instantanea(self, session_id: str, agente: Optional[Agente]) -> Callable:
+        """
+        Los agentes de las distintas intenciones comparten el historial de la
+        sesión: responden sobre una copia de solo lectura, y después se guarda
+        un único turno (ver `_guardar_turno`). Lee el historial ahora y devuelve
+        la función que crea el `with` que lo activa en el contexto actual.
+        """
+        mensajes = agente.history_factory(session_id).messages if agente else []
+        return functools.partial(instantanea_historial, ruta_historial(session_id), mensajes)
+    
+    def _guardar_turno(self, session_id: str, mensaje_usuario: str, agente: Optional[Agente], texto: str):
+        """Guarda en el historial la pregunta una sola vez y la respuesta unida como un único mensaje."""
+        if agente is None:
+            return
+        try:
+            agente.history_factory(session_id).add_messages(
+                [HumanMessage(content=mensaje_usuario), AIMessage(content=texto)]
+            )
+        except Exception as e:
+            self._notificar_error(f"No se pudo guardar el turno en el historial: {str(e)}")
+    
+    def _combinar_secciones(self, session_id: str, secciones: List[Dict], segundos: float) -> Dict:
+        """
+        Une las secciones en una sola respuesta, en el orden de las intenciones.
+        El tiempo de cada agente va en los metadatos: con la ejecución en paralelo
+        el total se acerca al del más lento, no a la suma.
+        """
+        texto = "\n\n".join(self._encabezado_seccion(s["funcionalidad"]) + s["output"] for s in secciones)
+        suma = sum(s["segundos"] for s in secciones)
+        tiempos = ", ".join(f"{s['funcionalidad']}={s['segundos']:.2f}s" for s in secciones)
+        print(f"[ORQUESTADOR] {len(secciones)} intenciones en {segundos:.2f}s (agentes: {tiempos})")
+        return {
+            "session_id": session_id,
+            "funcionalidad": secciones[0]["funcionalidad"],
+            "respuesta": {
+                "output": texto,
+                "metadata": {"tipo": "multi_intencion", "secciones": secciones}
+            },
+            "metadata": {
+                "intenciones": [s["funcionalidad"] for s in secciones],
+                "segundos": round(segundos, 3),
+                "segundos_secuencial": round(suma, 3)
+            }
+        }
+    
+    def _procesar_intenciones(self, session_id: str, mensaje_usuario: str, funcionalidades: List[str]) -> Dict:
+        """
+        Responde a cada intención con su agente a la vez: la principal en este
+        hilo y las demás en los pools de utils/ejecutores.py. Las que usan el
+        LLM se turnan en su planificador; la búsqueda de centros (HTTP y CPU)
+        corre mientras tanto.
+        """
+        inicio = time.perf_counter()
+        rutas = self._preparar_intenciones(session_id, mensaje_usuario, funcionalidades)
+        agente_historial = self._agente_historial(rutas)
+        with self._instantanea(session_id, agente_historial)():
+            futuros = self._lanzar_secciones(session_id, mensaje_usuario, rutas[1:])
+            secciones = [self._ejecutar_seccion(session_id, mensaje_usuario, rutas[0])]
+        secciones += [futuro.result() for futuro in futuros]
+        resultado = self._combinar_secciones(session_id, secciones, time.perf_counter() - inicio)
+        self._guardar_turno(session_id, mensaje_usuario, agente_historial, resultado["respuesta"]["output"])
+        return resultado
+    
+    def _procesar_intenciones_stream(self, session_id: str, mensaje_usuario: str,
+                                     funcionalidades: List[str]) -> Iterator[Dict]:
+        """
+        Versión en streaming de `_procesar_intenciones`: la intención principal
+        se entrega por fragmentos y cada una de las demás como un fragmento en
+        cuanto termina, en orden. El texto es el mismo que el de la respuesta final.
+        """
+        inicio = time.perf_counter()
+        rutas = self._preparar_intenciones(session_id, mensaje_usuario, funcionalidades)
+        principal = rutas[0]
+        agente_historial = self._agente_historial(rutas)
+        instantanea = self._instantanea(session_id, agente_historial)
+        with instantanea():
+            futuros = self._lanzar_secciones(session_id, mensaje_usuario, rutas[1:])
+        
+        yield {"evento": "inicio", "session_id": session_id, "funcionalidad": funcionalidades[0]}
+        
+        if "resultado" in principal:
+            seccion = self._ejecutar_seccion(session_id, mensaje_usuario, principal)
+            yield {"evento": "fragmento", "texto": self._encabezado_seccion(seccion["funcionalidad"]) + seccion["output"]}
+        else:
+            yield {"evento": "fragmento", "texto": self._encabezado_seccion(principal["funcionalidad"])}
+            texto = ""
+            comienzo = time.perf_counter()
+            try:
+                fragmentos = principal["agente"].preguntar_stream(
+                    session_id=session_id,
+                    pregunta=mensaje_usuario,
+                    metadata=principal["metadata"]
+                )
+                # La instantánea solo mientras avanza el agente: entre fragmentos el
+                # contexto es el de quien consume el stream
+                while True:
+                    with instantanea():
+                        fragmento = next(fragmentos, None)
+                    if fragmento is None:
+                        break
+                    texto += fragmento
+                    yield {"evento": "fragmento", "texto": fragmento}
+            except Exception as e:
+                error = self._respuesta_error_procesamiento(session_id, principal["funcionalidad"], e)
+                fragmento = ("\n\n" if texto else "") + error["respuesta"]["output"]
+                texto += fragmento
+                yield {"evento": "fragmento", "texto": fragmento}
+            seccion = self._seccion(principal["funcionalidad"], texto, time.perf_counter() - comienzo)
+        
+        secciones = [seccion]
+        for futuro in futuros:
+            seccion = futuro.result()
+            secciones.append(seccion)
+            yield {"evento": "fragmento", "texto": "\n\n" + self._encabezado_seccion(seccion["funcionalidad"]) + seccion["output"]}
+        
+        resultado = self._combinar_secciones(session_id, secciones, time.perf_counter() - inicio)
+        self._guardar_turno(session_id, mensaje_usuario, agente_historial, resultado["respuesta"]["output"])
+        yield {"evento": "fin", "resultado": resultado}
+    
+    async def _procesar_intenciones_async(self, session_id: str, mensaje_usuario: str,
+                                          funcionalidades: List[str]) -> Dict:
+        """Versión asíncrona de `_procesar_intenciones`: todos los agentes en el event loop."""
+        inicio = time.perf_counter()
+        rutas = await en_ejecutor("llm", self._preparar_intenciones, session_id, mensaje_usuario, funcionalidades)
+        agente_historial = self._agente_historial(rutas)
+        with self._instantanea(session_id, agente_historial)():
+            # Cada tarea copia el contexto, con la instantánea
+            secciones = await asyncio.gather(
+                *(self._ejecutar_seccion_async(session_id, mensaje_usuario, ruta) for ruta in rutas)
+            )
+        resultado = self._combinar_secciones(session_id, list(secciones), time.perf_counter() - inicio)
+        self._guardar_turno(session_id, mensaje_usuario, agente_historial, resultado["respuesta"]["output"])
+        return resultado
+    
+    def procesar_mensaje(self, session_id: Optional[str], mensaje_usuario: str, archivo_path: Optional[str] = None) -> Dict:
+        """
+        Procesa un mensaje del usuario con detección automática de archivos PDF.
+        """
+        if not session_id:
+            session_id = self._generar_session_id()
+
+        ruta = self._enrutar(session_id, mensaje_usuario, archivo_path)
+        if "resultado" in ruta:
+            return ruta["resultado"]
+        if "intenciones" in ruta:
+            return self._procesar_intenciones(session_id, mensaje_usuario, ruta["intenciones"])
+        funcionalidad, agente, metadata = ruta["funcionalidad"], ruta["agente"], ruta["metadata"]
+        
+        # Pregunta principal
         try:
             respuesta = agente.preguntar(
                 session_id=session_id,
@@ -404,18 +994,87 @@ class Orquestador:
             }
             
         except Exception as e:
-            error_msg = f"Error procesando mensaje: {str(e)}"
-            self._notificar_error(error_msg)
+            return self._respuesta_error_procesamiento(session_id, funcionalidad, e)
+    
+    def procesar_mensaje_stream(self, session_id: Optional[str], mensaje_usuario: str, archivo_path: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Versión en streaming de `procesar_mensaje`.
+        
+        Yields:
+            Eventos en orden:
+            - {"evento": "inicio", "session_id", "funcionalidad"} cuando se conoce el agente
+            - {"evento": "fragmento", "texto"} por cada fragmento generado
+            - {"evento": "fin", "resultado"} con el mismo dict que devuelve `procesar_mensaje`
+        """
+        if not session_id:
+            session_id = self._generar_session_id()
+
+        ruta = self._enrutar(session_id, mensaje_usuario, archivo_path)
+        if "resultado" in ruta:
+            yield {"evento": "fin", "resultado": ruta["resultado"]}
+            return
+        if "intenciones" in ruta:
+            yield from self._procesar_intenciones_stream(session_id, mensaje_usuario, ruta["intenciones"])
+            return
+        funcionalidad, agente, metadata = ruta["funcionalidad"], ruta["agente"], ruta["metadata"]
+        
+        yield {"evento": "inicio", "session_id": session_id, "funcionalidad": funcionalidad}
+        
+        texto = ""
+        try:
+            for fragmento in agente.preguntar_stream(
+                session_id=session_id,
+                pregunta=mensaje_usuario,
+                metadata=metadata
+            ):
+                texto += fragmento
+                yield {"evento": "fragmento", "texto": fragmento}
+            
+            resultado = {
+                "session_id": session_id,
+                "funcionalidad": funcionalidad,
+                "respuesta": {"output": texto},
+                "metadata": metadata if metadata else {}
+            }
+        except Exception as e:
+            resultado = self._respuesta_error_procesamiento(session_id, funcionalidad, e)
+        
+        yield {"evento": "fin", "resultado": resultado}
+    
+    async def procesar_mensaje_async(self, session_id: Optional[str], mensaje_usuario: str, archivo_path: Optional[str] = None) -> Dict:
+        """
+        Versión asíncrona de `procesar_mensaje`.
+        
+        Las llamadas al LLM se esperan sobre el planificador del modelo y el trabajo
+        bloqueante (visión, PDF, HTTP) va a los pools de utils/ejecutores.py, de modo
+        que un solo event loop atiende muchas sesiones a la vez.
+        """
+        if not session_id:
+            session_id = self._generar_session_id()
+
+        ruta = await self._enrutar_async(session_id, mensaje_usuario, archivo_path)
+        if "resultado" in ruta:
+            return ruta["resultado"]
+        if "intenciones" in ruta:
+            return await self._procesar_intenciones_async(session_id, mensaje_usuario, ruta["intenciones"])
+        funcionalidad, agente, metadata = ruta["funcionalidad"], ruta["agente"], ruta["metadata"]
+        
+        try:
+            respuesta = await agente.preguntar_async(
+                session_id=session_id,
+                pregunta=mensaje_usuario,
+                metadata=metadata
+            )
             
             return {
                 "session_id": session_id,
                 "funcionalidad": funcionalidad,
-                "respuesta": {
-                    "output": f"❌ {error_msg}",
-                    "metadata": {"tipo": "error_procesamiento"}
-                },
-                "metadata": {"error": error_msg}
+                "respuesta": respuesta,
+                "metadata": metadata if metadata else {}
             }
+            
+        except Exception as e:
+            return self._respuesta_error_procesamiento(session_id, funcionalidad, e)
     
     def _notificar_error(self, mensaje: str):
         """Notifica sobre errores de procesamiento."""
@@ -505,16 +1164,29 @@ class Orquestador:
                 },
                 "metadata": {"error": error_msg}
             }
-    def procesar_imagen_medica(self, session_id: Optional[str], imagen_path: str, mensaje : str) -> Dict:
+    async def procesar_archivo_medico_async(self, session_id: Optional[str], archivo_path: str,
+                                            patient_context: str = "", patient_level: str = "intermedio") -> Dict:
         """
-        Procesa una imagen médica enviada desde el frontend.
+        Versión asíncrona de `procesar_archivo_medico`. La extracción del PDF y su
+        análisis son síncronos, así que se ejecutan completos en el pool "llm".
         """
         if not session_id:
             session_id = self._generar_session_id()
+        return await en_ejecutor(
+            "llm", self.procesar_archivo_medico, session_id, archivo_path, patient_context, patient_level
+        )
 
+    def _preparar_imagen(self, session_id: str, imagen_path: str) -> Dict:
+        """
+        Valida la imagen y prepara el agente de análisis de imágenes.
+        
+        Returns:
+            Dict con "resultado" si no se puede procesar, o con "funcionalidad",
+            "agente" y "metadata"
+        """
         # Validar que es una imagen
         if not self.is_image(imagen_path):
-            return {
+            return {"resultado": {
                 "session_id": session_id,
                 "funcionalidad": "error",
                 "respuesta": {
@@ -522,7 +1194,7 @@ class Orquestador:
                     "metadata": {"tipo": "formato_no_soportado"}
                 },
                 "metadata": {"error": "Formato no soportado"}
-            }
+            }}
 
         # Clasificar automáticamente como análisis de imágenes
         funcionalidad = FuncionalidadMedica.ANALISIS_IMAGENES.key
@@ -530,7 +1202,7 @@ class Orquestador:
 
         agente = self.agentes.get(funcionalidad)
         if not agente:
-            return {
+            return {"resultado": {
                 "session_id": session_id,
                 "funcionalidad": funcionalidad,
                 "respuesta": {
@@ -538,39 +1210,87 @@ class Orquestador:
                     "metadata": {"tipo": "error_agente"}
                 },
                 "metadata": {"error": "Agente no registrado"}
-            }
+            }}
+
+        # Iniciar interacción si el método existe
+        metadata = agente.iniciar_interaccion(session_id, imagen_path)
+        return {"funcionalidad": funcionalidad, "agente": agente, "metadata": metadata}
+
+    def _pregunta_imagen(self, mensaje: str, imagen_path: str) -> str:
+        return f"{mensaje}; Además adjunto una imagen, te pasare los resultados del análisis: {imagen_path}"
+
+    def _respuesta_error_imagen(self, session_id: str, error: Exception) -> Dict:
+        error_msg = f"Error procesando imagen médica: {str(error)}"
+        self._notificar_error(error_msg)
+
+        return {
+            "session_id": session_id,
+            "funcionalidad": FuncionalidadMedica.ANALISIS_IMAGENES.key,
+            "respuesta": {
+                "output": f"❌ {error_msg}",
+                "metadata": {"tipo": "error_procesamiento"}
+            },
+            "metadata": {"error": error_msg}
+        }
+
+    def procesar_imagen_medica(self, session_id: Optional[str], imagen_path: str, mensaje : str) -> Dict:
+        """
+        Procesa una imagen médica enviada desde el frontend.
+        """
+        if not session_id:
+            session_id = self._generar_session_id()
 
         try:
-            # Iniciar interacción si el método existe
-            metadata = agente.iniciar_interaccion(session_id, imagen_path)
+            preparacion = self._preparar_imagen(session_id, imagen_path)
+            if "resultado" in preparacion:
+                return preparacion["resultado"]
 
             # Procesar la imagen médica
-            respuesta = agente.preguntar(
+            respuesta = preparacion["agente"].preguntar(
                 session_id=session_id,
-                pregunta=f"{mensaje}; Además adjunto una imagen, te pasare los resultados del análisis: {imagen_path}",
-                metadata=metadata
+                pregunta=self._pregunta_imagen(mensaje, imagen_path),
+                metadata=preparacion["metadata"]
             )
 
             return {
                 "session_id": session_id,
-                "funcionalidad": funcionalidad,
+                "funcionalidad": preparacion["funcionalidad"],
                 "respuesta": respuesta,
-                "metadata": metadata if metadata else {}
+                "metadata": preparacion["metadata"] if preparacion["metadata"] else {}
             }
 
         except Exception as e:
-            error_msg = f"Error procesando imagen médica: {str(e)}"
-            self._notificar_error(error_msg)
+            return self._respuesta_error_imagen(session_id, e)
+
+    async def procesar_imagen_medica_async(self, session_id: Optional[str], imagen_path: str, mensaje: str) -> Dict:
+        """
+        Versión asíncrona de `procesar_imagen_medica`: los modelos de visión corren
+        en el pool "vision" y la respuesta del LLM se espera sin bloquear el event loop.
+        """
+        if not session_id:
+            session_id = self._generar_session_id()
+
+        try:
+            # La preparación puede ejecutar ya los modelos de visión
+            preparacion = await en_ejecutor("vision", self._preparar_imagen, session_id, imagen_path)
+            if "resultado" in preparacion:
+                return preparacion["resultado"]
+
+            respuesta = await preparacion["agente"].preguntar_async(
+                session_id=session_id,
+                pregunta=self._pregunta_imagen(mensaje, imagen_path),
+                metadata=preparacion["metadata"]
+            )
 
             return {
                 "session_id": session_id,
-                "funcionalidad": funcionalidad,
-                "respuesta": {
-                    "output": f"❌ {error_msg}",
-                    "metadata": {"tipo": "error_procesamiento"}
-                },
-                "metadata": {"error": error_msg}
-            }       
+                "funcionalidad": preparacion["funcionalidad"],
+                "respuesta": respuesta,
+                "metadata": preparacion["metadata"] if preparacion["metadata"] else {}
+            }
+
+        except Exception as e:
+            return self._respuesta_error_imagen(session_id, e)
     
     def continuar_conversacion_examenes(self, session_id: str, pregunta: str) -> Dict:
         """
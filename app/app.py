@@ -9,6 +9,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 os.environ["CLICOLOR"] = "0"
 
 import dash
+import flask
 from dash import dcc, html
 import dash_bootstrap_components as dbc
 from agents.orquestador import Orquestador, FuncionalidadMedica
@@ -18,6 +19,10 @@ from agents.interpretacionExamenes import AgenteInterpretacionExamenes
 from agents.explicacion import AgenteExplicacionMedica
 from agents.busqueda import AgenteBusquedaCentros
 from agents.contactoMedico import AgenteContactoMedico
+from utils.calentamiento import calentador
+from utils.memoria import gestor_memoria
+from utils.retencion import retencion
+from app.util.calentamiento import registrar_componentes
 
 # Importar componentes
 from components.sidebar import create_sidebar_component
@@ -32,8 +37,16 @@ from callbacks.sidebar import register_sidebar_callbacks
 from callbacks.chat import register_chat_callbacks
 from callbacks.navigation import register_navigation_callbacks
 
-def create_app():
-    """Crea y configura la aplicación Dash"""
+def create_app(iniciar_calentamiento: bool = True, iniciar_retencion: bool = True):
+    """
+    Crea y configura la aplicación Dash
+    
+    Args:
+        iniciar_calentamiento: Cargar los modelos en segundo plano desde ya
+            (ver app/util/calentamiento.py). El estado se consulta en /listo.
+        iniciar_retencion: Arrancar el borrado periódico de historiales y análisis
+            antiguos (ver utils/retencion.py). Las métricas se consultan en /retencion.
+    """
     
     # Inicializar orquestador sin frontend_callback
     orquestador = Orquestador()
@@ -64,6 +77,13 @@ def create_app():
         AgenteContactoMedico()
     )
 
+    # Precarga de modelos en segundo plano, por prioridad
+    registrar_componentes(orquestador)
+    if iniciar_calentamiento:
+        calentador.iniciar()
+    if iniciar_retencion:
+        retencion.iniciar()
+
     # Crear aplicación Dash
     external_stylesheets = [
         dbc.themes.DARKLY,
@@ -72,6 +92,27 @@ def create_app():
     app = dash.Dash(__name__, external_stylesheets=external_stylesheets, suppress_callback_exceptions=True)
     app.title = "Health IA"
 
+    @app.server.route("/listo")
+    def listo():
+        """Sonda de disponibilidad: 200 cuando el LLM está cargado, 503 mientras tanto"""
+        estado = calentador.estado()
+        return flask.jsonify(estado), 200 if estado["listo"] else 503
+
+    @app.server.route("/memoria")
+    def memoria():
+        """Memoria residente del proceso y modelos cargados"""
+        return flask.jsonify(gestor_memoria.uso())
+
+    @app.server.route("/retencion")
+    def retencion_artefactos():
+        """Barridos de historiales y análisis antiguos, y espacio liberado"""
+        return flask.jsonify(retencion.metricas())
+
+    @app.server.route("/enrutamiento")
+    def enrutamiento():
+        """Mensajes por vía de enrutamiento y día, y llamadas al clasificador LLM ahorradas"""
+        return flask.jsonify(orquestador.metricas_enrutamiento())
+
     # Layout principal con componentes
     app.layout = html.Div(style=MAIN_STYLES['main-container'], children=[
         dcc.Location(id='url', refresh=False),
@@ -81,6 +122,7 @@ def create_app():
         dcc.Store(id='conversations-store', data=[]),
         dcc.Store(id='sidebar-editing-title', data=None),
         dcc.Upload(id='upload-document', children=None, multiple=True),
+        dcc.Interval(id='stream-interval', interval=250, disabled=True),
         
         # Botón flotante para abrir sidebar (visible cuando está cerrado)
         dbc.Button(
@@ -108,7 +150,12 @@ def create_app():
 
 def main():
     """Función principal para ejecutar la aplicación"""
-    app = create_app()
+    # Con debug=True el recargador ejecuta main() dos veces; solo el proceso hijo
+    # (WERKZEUG_RUN_MAIN) atiende peticiones, así que solo él precarga los modelos
+    # y barre los artefactos antiguos
+    atiende = os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+    app = create_app(iniciar_calentamiento=atiende, iniciar_retencion=atiende)
+    # Un solo proceso: las respuestas en streaming viven en su memoria (ver app/util/streaming.py)
     app.run(debug=True)
 
 if __name__ == '__main__':
@@ -10,10 +10,38 @@ from styles.chat import CHAT_STYLES
 from utils.funcionalidades import FuncionalidadMedica
 import uuid
 from app.util.helpers import generar_mensaje_bienvenida, create_conversation_item
+from app.util.streaming import RespuestasEnCurso
 import time
 
+ROUTE_MAPPING = {
+    'diagnostico': '/diagnostico',
+    'explicacion_medica': '/explicacion',
+    'explicacion': '/explicacion',
+    'interpretacion_examenes': '/interpretacion-examenes',
+    'resumen_medico': '/resumen-medico',
+    'contacto_medico': '/contacto-medico',
+    'buscador_centros': '/busqueda',
+    'busqueda': '/busqueda',
+    'analisis_imagenes': '/analizar-imagenes',
+    'analizar_imagenes': '/analizar-imagenes'
+}
+
+MENSAJE_ERROR = "Lo siento, ocurrió un error al procesar tu mensaje. Por favor intenta nuevamente."
+MENSAJE_NO_DISPONIBLE = "La respuesta a este mensaje ya no está disponible. Por favor envíalo de nuevo."
+
+def render_messages(messages):
+    """Convierte los mensajes de una conversación en componentes del chat"""
+    rendered_messages = []
+    for msg in messages:
+        if msg['role'] == 'user':
+            rendered_messages.append(dash.html.Div(f"Tú: {msg['content']}", style=CHAT_STYLES['user-message']))
+        else:
+            rendered_messages.append(dash.html.Div(f"Asistente: {msg['content']}", style=CHAT_STYLES['bot-message']))
+    return rendered_messages
+
 def register_chat_callbacks(app, orquestador):
     """Registra todos los callbacks relacionados con el chat"""
+    respuestas_en_curso = RespuestasEnCurso()
     
     @app.callback(
         [Output('chat-messages', 'children', allow_duplicate=True),
@@ -22,7 +50,8 @@ def register_chat_callbacks(app, orquestador):
          Output('url', 'pathname', allow_duplicate=True),
          Output('conversations-store', 'data'),
          Output('session-id', 'data'),
-         Output('sidebar-editing-title', 'data', allow_duplicate=True)],
+         Output('sidebar-editing-title', 'data', allow_duplicate=True),
+         Output('stream-interval', 'disabled')],
         [Input('send-button', 'n_clicks'),
          Input('user-input', 'n_submit'),
          Input('new-chat-button', 'n_clicks'),
@@ -52,7 +81,7 @@ def register_chat_callbacks(app, orquestador):
                 for conv in conversations:
                     if conv['id'] == editing_title:
                         conv['title'] = new_title
-                return no_update, no_update, no_update, no_update, conversations, no_update, None
+                return no_update, no_update, no_update, no_update, conversations, no_update, None, no_update
             raise PreventUpdate
 
         # Manejar nueva conversación desde el sidebar
@@ -75,7 +104,7 @@ def register_chat_callbacks(app, orquestador):
             for conv in conversations:
                 conv['active'] = False
             conversations.append(new_conversation)
-            return welcome_message, "", 'home', '/', conversations, new_session_id, None
+            return welcome_message, "", 'home', '/', conversations, new_session_id, None, no_update
 
         # Manejar envío de mensaje
         if not user_input or (send_clicks is None and submit is None):
@@ -86,45 +115,62 @@ def register_chat_callbacks(app, orquestador):
         if not conv:
             raise PreventUpdate
         conv['messages'].append({'role': 'user', 'content': user_input})
-        try:
-            respuesta = orquestador.procesar_mensaje(session_id, user_input)
-            funcionalidad = respuesta.get('funcionalidad', 'home')
-            output = respuesta['respuesta'].get('output', 'No se pudo generar una respuesta.')
+        # La respuesta se genera en segundo plano y se pinta con el intervalo; la
+        # conversación guarda los identificadores de sus respuestas pendientes, en orden
+        respuesta_id = respuestas_en_curso.iniciar(session_id, orquestador.procesar_mensaje_stream(session_id, user_input))
+        conv.setdefault('respuestas_en_curso', []).append(respuesta_id)
+        rendered_messages = render_messages(conv['messages'] + [{'role': 'assistant', 'content': "…"}])
+        return rendered_messages, "", no_update, no_update, conversations, session_id, None, False
+
+    @app.callback(
+        [Output('chat-messages', 'children', allow_duplicate=True),
+         Output('current-functionality', 'data', allow_duplicate=True),
+         Output('url', 'pathname', allow_duplicate=True),
+         Output('conversations-store', 'data', allow_duplicate=True),
+         Output('stream-interval', 'disabled', allow_duplicate=True)],
+        Input('stream-interval', 'n_intervals'),
+        [State('session-id', 'data'),
+         State('conversations-store', 'data'),
+         State('current-functionality', 'data')],
+        prevent_initial_call=True
+    )
+    def update_stream(n_intervals, session_id, conversations, current_functionality):
+        conv = next((c for c in conversations or [] if c['session_id'] == session_id), None)
+        pendientes = conv.get('respuestas_en_curso') if conv else None
+        if not pendientes:
+            return no_update, no_update, no_update, no_update, True
+
+        # Se recogen en orden las respuestas terminadas; la primera sin terminar se pinta parcial
+        funcionalidad = current_functionality
+        parcial = None
+        recogidas = 0
+        while pendientes:
+            estado = respuestas_en_curso.estado(pendientes[0])
+            if estado is not None and not estado['terminado']:
+                parcial = estado['texto'] or "…"
+                break
+            respuestas_en_curso.finalizar(pendientes.pop(0))
+            recogidas += 1
+            if estado is None:
+                # Descartada por antigua, o generada en otro proceso
+                print(f"Error en update_stream: respuesta de la sesión {session_id} no encontrada")
+                conv['messages'].append({'role': 'assistant', 'content': MENSAJE_NO_DISPONIBLE})
+                continue
+            resultado = estado['resultado']
+            if not resultado:
+                print(f"Error en update_stream: la sesión {session_id} terminó sin resultado")
+                conv['messages'].append({'role': 'assistant', 'content': MENSAJE_ERROR})
+                continue
+            funcionalidad = resultado.get('funcionalidad', 'home')
+            output = resultado['respuesta'].get('output', 'No se pudo generar una respuesta.')
             conv['messages'].append({'role': 'assistant', 'content': output})
-            rendered_messages = []
-            for msg in conv['messages']:
-                if msg['role'] == 'user':
-                    rendered_messages.append(dash.html.Div(f"Tú: {msg['content']}", style=CHAT_STYLES['user-message']))
-                else:
-                    rendered_messages.append(dash.html.Div(f"Asistente: {msg['content']}", style=CHAT_STYLES['bot-message']))
-            if funcionalidad != current_functionality:
-                route_mapping = {
-                    'diagnostico': '/diagnostico',
-                    'explicacion_medica': '/explicacion',
-                    'explicacion': '/explicacion',
-                    'interpretacion_examenes': '/interpretacion-examenes',
-                    'resumen_medico': '/resumen-medico',
-                    'contacto_medico': '/contacto-medico',
-                    'buscador_centros': '/busqueda',
-                    'busqueda': '/busqueda',
-                    'analisis_imagenes': '/analizar-imagenes',
-                    'analizar_imagenes': '/analizar-imagenes'
-                }
-                pathname = route_mapping.get(funcionalidad, '/')
-            else:
-                pathname = dash.no_update
-            return rendered_messages, "", funcionalidad, pathname, conversations, session_id, None
-        except Exception as e:
-            print(f"Error en update_chat: {str(e)}")
-            error_message = dash.html.Div(
-                "Lo siento, ocurrió un error al procesar tu mensaje. Por favor intenta nuevamente.",
-                style=CHAT_STYLES['bot-message']
-            )
-            conv['messages'].append({'role': 'assistant', 'content': "Lo siento, ocurrió un error al procesar tu mensaje. Por favor intenta nuevamente."})
-            rendered_messages = []
-            for msg in conv['messages']:
-                if msg['role'] == 'user':
-                    rendered_messages.append(dash.html.Div(f"Tú: {msg['content']}", style=CHAT_STYLES['user-message']))
-                else:
-                    rendered_messages.append(dash.html.Div(f"Asistente: {msg['content']}", style=CHAT_STYLES['bot-message']))
-            return rendered_messages, "", current_functionality, dash.no_update, conversations, session_id, None 
\ No newline at end of file
+
+        if parcial is not None:
+            mensajes = render_messages(conv['messages'] + [{'role': 'assistant', 'content': parcial}])
+            return mensajes, no_update, no_update, conversations if recogidas else no_update, False
+
+        if funcionalidad != current_functionality:
+            pathname = ROUTE_MAPPING.get(funcionalidad, '/')
+        else:
+            pathname = dash.no_update
+        return render_messages(conv['messages']), funcionalidad, pathname, conversations, True
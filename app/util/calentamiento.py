@@ -0,0 +1,64 @@
+"""
+Calentamiento de modelos al arrancar la aplicación
+"""
+
+import os
+import importlib
+from typing import List
+
+from agents.agente import Agente
+from agents.orquestador import Orquestador, FuncionalidadMedica
+from agents.analizarImagenes import MODELOS_VISION
+from utils.calentamiento import calentador
+from utils.tokenizacion import obtener_tokenizador
+from utils.clasificador_ngramas import DIRECTORIO_REGISTRO
+
+
+def _cargar_modelo_vision(modulo: str):
+    return importlib.import_module(modulo).get_model()
+
+
+def registrar_componentes(orquestador: Orquestador) -> None:
+    """
+    Registra los componentes a precargar, por prioridad:
+    0. LLM compartido (requerido para declarar la aplicación lista), vocabulario
+       con el que se cuentan los tokens del historial, y clasificación sin LLM
+       (modelo de n-gramas y caché de clasificaciones)
+    1. Prefijos KV de cada agente: tokenización con el vocabulario del GGUF y estado evaluado
+    2. Agente de análisis de PDFs
+    3. Herramientas y modelos de visión
+    """
+    agentes: List[Agente] = [orquestador.agente_clasificador] + list(orquestador.agentes.values())
+
+    def cargar_llm():
+        for agente in agentes:
+            agente._ensure_llm()
+
+    def cargar_prefijos():
+        for agente in agentes:
+            agente.precargar_prefijo()
+
+    def cargar_tokenizadores():
+        for model_path in {a.model_config.get("model_path") for a in agentes} - {None}:
+            obtener_tokenizador(model_path).cargar()
+
+    def cargar_clasificacion():
+        orquestador.clasificador_estadistico.modelo()
+        if DIRECTORIO_REGISTRO:
+            orquestador.cache_clasificacion.calentar([os.path.join(DIRECTORIO_REGISTRO, "intenciones-*.jsonl")])
+
+    # El vocabulario y la clasificación cargan en milisegundos: antes que los pesos
+    calentador.registrar("tokenizadores", cargar_tokenizadores, prioridad=0)
+    calentador.registrar("clasificacion", cargar_clasificacion, prioridad=0)
+    calentador.registrar("llm", cargar_llm, prioridad=0, requerido=True)
+    calentador.registrar("prefijos_kv", cargar_prefijos, prioridad=1)
+
+    agente_examenes = orquestador.agentes.get(FuncionalidadMedica.INTERPRETACION_EXAMENES.key)
+    if agente_examenes is not None:
+        calentador.agregar(agente_examenes._pdf_agent, prioridad=2)
+
+    agente_imagenes = orquestador.agentes.get(FuncionalidadMedica.ANALISIS_IMAGENES.key)
+    if agente_imagenes is not None:
+        calentador.agregar(agente_imagenes.herramientas, prioridad=3)
+        for i, (nombre, modulo) in enumerate(MODELOS_VISION):
+            calentador.registrar(nombre, lambda modulo=modulo: _cargar_modelo_vision(modulo), prioridad=4 + i)
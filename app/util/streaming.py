@@ -0,0 +1,111 @@
+"""
+Respuestas en curso para el chat en streaming
+"""
+
+import os
+import time
+import uuid
+import threading
+from typing import Dict, Any, Iterator, Optional
+
+# Segundos que se guarda una respuesta terminada que nadie ha recogido
+# (el usuario cambió de conversación o cerró la pestaña)
+RETENCION = float(os.getenv("STREAM_RETENCION", 300))
+# Cada cuántos segundos se buscan respuestas abandonadas
+INTERVALO_PURGA = 60.0
+
+
+class RespuestasEnCurso:
+    """
+    Consume en segundo plano el stream del orquestador de cada mensaje y guarda
+    el texto parcial para que el callback del intervalo lo vaya pintando.
+
+    Cada mensaje tiene su propio identificador (el que devuelve `iniciar`), así
+    que un segundo mensaje de la misma sesión no pisa la respuesta del primero.
+    Las respuestas terminadas que no se recogen en RETENCION segundos se
+    descartan desde un hilo en segundo plano.
+
+    El estado vive en la memoria del proceso: la aplicación debe servirse con
+    un solo proceso (el servidor de Dash por defecto, o un único trabajador con
+    hilos), porque el callback del intervalo tiene que llegar al proceso que
+    generó la respuesta.
+    """
+
+    def __init__(self, retencion: float = RETENCION, intervalo: float = INTERVALO_PURGA):
+        self.retencion = retencion
+        self.intervalo = intervalo
+        self._respuestas: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._purgador: Optional[threading.Thread] = None
+
+    def iniciar(self, session_id: str, eventos: Iterator[Dict]) -> str:
+        """
+        Empieza a consumir los eventos de `Orquestador.procesar_mensaje_stream`.
+
+        Returns:
+            Identificador de la respuesta, para `estado` y `finalizar`
+        """
+        respuesta_id = uuid.uuid4().hex
+        with self._lock:
+            self._respuestas[respuesta_id] = {
+                "session_id": session_id,
+                "texto": "",
+                "funcionalidad": None,
+                "resultado": None,
+                "terminado": False,
+                "actualizado": time.monotonic()
+            }
+            if self._purgador is None:
+                self._purgador = threading.Thread(target=self._purgar_periodicamente,
+                                                  name="purga-respuestas", daemon=True)
+                self._purgador.start()
+        hilo = threading.Thread(target=self._consumir, args=(respuesta_id, eventos), daemon=True)
+        hilo.start()
+        return respuesta_id
+
+    def _consumir(self, respuesta_id: str, eventos: Iterator[Dict]):
+        estado = self._respuestas[respuesta_id]
+        try:
+            for evento in eventos:
+                with self._lock:
+                    if evento["evento"] == "inicio":
+                        estado["funcionalidad"] = evento["funcionalidad"]
+                    elif evento["evento"] == "fragmento":
+                        estado["texto"] += evento["texto"]
+                    elif evento["evento"] == "fin":
+                        estado["resultado"] = evento["resultado"]
+                    estado["actualizado"] = time.monotonic()
+        except Exception as e:
+            print(f"[STREAMING] Error en sesión {estado['session_id']}: {str(e)}")
+        finally:
+            with self._lock:
+                estado["terminado"] = True
+                estado["actualizado"] = time.monotonic()
+
+    def estado(self, respuesta_id: str) -> Optional[Dict[str, Any]]:
+        """Copia del estado actual de una respuesta, o None si no existe en este proceso"""
+        with self._lock:
+            estado = self._respuestas.get(respuesta_id)
+            return dict(estado) if estado else None
+
+    def finalizar(self, respuesta_id: str) -> Optional[Dict[str, Any]]:
+        """Retira una respuesta y devuelve su estado final"""
+        with self._lock:
+            return self._respuestas.pop(respuesta_id, None)
+
+    def purgar(self) -> int:
+        """Descarta las respuestas terminadas hace más de `retencion` segundos. Devuelve cuántas."""
+        limite = time.monotonic() - self.retencion
+        with self._lock:
+            viejas = [respuesta_id for respuesta_id, estado in self._respuestas.items()
+                      if estado["terminado"] and estado["actualizado"] < limite]
+            for respuesta_id in viejas:
+                del self._respuestas[respuesta_id]
+        if viejas:
+            print(f"[STREAMING] {len(viejas)} respuestas abandonadas descartadas")
+        return len(viejas)
+
+    def _purgar_periodicamente(self):
+        while True:
+            time.sleep(self.intervalo)
+            self.purgar()
@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+
+import pytest
+
+# Los módulos se importan como en la aplicación (utils.*, agents.*), desde la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.conversation import CacheConversaciones, Conversation  # noqa: E402
+
+
+@pytest.fixture
+def leer_registros():
+    """Registros de un historial JSONL, en orden; lista vacía si el archivo no existe."""
+    def leer(ruta):
+        if not os.path.exists(ruta):
+            return []
+        with open(ruta, encoding="utf-8") as f:
+            return [json.loads(linea) for linea in f if linea.strip()]
+    return leer
+
+
+@pytest.fixture
+def conversacion_jsonl():
+    """Crea una Conversation con backend JSONL y un presupuesto de tokens que no recorta."""
+    def crear(ruta, **kwargs):
+        kwargs.setdefault("max_context_tokens", 10000)
+        return Conversation(file_path=str(ruta), backend="jsonl", **kwargs)
+    return crear
+
+
+@pytest.fixture
+def nueva_cache_conversaciones():
+    """Crea una CacheConversaciones propia de la prueba, que solo vuelca cuando se le pide."""
+    creadas = []
+
+    def crear(capacidad=4):
+        # Intervalo largo: los volcados de las pruebas son siempre explícitos
+        cache = CacheConversaciones(capacidad=capacidad, intervalo=3600)
+        creadas.append(cache)
+        return cache
+    yield crear
+    for cache in creadas:
+        cache.cerrar()
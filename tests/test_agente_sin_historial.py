@@ -0,0 +1,49 @@
+import os
+from typing import Any, List, Optional
+
+import pytest
+from langchain_core.language_models.llms import LLM
+
+from agents.agente import Agente
+from utils.conversation import cache_conversaciones
+
+
+class LLMFijo(LLM):
+    """LLM de prueba: anota cada prompt y responde siempre lo mismo."""
+
+    prompts: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fijo"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        self.prompts.append(prompt)
+        return "diagnostico"
+
+
+@pytest.fixture
+def agente(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    prompt = tmp_path / "prompt.txt"
+    prompt.write_text("Clasifica el mensaje del paciente.", encoding="utf-8")
+    agente = Agente({"nombre": "clasificador"}, {"tokenizer_name": "palabras"}, str(prompt))
+    agente.llm = LLMFijo(prompts=[])
+    return agente
+
+
+def test_llamadas_sueltas_no_usan_historial(agente, tmp_path):
+    antes = cache_conversaciones.metricas()
+    assert agente.preguntar_sin_historial("me duele la cabeza") == "diagnostico"
+    assert agente.preguntar_sin_historial("¿dónde hay un hospital?") == "diagnostico"
+
+    primero, segundo = agente.llm.prompts
+    assert "me duele la cabeza" in primero
+    assert "me duele la cabeza" not in segundo and "¿dónde hay un hospital?" in segundo
+    # Mismo prompt salvo la pregunta: el prefijo estático se reutiliza
+    assert primero.startswith(agente.prefijo_estatico) and segundo.startswith(agente.prefijo_estatico)
+    # Ni se abre una conversación en memoria ni se escribe en disco
+    despues = cache_conversaciones.metricas()
+    assert (despues["aciertos"], despues["fallos"]) == (antes["aciertos"], antes["fallos"])
+    historiales = tmp_path / "historiales"
+    assert not historiales.exists() or os.listdir(historiales) == []
@@ -0,0 +1,120 @@
+import json
+import os
+
+from utils import cache_clasificacion
+from utils.cache_clasificacion import CacheClasificacion, SIN_PATRON
+
+PATRONES = {"diagnostico": [r"\b(dolor|fiebre)\b"], "busqueda": [r"\b(hospital|clínica)\b"]}
+
+
+def _cache(tmp_path, **kwargs):
+    kwargs.setdefault("ruta_disco", str(tmp_path / "cache" / "clasificacion.sqlite3"))
+    cache = CacheClasificacion(**kwargs)
+    cache.configurar(PATRONES)
+    return cache
+
+
+def test_mensajes_normalizados_comparten_entrada(tmp_path):
+    cache = _cache(tmp_path)
+    assert cache.obtener("¿Qué es la diabetes?") is None
+    cache.guardar("¿Qué es la diabetes?", "explicacion", "llm")
+
+    assert cache.obtener("que es la  DIABETES") == ("explicacion", "llm")
+    metricas = cache.metricas()
+    assert metricas["fallos"] == 1 and metricas["aciertos_memoria"] == 1
+    assert metricas["tasa_aciertos"] == 0.5
+
+
+def test_resultados_negativos(tmp_path):
+    cache = _cache(tmp_path)
+    cache.guardar("hola", None, SIN_PATRON)
+    assert cache.obtener("Hola!") == (None, SIN_PATRON)
+    assert cache.metricas()["negativos"] == 1
+
+
+def test_lru_en_memoria_y_nivel_en_disco(tmp_path):
+    cache = _cache(tmp_path, capacidad=2)
+    cache.guardar("uno", "diagnostico", "patrones")
+    cache.guardar("dos", "busqueda", "patrones")
+    cache.obtener("uno")
+    cache.guardar("tres", "explicacion", "llm")
+
+    metricas = cache.metricas()
+    assert metricas["expulsadas"] == 1 and metricas["entradas_memoria"] == 2
+    # "dos" salió de memoria pero sigue en disco
+    assert cache.obtener("dos") == ("busqueda", "patrones")
+    assert cache.metricas()["aciertos_disco"] == 1
+
+    # Otra instancia (otro arranque) con el mismo archivo y la misma versión
+    otra = _cache(tmp_path)
+    assert otra.obtener("tres") == ("explicacion", "llm")
+
+
+def test_solo_memoria(tmp_path):
+    cache = _cache(tmp_path, ruta_disco=None)
+    cache.guardar("uno", "diagnostico", "patrones")
+    assert cache.obtener("uno") == ("diagnostico", "patrones")
+    assert not os.path.exists(tmp_path / "cache")
+
+
+def test_cambio_de_patrones_invalida(tmp_path):
+    cache = _cache(tmp_path)
+    cache.guardar("me duele", "diagnostico", "patrones")
+    version = cache.version
+
+    cache.configurar({**PATRONES, "explicacion": [r"\bqué es\b"]})
+    assert cache.version != version
+    assert cache.obtener("me duele") is None
+    assert cache.metricas()["invalidaciones"] == 1
+    # El disco descartó la versión anterior: volver a los patrones originales no la recupera
+    cache.configurar(PATRONES)
+    assert cache.obtener("me duele") is None
+
+
+def test_cambio_del_prompt_vigilado_invalida(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_clasificacion, "INTERVALO_VIGILANCIA", 0.0)
+    prompt = tmp_path / "clasificador.txt"
+    prompt.write_text("Clasifica el mensaje", encoding="utf-8")
+    cache = CacheClasificacion(ruta_disco=None)
+    cache.configurar(PATRONES, vigilados=[str(prompt)])
+    cache.guardar("me duele", "diagnostico", "llm")
+    assert cache.obtener("me duele") == ("diagnostico", "llm")
+
+    prompt.write_text("Clasifica el mensaje del paciente", encoding="utf-8")
+    mtime = os.path.getmtime(prompt) + 10
+    os.utime(prompt, (mtime, mtime))
+    assert cache.obtener("me duele") is None
+    assert cache.metricas()["invalidaciones"] == 1
+
+
+def test_calentar_desde_el_registro(tmp_path):
+    cache = _cache(tmp_path)
+    registros = tmp_path / "logs"
+    registros.mkdir()
+    lineas = [
+        {"mensaje": "tengo fiebre", "funcionalidad": "diagnostico", "fuente": "patrones", "version": cache.version},
+        {"mensaje": "Tengo fiebre!", "funcionalidad": "explicacion", "fuente": "llm", "version": cache.version},
+        {"mensaje": "hospital cerca", "funcionalidad": "busqueda", "fuente": "patrones", "version": "antigua"},
+    ]
+    (registros / "intenciones-2026-10-01.jsonl").write_text(
+        "\n".join(json.dumps(l, ensure_ascii=False) for l in lineas) + "\nroto\n", encoding="utf-8"
+    )
+
+    assert cache.calentar([str(registros / "intenciones-*.jsonl")]) == 1
+    # Gana la entrada más reciente del registro; las de otra versión se ignoran
+    assert cache.obtener("tengo fiebre") == ("explicacion", "llm")
+    assert cache.obtener("hospital cerca") is None
+
+    # El siguiente arranque precarga del disco, ya sin leer el registro
+    otra = _cache(tmp_path)
+    assert otra.calentar([]) == 1
+    assert otra.obtener("tengo fiebre") == ("explicacion", "llm")
+    assert otra.metricas()["aciertos_memoria"] == 1
+
+
+def test_limpiar(tmp_path):
+    cache = _cache(tmp_path)
+    cache.guardar("uno", "diagnostico", "patrones")
+    cache.limpiar()
+    assert cache.obtener("uno") is None
+    assert _cache(tmp_path).obtener("uno") is None
@@ -0,0 +1,114 @@
+import threading
+
+from utils.conversation import Conversation
+
+
+def test_misma_instancia_y_limites_de_cada_agente(tmp_path, nueva_cache_conversaciones):
+    cache = nueva_cache_conversaciones()
+    ruta = str(tmp_path / "s1.jsonl")
+    primera = cache.obtener(ruta, backend="jsonl", max_context_tokens=1000, max_messages=10)
+    segunda = cache.obtener(ruta, backend="jsonl", max_context_tokens=500, max_messages=4)
+
+    assert primera is segunda
+    assert segunda._max_context_tokens == 500 and segunda._max_messages == 4
+    assert cache.metricas()["aciertos"] == 1 and cache.metricas()["fallos"] == 1
+
+
+def test_escritura_diferida_en_un_solo_bloque(tmp_path, nueva_cache_conversaciones, leer_registros):
+    cache = nueva_cache_conversaciones()
+    ruta = str(tmp_path / "s2.jsonl")
+    conversacion = cache.obtener(ruta, backend="jsonl", max_context_tokens=1000, max_messages=2)
+    for i in range(3):
+        conversacion.add_user_message(f"m{i}")
+
+    # Nada en disco hasta el volcado; en memoria ya está recortada
+    assert leer_registros(ruta) == []
+    assert [m.content for m in conversacion.messages] == ["m1", "m2"]
+    assert cache.metricas()["pendientes"] == 1
+
+    cache.volcar_todo()
+    # Todos los turnos pendientes como un bloque de mensajes y un único recorte
+    assert [r["op"] for r in leer_registros(ruta)] == ["add", "add", "add", "trim"]
+    assert leer_registros(ruta)[-1]["n"] == 1
+    assert cache.metricas()["pendientes"] == 0
+    assert [m.content for m in Conversation(file_path=ruta, backend="jsonl").messages] == ["m1", "m2"]
+
+    # Un segundo volcado sin cambios no escribe nada
+    cache.volcar_todo()
+    assert len(leer_registros(ruta)) == 4
+
+
+def test_expulsion_lru_vuelca_lo_pendiente(tmp_path, nueva_cache_conversaciones, leer_registros):
+    cache = nueva_cache_conversaciones(capacidad=2)
+    rutas = [str(tmp_path / f"s{i}.jsonl") for i in range(3)]
+    a = cache.obtener(rutas[0], backend="jsonl")
+    a.add_user_message("de a")
+    cache.obtener(rutas[1], backend="jsonl")
+    # Usar la primera la deja como la más reciente: se expulsa la segunda
+    cache.obtener(rutas[0], backend="jsonl")
+    cache.obtener(rutas[2], backend="jsonl")
+    assert cache.metricas()["expulsadas"] == 1
+    assert cache.obtener(rutas[0], backend="jsonl") is a
+
+    b = cache.obtener(rutas[1], backend="jsonl")
+    b.add_user_message("de b")
+    cache.obtener(rutas[2], backend="jsonl")
+    cache.obtener(rutas[0], backend="jsonl")
+    # b se expulsó con un mensaje pendiente: se escribió al salir
+    assert [r["msg"]["content"] for r in leer_registros(rutas[1])] == ["de b"]
+
+
+def test_descartar_no_vuelca(tmp_path, nueva_cache_conversaciones, leer_registros):
+    cache = nueva_cache_conversaciones()
+    ruta = str(tmp_path / "s3.jsonl")
+    conversacion = cache.obtener(ruta, backend="jsonl")
+    conversacion.add_user_message("se borra")
+
+    assert cache.descartar(ruta)
+    assert not cache.descartar(ruta)
+    cache.volcar_todo()
+    assert leer_registros(ruta) == []
+    # Fuera de la caché vuelve a escribir directamente
+    conversacion.add_user_message("directo")
+    assert [r["msg"]["content"] for r in leer_registros(ruta)] == ["directo"]
+
+
+def test_sin_capacidad_escribe_en_cada_peticion(tmp_path, nueva_cache_conversaciones, leer_registros):
+    cache = nueva_cache_conversaciones(capacidad=0)
+    ruta = str(tmp_path / "s4.jsonl")
+    primera = cache.obtener(ruta, backend="jsonl")
+    primera.add_user_message("hola")
+
+    assert [r["msg"]["content"] for r in leer_registros(ruta)] == ["hola"]
+    segunda = cache.obtener(ruta, backend="jsonl")
+    assert segunda is not primera
+    assert [m.content for m in segunda.messages] == ["hola"]
+    assert cache.metricas()["en_memoria"] == 0
+
+
+def test_cargas_concurrentes_comparten_instancia(tmp_path, nueva_cache_conversaciones):
+    cache = nueva_cache_conversaciones()
+    ruta = str(tmp_path / "s5.jsonl")
+    barrera = threading.Barrier(8)
+    obtenidas = []
+
+    def obtener():
+        barrera.wait()
+        obtenidas.append(cache.obtener(ruta, backend="jsonl"))
+
+    hilos = [threading.Thread(target=obtener) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len({id(c) for c in obtenidas}) == 1
+    assert cache.metricas()["en_memoria"] == 1
+
+
+def test_cerrar_vuelca(tmp_path, nueva_cache_conversaciones, leer_registros):
+    cache = nueva_cache_conversaciones()
+    ruta = str(tmp_path / "s6.jsonl")
+    cache.obtener(ruta, backend="jsonl").add_ai_message("al cerrar")
+    cache.cerrar()
+    assert [r["msg"]["content"] for r in leer_registros(ruta)] == ["al cerrar"]
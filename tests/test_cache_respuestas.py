@@ -0,0 +1,99 @@
+import pytest
+
+from agents.agente import Agente
+from utils.conversation import cache_conversaciones
+from utils.cache_respuestas import CacheRespuestas, normalizar_pregunta
+
+
+def _cache(tmp_path, **kwargs):
+    kwargs.setdefault("ruta_disco", str(tmp_path / "cache" / "respuestas.sqlite3"))
+    return CacheRespuestas(**kwargs)
+
+
+def test_claves_de_preguntas_equivalentes():
+    assert normalizar_pregunta("¿Qué es la Diabetes?") == "que es la diabetes"
+    params = {"temperature": 0.2, "top_p": 0.9}
+    clave = CacheRespuestas.clave("¿Qué es la Diabetes?", "prompt", params)
+    assert clave == CacheRespuestas.clave("que es la  diabetes", "prompt", dict(reversed(params.items())))
+    assert clave != CacheRespuestas.clave("que es la diabetes", "otro prompt", params)
+    assert clave != CacheRespuestas.clave("que es la diabetes", "prompt", {**params, "temperature": 0.3})
+
+
+def test_caducidad(tmp_path):
+    vigente = _cache(tmp_path, ttl=60)
+    vigente.guardar("k", "respuesta")
+    assert vigente.obtener("k") == "respuesta"
+
+    caducada = _cache(tmp_path, ttl=0)
+    caducada.guardar("k", "respuesta")
+    assert caducada.obtener("k") is None
+    # Tampoco el disco la devuelve a otra instancia
+    assert _cache(tmp_path, ttl=60).obtener("k") is None
+
+
+def test_lru_en_memoria(tmp_path):
+    cache = _cache(tmp_path, capacidad=2, ruta_disco=None)
+    cache.guardar("uno", "1")
+    cache.guardar("dos", "2")
+    cache.obtener("uno")
+    cache.guardar("tres", "3")
+
+    assert cache.obtener("dos") is None
+    assert cache.obtener("uno") == "1" and cache.obtener("tres") == "3"
+    metricas = cache.metricas()
+    assert metricas["expulsadas"] == 1 and metricas["entradas_memoria"] == 2
+    assert metricas["aciertos_memoria"] == 3 and metricas["fallos"] == 1
+
+
+def test_el_disco_sobrevive_a_otra_instancia(tmp_path):
+    cache = _cache(tmp_path, capacidad=1)
+    cache.guardar("uno", "1")
+    cache.guardar("dos", "2")
+    # "uno" salió de memoria pero sigue en disco
+    assert cache.obtener("uno") == "1"
+    assert cache.metricas()["aciertos_disco"] == 1
+
+    otra = _cache(tmp_path)
+    assert otra.obtener("dos") == "2"
+    assert otra.obtener("dos") == "2"
+    assert otra.metricas()["aciertos_disco"] == 1 and otra.metricas()["aciertos_memoria"] == 1
+
+    otra.limpiar()
+    assert _cache(tmp_path).obtener("uno") is None
+
+
+@pytest.fixture
+def agente(tmp_path, monkeypatch):
+    # Los historiales van a historiales/ relativo al directorio de trabajo
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "historiales").mkdir()
+    prompt = tmp_path / "prompt.txt"
+    prompt.write_text("Explica términos médicos.", encoding="utf-8")
+    model_config = {
+        "model_path": str(tmp_path / "modelo.gguf"),
+        "temperature": 0.2,
+        "cache_respuestas": True,
+        "tokenizer": lambda texto: len(texto.split()),
+        "tokenizer_name": "palabras",
+    }
+    yield Agente({"nombre": "explicacion"}, model_config, str(prompt))
+    # Volcado pendiente antes de salir del directorio temporal
+    cache_conversaciones.volcar_todo()
+
+
+def test_clave_solo_sin_historial(agente):
+    clave = agente._clave_cache("s1", "¿Qué es la diabetes?")
+    assert clave is not None
+    assert agente._clave_cache("s2", "que es la diabetes") == clave
+
+    agente.history_factory("s1").add_user_message("hola")
+    assert agente._clave_cache("s1", "¿Qué es la diabetes?") is None
+    assert agente._clave_cache("s2", "¿Qué es la diabetes?") == clave
+
+
+def test_sin_clave_si_el_agente_no_cachea(agente, monkeypatch):
+    monkeypatch.setitem(agente.model_config, "temperature", 0.9)
+    assert agente._clave_cache("s1", "¿Qué es la diabetes?") is None
+    monkeypatch.setitem(agente.model_config, "temperature", 0.2)
+    monkeypatch.setitem(agente.model_config, "cache_respuestas", False)
+    assert agente._clave_cache("s1", "¿Qué es la diabetes?") is None
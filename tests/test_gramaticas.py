@@ -0,0 +1,42 @@
+import re
+
+import pytest
+from llama_cpp import LlamaGrammar
+
+from utils import gramaticas
+from utils.gramaticas import gramatica_json, gramatica_opciones, REGLA_CHAR_ESTRICTA
+
+ESQUEMA = {
+    "type": "object",
+    "properties": {"resumen": {"type": "string"}},
+    "required": ["resumen"],
+}
+
+
+def _clase_char(gbnf):
+    """Primera clase de caracteres de la regla `char`, como expresión regular de Python."""
+    regla = next(linea for linea in gbnf.splitlines() if linea.startswith("char ::="))
+    return re.compile(re.match(r"char ::= (\[(?:\\.|[^\]])*\])", regla).group(1))
+
+
+def test_cadenas_del_esquema_rechazan_caracteres_de_control():
+    gbnf = gramatica_json(ESQUEMA)
+    assert REGLA_CHAR_ESTRICTA in gbnf
+    char = _clase_char(gbnf)
+
+    assert char.fullmatch("a") and char.fullmatch("ñ")
+    for prohibido in ("\n", "\t", "\x00", "\x7f", '"', "\\"):
+        assert not char.fullmatch(prohibido)
+    LlamaGrammar.from_string(gbnf, verbose=False)
+
+
+def test_aviso_si_cambia_la_regla_generada(monkeypatch):
+    monkeypatch.setattr(gramaticas, "json_schema_to_gbnf", lambda esquema: 'root ::= "{}"\nchar ::= [^"]\n')
+    with pytest.warns(UserWarning, match="char"):
+        assert gramatica_json(ESQUEMA) == 'root ::= "{}"\nchar ::= [^"]\n'
+
+
+def test_gramatica_opciones():
+    gbnf = gramatica_opciones(["diagnostico", "busqueda"])
+    assert gbnf == 'root ::= " "? ("diagnostico" | "busqueda")\n'
+    LlamaGrammar.from_string(gbnf, verbose=False)
@@ -0,0 +1,138 @@
+import json
+
+import pytest
+from langchain_core.messages import HumanMessage, AIMessage
+
+from utils.conversation import HistorialJSONL
+
+
+def test_turnos_se_anaden_al_log_y_se_recargan(tmp_path, conversacion_jsonl, leer_registros):
+    ruta = tmp_path / "historiales" / "s1.jsonl"
+    conversacion = conversacion_jsonl(ruta)
+    conversacion.add_messages([HumanMessage(content="hola doctor"), AIMessage(content="hola, ¿qué le ocurre?")])
+    conversacion.add_user_message("me duele la cabeza")
+
+    registros = leer_registros(ruta)
+    assert [r["op"] for r in registros] == ["add", "add", "add"]
+    assert registros[0]["msg"] == {"type": "human", "content": "hola doctor", "tokens": 2, "tokenizador": "palabras"}
+
+    recargada = conversacion_jsonl(ruta)
+    assert [(m.type, m.content) for m in recargada.messages] == [
+        ("human", "hola doctor"), ("ai", "hola, ¿qué le ocurre?"), ("human", "me duele la cabeza"),
+    ]
+    assert recargada._total_tokens == conversacion._total_tokens == 10
+
+
+def test_recorte_escribe_registro_trim(tmp_path, conversacion_jsonl, leer_registros):
+    ruta = tmp_path / "s2.jsonl"
+    conversacion = conversacion_jsonl(ruta, max_messages=2)
+    for i in range(4):
+        conversacion.add_user_message(f"mensaje {i}")
+
+    registros = leer_registros(ruta)
+    assert [r["op"] for r in registros] == ["add", "add", "add", "trim", "add", "trim"]
+    assert all(r["n"] == 1 for r in registros if r["op"] == "trim")
+    assert [m.content for m in conversacion_jsonl(ruta, max_messages=2).messages] == ["mensaje 2", "mensaje 3"]
+
+
+def test_recorte_por_tokens_conserva_el_ultimo(tmp_path, conversacion_jsonl):
+    ruta = tmp_path / "s3.jsonl"
+    conversacion = conversacion_jsonl(ruta, max_context_tokens=12, token_buffer=5)
+    conversacion.add_user_message("uno dos tres cuatro")
+    conversacion.add_user_message("cinco seis siete ocho")
+    assert [m.content for m in conversacion.messages] == ["cinco seis siete ocho"]
+    assert conversacion._calculate_context_usage() == 4
+
+
+def test_mensaje_demasiado_largo(tmp_path, conversacion_jsonl):
+    conversacion = conversacion_jsonl(tmp_path / "s4.jsonl", max_context_tokens=10, token_buffer=5)
+    with pytest.raises(ValueError):
+        conversacion.add_user_message("a b c d e f g")
+
+
+def test_linea_corrupta_se_ignora_y_se_repara(tmp_path, conversacion_jsonl, leer_registros):
+    ruta = tmp_path / "s5.jsonl"
+    conversacion = conversacion_jsonl(ruta)
+    conversacion.add_user_message("primero")
+    conversacion.add_ai_message("segundo")
+    with open(ruta, "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "msg": {"type": "hum')
+
+    with pytest.warns(UserWarning):
+        recargada = conversacion_jsonl(ruta)
+    assert [m.content for m in recargada.messages] == ["primero", "segundo"]
+    # Reescrito sin el trozo roto: el siguiente registro queda en su propia línea
+    recargada.add_user_message("tercero")
+    assert [r["msg"]["content"] for r in leer_registros(ruta)] == ["primero", "segundo", "tercero"]
+
+
+def test_convierte_historial_json_antiguo(tmp_path, conversacion_jsonl, leer_registros):
+    antiguo = tmp_path / "s6.json"
+    antiguo.write_text(json.dumps([
+        {"type": "human", "content": "¿qué es la diabetes?"},
+        {"type": "ai", "content": "Una enfermedad metabólica."},
+    ]), encoding="utf-8")
+
+    conversacion = conversacion_jsonl(tmp_path / "s6.jsonl")
+    assert [m.content for m in conversacion.messages] == ["¿qué es la diabetes?", "Una enfermedad metabólica."]
+    assert not antiguo.exists()
+    assert len(leer_registros(tmp_path / "s6.jsonl")) == 2
+
+
+def test_compactar_deja_solo_los_vivos(tmp_path, conversacion_jsonl, leer_registros):
+    ruta = tmp_path / "s7.jsonl"
+    conversacion = conversacion_jsonl(ruta, max_messages=2)
+    for i in range(6):
+        conversacion.add_user_message(f"m{i}")
+    assert len(leer_registros(ruta)) > 2
+
+    historial = HistorialJSONL(str(ruta))
+    historial.compactar()
+    assert [r["msg"]["content"] for r in leer_registros(ruta)] == ["m4", "m5"]
+    assert historial.registros == 2
+
+
+def test_recuentos_de_otro_tokenizador_se_recalculan(tmp_path, conversacion_jsonl):
+    ruta = tmp_path / "s8.jsonl"
+    conversacion_jsonl(ruta).add_user_message("uno dos tres")
+
+    por_caracteres = conversacion_jsonl(ruta, tokenizer=len, tokenizer_name="caracteres")
+    assert por_caracteres._tokens == [len("uno dos tres")]
+    # Mismo nombre: se reutiliza el recuento guardado sin volver a tokenizar
+    contados = []
+    conversacion_jsonl(ruta, tokenizer=lambda t: contados.append(t) or 0, tokenizer_name="palabras")
+    assert contados == []
+
+
+def test_configurar_solo_recuenta_si_cambia_el_tokenizador(tmp_path, conversacion_jsonl):
+    contados = []
+
+    def contar(texto):
+        contados.append(texto)
+        return len(texto)
+
+    conversacion = conversacion_jsonl(tmp_path / "s9.jsonl", tokenizer=contar)
+    conversacion.add_user_message("uno dos")
+    contados.clear()
+    # Sin nombre: el mismo objeto en cada petición no recuenta
+    conversacion.configurar(max_context_tokens=10000, tokenizer=contar)
+    conversacion.configurar(max_context_tokens=500, tokenizer=contar)
+    assert contados == [] and conversacion._total_tokens == 7
+
+    conversacion.configurar(max_context_tokens=500, tokenizer=lambda t: 1)
+    assert conversacion._total_tokens == 1
+    # Con nombre manda el nombre, no el objeto
+    conversacion.configurar(max_context_tokens=500, tokenizer=contar, tokenizer_name="caracteres")
+    assert conversacion._total_tokens == 7
+    conversacion.configurar(max_context_tokens=500, tokenizer=lambda t: 1, tokenizer_name="caracteres")
+    assert conversacion._total_tokens == 7
+
+
+def test_clear_vacia_el_log(tmp_path, conversacion_jsonl, leer_registros):
+    ruta = tmp_path / "s9.jsonl"
+    conversacion = conversacion_jsonl(ruta)
+    conversacion.add_user_message("hola")
+    conversacion.clear()
+    assert conversacion.messages == []
+    assert leer_registros(ruta) == []
+    assert conversacion_jsonl(ruta).messages == []
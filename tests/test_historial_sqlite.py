@@ -0,0 +1,123 @@
+import json
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage, AIMessage
+
+from utils import historial_sqlite
+from utils.conversation import Conversation, HistorialJSONL
+from utils.historial_sqlite import HistorialSQLite, clave_historial, migrar, purgar_inactivas
+
+
+@pytest.fixture
+def ruta_db(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "db" / "historiales.sqlite3")
+    monkeypatch.setattr(historial_sqlite, "RUTA_DB", ruta)
+    return ruta
+
+
+def _contenidos(mensajes):
+    return [(m["type"], m["content"]) for m in mensajes]
+
+
+def test_clave_historial():
+    assert clave_historial("historiales/006.jsonl") == ("historiales", "006")
+    assert clave_historial("pdf_analysis/session_006.jsonl") == ("pdf_analysis", "session_006")
+
+
+def test_conversacion_sqlite_ida_y_vuelta(ruta_db, tmp_path):
+    ruta = str(tmp_path / "historiales" / "s1.jsonl")
+    conversacion = Conversation(file_path=ruta, backend="sqlite", max_messages=3)
+    conversacion.add_messages([HumanMessage(content="hola"), AIMessage(content="buenas")])
+    conversacion.add_messages([HumanMessage(content="tengo fiebre"), AIMessage(content="¿desde cuándo?")])
+
+    # El recorte borra filas: en la base solo quedan los vivos, con su recuento de tokens
+    guardados = HistorialSQLite(ruta).cargar()
+    assert _contenidos(guardados) == [("ai", "buenas"), ("human", "tengo fiebre"), ("ai", "¿desde cuándo?")]
+    assert guardados[1]["tokens"] == 2 and guardados[1]["tokenizador"] == "palabras"
+
+    recargada = Conversation(file_path=ruta, backend="sqlite", max_messages=3)
+    assert [m.content for m in recargada.messages] == ["buenas", "tengo fiebre", "¿desde cuándo?"]
+
+
+def test_sesiones_y_colecciones_separadas(ruta_db, tmp_path):
+    HistorialSQLite(str(tmp_path / "historiales" / "a.jsonl")).agregar([{"type": "human", "content": "a"}])
+    HistorialSQLite(str(tmp_path / "pdf_analysis" / "a.jsonl")).agregar([{"type": "human", "content": "pdf"}])
+
+    assert _contenidos(HistorialSQLite(str(tmp_path / "historiales" / "a.jsonl")).cargar()) == [("human", "a")]
+    assert _contenidos(HistorialSQLite(str(tmp_path / "pdf_analysis" / "a.jsonl")).cargar()) == [("human", "pdf")]
+    assert not HistorialSQLite(str(tmp_path / "historiales" / "b.jsonl")).existe()
+
+
+def test_resumen_y_borrado(ruta_db, tmp_path):
+    historial = HistorialSQLite(str(tmp_path / "historiales" / "s2.jsonl"))
+    historial.agregar([{"type": "human", "content": f"m{i}"} for i in range(4)])
+    historial.agregar([], recortados=2, resumen={"texto": "resumen", "tokens": 1, "tokenizador": "palabras"})
+
+    assert _contenidos(historial.cargar()) == [("human", "m2"), ("human", "m3")]
+    assert historial.obtener_resumen() == {"texto": "resumen", "tokens": 1, "tokenizador": "palabras"}
+    assert historial.borrar() == 2
+    assert historial.cargar() == [] and historial.obtener_resumen() is None
+
+
+def test_migracion_ida_y_vuelta(ruta_db, tmp_path):
+    historiales = tmp_path / "historiales"
+    pdfs = tmp_path / "pdf_analysis"
+    historiales.mkdir()
+    pdfs.mkdir()
+
+    # Log JSONL con recorte y resumen
+    log = HistorialJSONL(str(historiales / "s1.jsonl"))
+    log.agregar([{"type": "human", "content": "uno"}, {"type": "ai", "content": "dos"},
+                 {"type": "human", "content": "tres"}])
+    log.agregar([], recortados=1, resumen={"texto": "antes: uno", "tokens": 2, "tokenizador": "palabras"})
+    # Historial antiguo en JSON
+    (pdfs / "session_s2.json").write_text(json.dumps([
+        {"type": "human", "content": "analiza mi hemograma"},
+        {"type": "ai", "content": "Valores normales."},
+    ]), encoding="utf-8")
+    # Corrupto y ajeno
+    (historiales / "roto.json").write_text("[{", encoding="utf-8")
+    (historiales / "notas.txt").write_text("no es un historial", encoding="utf-8")
+
+    with pytest.warns(UserWarning):
+        resumen = migrar([str(historiales), str(pdfs)], ruta_db)
+    assert resumen == {"importadas": 2, "omitidas": 0, "errores": 1, "mensajes": 4}
+
+    s1 = HistorialSQLite(str(historiales / "s1.jsonl"), ruta_db)
+    assert _contenidos(s1.cargar()) == [("ai", "dos"), ("human", "tres")]
+    assert s1.obtener_resumen()["texto"] == "antes: uno"
+    s2 = HistorialSQLite(str(pdfs / "session_s2.jsonl"), ruta_db)
+    assert _contenidos(s2.cargar()) == [("human", "analiza mi hemograma"), ("ai", "Valores normales.")]
+
+    # Lo migrado se lee igual a través de Conversation
+    conversacion = Conversation(file_path=str(historiales / "s1.jsonl"), backend="sqlite")
+    assert [m.content for m in conversacion.messages][1:] == ["dos", "tres"]
+
+    # Segunda pasada: ya existen
+    with pytest.warns(UserWarning):
+        assert migrar([str(historiales), str(pdfs)], ruta_db)["omitidas"] == 2
+
+    # Reemplazando y borrando los archivos importados
+    with pytest.warns(UserWarning):
+        resumen = migrar([str(historiales)], ruta_db, reemplazar=True, borrar=True)
+    assert resumen["importadas"] == 1
+    assert not (historiales / "s1.jsonl").exists()
+    assert (historiales / "roto.json").exists()
+    assert _contenidos(s1.cargar()) == [("ai", "dos"), ("human", "tres")]
+
+
+def test_purgar_inactivas(ruta_db, tmp_path):
+    vieja = HistorialSQLite(str(tmp_path / "historiales" / "vieja.jsonl"))
+    nueva = HistorialSQLite(str(tmp_path / "historiales" / "nueva.jsonl"))
+    vieja.reescribir([{"type": "human", "content": "a"}, {"type": "ai", "content": "b"}], creado=time.time() - 1000)
+    nueva.agregar([{"type": "human", "content": "c"}])
+
+    sesiones, mensajes = purgar_inactivas("historiales", time.time() - 500, ruta_db)
+    assert (sesiones, mensajes) == (["vieja"], 2)
+    assert not vieja.existe() and nueva.existe()
+
+    # Limitado a unas sesiones concretas
+    assert purgar_inactivas("historiales", time.time() + 1, ruta_db, sesiones=["otra"]) == ([], 0)
+    assert purgar_inactivas("historiales", time.time() + 1, ruta_db, sesiones=[]) == ([], 0)
+    assert nueva.existe()
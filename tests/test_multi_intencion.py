@@ -0,0 +1,79 @@
+import pytest
+
+from agents import orquestador as modulo
+from agents.orquestador import Orquestador, PATRONES_CLASIFICACION, _CONECTORES
+from utils.funcionalidades import FuncionalidadMedica
+from utils.intenciones import ClasificadorIntenciones
+
+DOS_PETICIONES = "Tengo este hemograma y ¿dónde hay un hospital cerca?"
+TRES_PETICIONES = "Quiero interpretar mi hemograma. ¿Qué es la anemia? También, ¿dónde hay un hospital cerca?"
+
+
+def _partes(mensaje):
+    return [parte for parte in _CONECTORES.split(mensaje) if parte and parte.strip()]
+
+
+@pytest.fixture
+def orquestador(monkeypatch):
+    # Solo lo que usan la detección y la unión de intenciones: sin modelos ni sesiones
+    monkeypatch.setattr(modulo, "MULTI_INTENCION", True)
+    orquestador = Orquestador.__new__(Orquestador)
+    orquestador.clasificador_patrones = ClasificadorIntenciones(PATRONES_CLASIFICACION)
+    orquestador.agentes = {f.key: object() for f in FuncionalidadMedica}
+    orquestador.enrutamientos = []
+    orquestador._contar_enrutamiento = orquestador.enrutamientos.append
+    return orquestador
+
+
+def test_separacion_por_fin_de_frase_y_conectores():
+    assert _partes(DOS_PETICIONES) == ["Tengo este hemograma", "dónde hay un hospital cerca"]
+    assert _partes("Me duele la cabeza, además tengo fiebre") == ["Me duele la cabeza", "tengo fiebre"]
+    # "y" dentro de una palabra no separa
+    assert _partes("Ayer me hice el examen mayor") == ["Ayer me hice el examen mayor"]
+
+
+def test_una_sola_intencion_sigue_la_clasificacion_normal(orquestador):
+    # Una sola parte, aunque puntúe en dos intenciones
+    assert orquestador._detectar_intenciones("qué significa mi resultado de sangre") == []
+    # Dos partes, pero solo una con intención clara
+    assert orquestador._detectar_intenciones("Me duele la cabeza y ¿dónde hay un hospital cerca?") == []
+    assert orquestador.enrutamientos == []
+
+
+def test_desactivado(orquestador, monkeypatch):
+    monkeypatch.setattr(modulo, "MULTI_INTENCION", False)
+    assert orquestador._detectar_intenciones(DOS_PETICIONES) == []
+
+
+def test_dos_intenciones_de_mayor_a_menor_puntuacion(orquestador):
+    assert orquestador._detectar_intenciones(DOS_PETICIONES) == ["buscador_centros", "interpretacion_examenes"]
+    assert orquestador.enrutamientos == ["multi"]
+
+
+def test_un_agente_por_intencion_y_como_mucho_max_intenciones(orquestador, monkeypatch):
+    assert orquestador._detectar_intenciones(TRES_PETICIONES) == [
+        "buscador_centros", "interpretacion_examenes", "explicacion",
+    ]
+    monkeypatch.setattr(modulo, "MAX_INTENCIONES", 2)
+    assert orquestador._detectar_intenciones(TRES_PETICIONES) == ["buscador_centros", "interpretacion_examenes"]
+
+    # El mismo agente no atiende dos peticiones del mensaje
+    comun = object()
+    orquestador.agentes["buscador_centros"] = orquestador.agentes["interpretacion_examenes"] = comun
+    assert orquestador._detectar_intenciones(DOS_PETICIONES) == []
+
+
+def test_union_en_el_orden_de_las_intenciones(orquestador):
+    secciones = [
+        Orquestador._seccion("buscador_centros", {"output": "Hospital San Juan", "metadata": {"km": 2}}, 0.5),
+        Orquestador._seccion("interpretacion_examenes", "Hemoglobina normal", 1.25),
+    ]
+    resultado = orquestador._combinar_secciones("s1", secciones, 1.3)
+
+    assert resultado["funcionalidad"] == "buscador_centros"
+    assert resultado["metadata"]["intenciones"] == ["buscador_centros", "interpretacion_examenes"]
+    assert resultado["metadata"]["segundos_secuencial"] == 1.75
+    texto = resultado["respuesta"]["output"]
+    assert texto.index("Hospital San Juan") < texto.index("Hemoglobina normal")
+    assert texto.startswith(Orquestador._encabezado_seccion("buscador_centros"))
+    assert resultado["respuesta"]["metadata"]["secciones"][0]["metadata"] == {"km": 2}
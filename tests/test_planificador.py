@@ -0,0 +1,146 @@
+import threading
+
+import pytest
+
+from utils.planificador import PlanificadorInferencia
+
+ESPERA = 5
+
+
+def _bloquear(planificador, prefijo=None):
+    """Ocupa el trabajador hasta que se libera el evento devuelto."""
+    liberar = threading.Event()
+    empezado = threading.Event()
+
+    def trabajo():
+        empezado.set()
+        liberar.wait(ESPERA)
+
+    futuro = planificador.enviar(trabajo, prefijo=prefijo)
+    assert empezado.wait(ESPERA)
+    return liberar, futuro
+
+
+def _registrar(orden, nombre):
+    def trabajo():
+        orden.append(nombre)
+        return nombre
+    return trabajo
+
+
+def test_fifo_entre_peticiones_sin_prefijo():
+    planificador = PlanificadorInferencia("fifo")
+    liberar, _ = _bloquear(planificador)
+    orden = []
+    futuros = [planificador.enviar(_registrar(orden, n)) for n in "abc"]
+    liberar.set()
+
+    assert [f.result(ESPERA) for f in futuros] == ["a", "b", "c"]
+    assert orden == ["a", "b", "c"]
+    assert planificador.metricas()["por_afinidad"] == 0
+
+
+def test_afinidad_adelanta_el_mismo_prefijo():
+    planificador = PlanificadorInferencia("afinidad", max_afinidad=4)
+    liberar, _ = _bloquear(planificador, prefijo="diagnostico")
+    orden = []
+    futuros = [
+        planificador.enviar(_registrar(orden, "otro"), prefijo="busqueda"),
+        planificador.enviar(_registrar(orden, "mismo1"), prefijo="diagnostico"),
+        planificador.enviar(_registrar(orden, "mismo2"), prefijo="diagnostico"),
+    ]
+    liberar.set()
+    for futuro in futuros:
+        futuro.result(ESPERA)
+
+    assert orden == ["mismo1", "mismo2", "otro"]
+    assert planificador.metricas()["por_afinidad"] == 2
+
+
+def test_afinidad_limitada_por_racha():
+    planificador = PlanificadorInferencia("racha", max_afinidad=2)
+    liberar, _ = _bloquear(planificador, prefijo="diagnostico")
+    orden = []
+    futuros = [
+        planificador.enviar(_registrar(orden, "otro"), prefijo="busqueda"),
+        planificador.enviar(_registrar(orden, "mismo1"), prefijo="diagnostico"),
+        planificador.enviar(_registrar(orden, "mismo2"), prefijo="diagnostico"),
+    ]
+    liberar.set()
+    for futuro in futuros:
+        futuro.result(ESPERA)
+
+    # Tras dos seguidas del mismo prefijo se atiende la más antigua
+    assert orden == ["mismo1", "otro", "mismo2"]
+
+
+def test_coalescencia_comparte_resultado():
+    planificador = PlanificadorInferencia("coalescencia")
+    liberar, _ = _bloquear(planificador)
+    llamadas = []
+
+    def trabajo():
+        llamadas.append(1)
+        return "respuesta"
+
+    primero = planificador.enviar(trabajo, clave="misma")
+    segundo = planificador.enviar(trabajo, clave="misma")
+    distinto = planificador.enviar(trabajo, clave="otra")
+    liberar.set()
+
+    assert primero.result(ESPERA) == segundo.result(ESPERA) == distinto.result(ESPERA) == "respuesta"
+    assert len(llamadas) == 2
+    assert planificador.metricas()["coalescidas"] == 1
+
+
+def test_sin_coalescencia_tras_empezar():
+    # La clave solo une peticiones que esperan en cola, no a la que ya se está generando
+    planificador = PlanificadorInferencia("en_curso")
+    liberar = threading.Event()
+    empezado = threading.Event()
+
+    def lento():
+        empezado.set()
+        liberar.wait(ESPERA)
+        return "primera"
+
+    primero = planificador.enviar(lento, clave="misma")
+    assert empezado.wait(ESPERA)
+    segundo = planificador.enviar(lambda: "segunda", clave="misma")
+    liberar.set()
+
+    assert primero.result(ESPERA) == "primera"
+    assert segundo.result(ESPERA) == "segunda"
+    assert planificador.metricas()["coalescidas"] == 0
+
+
+def test_errores_y_metricas():
+    planificador = PlanificadorInferencia("errores")
+
+    def falla():
+        raise RuntimeError("sin modelo")
+
+    futuro = planificador.enviar(falla)
+    with pytest.raises(RuntimeError):
+        futuro.result(ESPERA)
+    assert planificador.enviar(lambda: 1).result(ESPERA) == 1
+
+    metricas = planificador.metricas()
+    assert metricas["errores"] == 1
+    assert metricas["atendidas"] == 2
+    assert metricas["en_cola"] == 0
+
+
+def test_llamada_desde_el_trabajador_no_se_bloquea():
+    planificador = PlanificadorInferencia("reentrante")
+
+    def externo():
+        return planificador.enviar(lambda: "interno").result(ESPERA)
+
+    assert planificador.enviar(externo).result(ESPERA) == "interno"
+
+
+def test_stream_entrega_fragmentos_en_orden():
+    planificador = PlanificadorInferencia("stream")
+    fragmentos = list(planificador.enviar_stream(lambda: iter(["a", "b", "c"])))
+    assert fragmentos == ["a", "b", "c"]
@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+from langchain_core.messages import SystemMessage
+
+from utils.conversation import PREFIJO_RESUMEN
+
+ESPERA = 5
+
+
+def _esperar_resumen(conversacion):
+    limite = time.monotonic() + ESPERA
+    while conversacion._resumiendo:
+        assert time.monotonic() < limite, "el resumen no terminó"
+        time.sleep(0.01)
+
+
+def _resumidor(llamadas):
+    def resumir(previo, mensajes):
+        llamadas.append((previo, [m.content for m in mensajes]))
+        return " | ".join(filter(None, [previo] + [m.content for m in mensajes]))
+    return resumir
+
+
+@pytest.fixture
+def conversacion_resumida(conversacion_jsonl):
+    """Conversación JSONL en modo resumen con una ventana de 4 mensajes."""
+    def crear(ruta, resumidor, **kwargs):
+        return conversacion_jsonl(ruta, summary_window=4, summarizer=resumidor, **kwargs)
+    return crear
+
+
+def test_turnos_antiguos_pasan_al_resumen(tmp_path, conversacion_resumida, leer_registros):
+    ruta = tmp_path / "s1.jsonl"
+    llamadas = []
+    conversacion = conversacion_resumida(ruta, _resumidor(llamadas))
+    for i in range(6):
+        conversacion.add_user_message(f"m{i}")
+    _esperar_resumen(conversacion)
+
+    assert llamadas == [("", ["m0", "m1"])]
+    mensajes = conversacion.messages
+    assert isinstance(mensajes[0], SystemMessage)
+    assert mensajes[0].content == PREFIJO_RESUMEN + "m0 | m1"
+    assert [m.content for m in mensajes[1:]] == ["m2", "m3", "m4", "m5"]
+    assert conversacion._calculate_context_usage() == 4 + 3
+
+    # En el log: un recorte de los resumidos y el resumen que los sustituye
+    registros = leer_registros(ruta)
+    assert registros[-2:] == [
+        {"op": "trim", "n": 2},
+        {"op": "summary", "resumen": {"texto": "m0 | m1", "tokens": 3, "tokenizador": "palabras"}},
+    ]
+
+    recargada = conversacion_resumida(ruta, _resumidor([]))
+    assert [m.content for m in recargada.messages] == [m.content for m in mensajes]
+    assert recargada._resumen_tokens == 3
+
+
+def test_el_resumen_se_acumula(tmp_path, conversacion_resumida):
+    llamadas = []
+    conversacion = conversacion_resumida(tmp_path / "s2.jsonl", _resumidor(llamadas))
+    for i in range(6):
+        conversacion.add_user_message(f"m{i}")
+    _esperar_resumen(conversacion)
+    for i in range(6, 8):
+        conversacion.add_user_message(f"m{i}")
+    _esperar_resumen(conversacion)
+
+    assert llamadas[1] == ("m0 | m1", ["m2", "m3"])
+    assert conversacion.messages[0].content == PREFIJO_RESUMEN + "m0 | m1 | m2 | m3"
+    assert [m.content for m in conversacion.messages[1:]] == ["m4", "m5", "m6", "m7"]
+
+
+def test_en_modo_resumen_no_se_recorta_por_cantidad(tmp_path, conversacion_resumida, leer_registros):
+    ruta = tmp_path / "s3.jsonl"
+    liberar = threading.Event()
+
+    def lento(previo, mensajes):
+        liberar.wait(ESPERA)
+        return "resumen"
+
+    conversacion = conversacion_resumida(ruta, lento, max_messages=3)
+    for i in range(6):
+        conversacion.add_user_message(f"m{i}")
+
+    # Mientras se resume, los mensajes siguen enteros en el prompt
+    assert [m.content for m in conversacion.messages] == [f"m{i}" for i in range(6)]
+    assert all(r["op"] == "add" for r in leer_registros(ruta))
+    liberar.set()
+    _esperar_resumen(conversacion)
+    # Solo salen los integrados en el resumen; la ventana manda, no max_messages
+    assert [m.content for m in conversacion.messages[1:]] == ["m2", "m3", "m4", "m5"]
+
+
+def test_error_del_resumidor_conserva_los_mensajes(tmp_path, conversacion_resumida):
+    def falla(previo, mensajes):
+        raise RuntimeError("modelo ocupado")
+
+    conversacion = conversacion_resumida(tmp_path / "s4.jsonl", falla)
+    with pytest.warns(UserWarning):
+        for i in range(6):
+            conversacion.add_user_message(f"m{i}")
+        _esperar_resumen(conversacion)
+    assert [m.content for m in conversacion.messages] == [f"m{i}" for i in range(6)]
+
+
+def test_clear_descarta_el_resumen_en_curso(tmp_path, conversacion_resumida, leer_registros):
+    ruta = tmp_path / "s5.jsonl"
+    liberar = threading.Event()
+
+    def lento(previo, mensajes):
+        liberar.wait(ESPERA)
+        return "resumen viejo"
+
+    conversacion = conversacion_resumida(ruta, lento)
+    for i in range(6):
+        conversacion.add_user_message(f"m{i}")
+    conversacion.clear()
+    liberar.set()
+    _esperar_resumen(conversacion)
+
+    assert conversacion.messages == []
+    assert leer_registros(ruta) == []
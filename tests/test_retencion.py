@@ -0,0 +1,102 @@
+import os
+import time
+
+import pytest
+
+from utils import historial_sqlite
+from utils.retencion import Retencion, TipoArtefacto, DIA, MB
+
+
+@pytest.fixture
+def directorio(tmp_path, monkeypatch):
+    # La retención trabaja con rutas relativas (historiales/, pdf_analysis/, ...)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(historial_sqlite, "RUTA_DB", os.path.join("historiales", "historiales.sqlite3"))
+    for nombre in ("historiales", "pdf_analysis"):
+        os.makedirs(nombre)
+    return tmp_path
+
+
+def _archivo(ruta, antiguedad=0.0, tamano=10):
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write("x" * tamano)
+    mtime = time.time() - antiguedad
+    os.utime(ruta, (mtime, mtime))
+    return ruta
+
+
+TIPOS = [
+    TipoArtefacto("temporales", "historiales", ("clasificador_temp.json*", "*.tmp"), 3600),
+    TipoArtefacto("historiales", "historiales", ("*.jsonl",), 30 * DIA, sqlite=True),
+    TipoArtefacto("pdf_analisis", "pdf_analysis", ("analysis_*.json",), 0),
+]
+
+
+def test_caducidad_por_tipo(directorio):
+    _archivo("historiales/vieja.jsonl", 31 * DIA)
+    _archivo("historiales/reciente.jsonl", 29 * DIA)
+    # Primer tipo que coincide: temporal, aunque también encaje en historiales
+    _archivo("historiales/clasificador_temp.jsonl", 2 * 3600)
+    _archivo("historiales/escritura.tmp", 2 * 3600)
+    # TTL 0: no caduca nunca
+    _archivo("pdf_analysis/analysis_1.json", 1000 * DIA)
+    # No es un artefacto reconocido
+    _archivo("historiales/notas.txt", 1000 * DIA)
+
+    resumen = Retencion(TIPOS, tamano_maximo_mb=0).barrer()
+
+    assert resumen["caducados"] == 3
+    assert resumen["bytes"] == 30
+    assert sorted(os.listdir("historiales")) == ["notas.txt", "reciente.jsonl"]
+    assert os.listdir("pdf_analysis") == ["analysis_1.json"]
+
+
+def test_tope_de_tamano_borra_lo_mas_antiguo(directorio):
+    for i, antiguedad in enumerate([3, 1, 2, 0]):
+        _archivo(f"historiales/s{i}.jsonl", antiguedad * 3600, tamano=1000)
+
+    retencion = Retencion(TIPOS, tamano_maximo_mb=2500 / MB)
+    resumen = retencion.barrer()
+
+    assert resumen["por_tamano"] == 2
+    assert sorted(os.listdir("historiales")) == ["s1.jsonl", "s3.jsonl"]
+    metricas = retencion.metricas()
+    assert metricas["archivos_borrados"] == 2 and metricas["bytes_liberados"] == 2000
+    assert metricas["barridos"] == 1
+
+
+def test_purga_sesiones_inactivas_en_sqlite(directorio):
+    vieja = historial_sqlite.HistorialSQLite("historiales/vieja.jsonl")
+    nueva = historial_sqlite.HistorialSQLite("historiales/nueva.jsonl")
+    vieja.reescribir([{"type": "human", "content": "a"}], creado=time.time() - 31 * DIA)
+    nueva.agregar([{"type": "human", "content": "b"}])
+
+    resumen = Retencion(TIPOS, tamano_maximo_mb=0).barrer()
+
+    assert resumen["mensajes_sqlite"] == 1
+    assert not vieja.existe() and nueva.existe()
+
+
+def test_borrar_sesion(directorio):
+    _archivo("historiales/s1.jsonl")
+    _archivo("pdf_analysis/session_s1.json")
+    _archivo("historiales/s2.jsonl")
+    historial_sqlite.HistorialSQLite("historiales/s1.jsonl").agregar([{"type": "human", "content": "a"}])
+
+    retencion = Retencion(TIPOS, tamano_maximo_mb=0)
+    assert retencion.borrar_sesion("s1") == 20
+
+    assert not os.path.exists("historiales/s1.jsonl")
+    assert os.path.exists("historiales/s2.jsonl")
+    assert not os.path.exists("pdf_analysis/session_s1.json")
+    assert not historial_sqlite.HistorialSQLite("historiales/s1.jsonl").existe()
+    metricas = retencion.metricas()
+    assert metricas["sesiones_borradas"] == 1 and metricas["mensajes_sqlite_borrados"] == 1
+
+
+def test_directorios_ausentes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(historial_sqlite, "RUTA_DB", os.path.join("historiales", "historiales.sqlite3"))
+    assert Retencion(TIPOS, tamano_maximo_mb=1).barrer() == {
+        "caducados": 0, "por_tamano": 0, "bytes": 0, "mensajes_sqlite": 0,
+    }
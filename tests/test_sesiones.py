@@ -0,0 +1,119 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from utils import sesiones
+from utils.sesiones import AlmacenSesiones, SesionesMemoria, LOTE
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1_000_000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(sesiones, "time", SimpleNamespace(time=reloj))
+    return reloj
+
+
+@pytest.fixture(params=["memoria", "sqlite"])
+def backend(request, tmp_path):
+    return {"backend": request.param, "ruta_db": str(tmp_path / "db" / "historiales.sqlite3")}
+
+
+def test_uso_como_diccionario(reloj, backend):
+    almacen = AlmacenSesiones("pruebas", ttl=60, **backend)
+    almacen["s1"] = {"funcionalidad": "diagnostico"}
+
+    assert "s1" in almacen and "s2" not in almacen
+    assert almacen["s1"] == {"funcionalidad": "diagnostico"}
+    assert almacen.get("s2", {}) == {}
+    assert almacen.ids() == ["s1"] and len(almacen) == 1
+    with pytest.raises(KeyError):
+        almacen["s2"]
+
+    assert almacen.pop("s1") == {"funcionalidad": "diagnostico"}
+    assert almacen.pop("s1", "defecto") == "defecto"
+    almacen["s1"] = {}
+    del almacen["s1"]
+    with pytest.raises(KeyError):
+        del almacen["s1"]
+
+
+def test_caducidad_y_renovacion(reloj, backend):
+    almacen = AlmacenSesiones("pruebas", ttl=60, **backend)
+    almacen["a"] = {"n": 1}
+    almacen["b"] = {"n": 2}
+
+    reloj.ahora += 50
+    almacen["a"] = {"n": 3}  # renueva a
+    reloj.ahora += 20
+
+    assert almacen.get("b") is None
+    assert almacen.get("a") == {"n": 3}
+    reloj.ahora += 60
+    assert almacen.expirar() == ["a"]
+    assert len(almacen) == 0
+
+
+def test_expiran_en_orden_y_avisan(reloj, backend):
+    avisos = []
+    terminado = threading.Event()
+
+    def al_expirar(session_id, datos):
+        avisos.append((session_id, datos))
+        if len(avisos) == 3:
+            terminado.set()
+
+    almacen = AlmacenSesiones("pruebas", ttl=10, al_expirar=al_expirar, **backend)
+    for i, session_id in enumerate(["c", "a", "b"]):
+        reloj.ahora += 1
+        almacen[session_id] = {"orden": i}
+    reloj.ahora += 100
+
+    assert almacen.expirar() == ["c", "a", "b"]
+    assert terminado.wait(5)
+    assert sorted(avisos) == [("a", {"orden": 1}), ("b", {"orden": 2}), ("c", {"orden": 0})]
+    assert almacen.expirar() == []
+
+
+def test_lotes_limitados(reloj, backend):
+    almacen = AlmacenSesiones("pruebas", ttl=10, **backend)
+    for i in range(5):
+        almacen[f"s{i}"] = {}
+    reloj.ahora += 20
+
+    assert len(almacen.expirar(limite=2)) == 2
+    # Vencida pero aún no retirada: no se devuelve
+    assert almacen._backend.leer("s4") is not None
+    assert almacen.get("s4") is None
+    assert almacen.ids() == []
+
+
+def test_espacios_separados(reloj, tmp_path):
+    ruta_db = str(tmp_path / "db" / "historiales.sqlite3")
+    orquestador = AlmacenSesiones("orquestador", ttl=60, backend="sqlite", ruta_db=ruta_db)
+    contacto = AlmacenSesiones("contacto", ttl=60, backend="sqlite", ruta_db=ruta_db)
+    orquestador["s1"] = {"funcionalidad": "busqueda"}
+
+    assert "s1" not in contacto
+    # Otro proceso con la misma base ve el estado
+    assert AlmacenSesiones("orquestador", ttl=60, backend="sqlite", ruta_db=ruta_db)["s1"] == {
+        "funcionalidad": "busqueda"
+    }
+
+
+def test_monticulo_no_crece_con_las_renovaciones():
+    memoria = SesionesMemoria()
+    for i in range(10 * LOTE):
+        memoria.escribir("s1", {}, float(i))
+    assert len(memoria._vencimientos) <= 2 * len(memoria._datos) + LOTE
+    # Los vencimientos obsoletos no caducan la sesión renovada
+    assert memoria.caducadas(float(10 * LOTE - 2), LOTE) == []
+    assert memoria.caducadas(float(10 * LOTE), LOTE) == [("s1", {})]
@@ -0,0 +1,189 @@
+import os
+import json
+import glob
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, Sequence
+
+from utils.cache_respuestas import normalizar_pregunta
+from utils.cache_dos_niveles import CacheDosNiveles
+
+# Mensajes cuya clasificación se recuerda en memoria y en disco
+CAPACIDAD = int(os.getenv("CACHE_CLASIFICACION_CAPACIDAD", 4096))
+CAPACIDAD_DISCO = int(os.getenv("CACHE_CLASIFICACION_CAPACIDAD_DISCO", 50000))
+# Archivo SQLite del nivel en disco. Vacío para usar solo memoria.
+RUTA_DISCO = os.getenv("CACHE_CLASIFICACION_DB", os.path.join("cache", "clasificacion.sqlite3"))
+# Segundos entre comprobaciones de que los archivos vigilados (el prompt) no cambiaron
+INTERVALO_VIGILANCIA = 5.0
+
+# Ningún patrón coincidió; la clasificación sigue por el modelo estadístico o el LLM
+SIN_PATRON = "sin_patron"
+
+
+class CacheClasificacion:
+    """
+    Caché de la funcionalidad decidida para cada mensaje, con dos niveles
+    (LRU en memoria y tabla SQLite, ver utils/cache_dos_niveles.py), por mensaje
+    normalizado: "¿Qué es la diabetes?" y "que es la diabetes" comparten entrada.
+
+    Guarda también los resultados negativos (SIN_PATRON): el mensaje no
+    coincidió con ningún patrón, así que la próxima vez se salta la búsqueda
+    aunque la clasificación posterior falle.
+
+    Cada entrada lleva la versión de los patrones y de los archivos vigilados
+    (prompts/clasificador.txt). Si cambian, la memoria se vacía y el disco
+    descarta las demás versiones.
+    """
+
+    def __init__(self, capacidad: int = CAPACIDAD, ruta_disco: Optional[str] = RUTA_DISCO,
+                 capacidad_disco: int = CAPACIDAD_DISCO):
+        self._almacen = CacheDosNiveles("clasificación", capacidad, ruta_disco, capacidad_disco)
+        self._patrones: Dict[str, List[str]] = {}
+        self._vigilados: Dict[str, Optional[float]] = {}  # ruta -> mtime
+        self._ultima_vigilancia = 0.0
+        self._lock = threading.Lock()
+        self._metricas = {"negativos": 0, "invalidaciones": 0, "calentadas": 0}
+
+    @property
+    def version(self) -> str:
+        return self._almacen.version
+
+    @staticmethod
+    def _mtime(ruta: str) -> Optional[float]:
+        try:
+            return os.path.getmtime(ruta)
+        except OSError:
+            return None
+
+    def configurar(self, patrones: Dict[str, List[str]], vigilados: Sequence[str] = ()) -> None:
+        """
+        Fija la versión de las entradas válidas. Se llama al crear el orquestador
+        y cada vez que cambian sus patrones.
+
+        Args:
+            patrones: Patrones de clasificación vigentes
+            vigilados: Archivos cuyo contenido decide la clasificación (prompt del clasificador)
+        """
+        with self._lock:
+            self._patrones = {k: list(v) for k, v in patrones.items()}
+            self._vigilados = {ruta: self._mtime(ruta) for ruta in vigilados}
+            self._actualizar_version()
+
+    def _actualizar_version(self) -> None:
+        """Recalcula la versión y, si cambió, invalida. Debe llamarse con el candado tomado."""
+        resumen = hashlib.sha256(json.dumps(self._patrones, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        for ruta in sorted(self._vigilados):
+            try:
+                with open(ruta, "rb") as f:
+                    resumen.update(f.read())
+            except OSError:
+                pass
+        anterior = self.version
+        if self._almacen.cambiar_version(resumen.hexdigest()[:16]) and anterior:
+            print("[CACHE CLASIFICACION] Patrones o prompt del clasificador modificados: caché invalidada")
+            self._metricas["invalidaciones"] += 1
+
+    def _vigilar(self) -> None:
+        """Invalida si algún archivo vigilado cambió. Debe llamarse con el candado tomado."""
+        ahora = time.monotonic()
+        if ahora - self._ultima_vigilancia < INTERVALO_VIGILANCIA:
+            return
+        self._ultima_vigilancia = ahora
+        cambiados = {ruta: self._mtime(ruta) for ruta in self._vigilados}
+        if cambiados != self._vigilados:
+            self._vigilados = cambiados
+            self._actualizar_version()
+
+    def obtener(self, mensaje: str) -> Optional[Tuple[Optional[str], str]]:
+        """
+        (funcionalidad, fuente) guardada para el mensaje, o None si no se conoce.
+        Un resultado negativo es (None, SIN_PATRON).
+        """
+        with self._lock:
+            self._vigilar()
+            entrada = self._almacen.obtener(normalizar_pregunta(mensaje))
+            if entrada is None:
+                return None
+            # Del disco vuelve como lista
+            entrada = tuple(entrada)
+            if entrada[0] is None:
+                self._metricas["negativos"] += 1
+            return entrada
+
+    def guardar(self, mensaje: str, funcionalidad: Optional[str], fuente: str) -> None:
+        """
+        Recuerda la clasificación de un mensaje.
+
+        Args:
+            mensaje: Mensaje del usuario (se normaliza)
+            funcionalidad: Funcionalidad decidida, o None con fuente SIN_PATRON
+            fuente: Nivel que la decidió (patrones, estadistico, llm)
+        """
+        with self._lock:
+            self._almacen.guardar(normalizar_pregunta(mensaje), (funcionalidad, fuente))
+
+    def _leer_registros(self, registros: Sequence[str]) -> "OrderedDict[str, Tuple[Optional[str], str]]":
+        """Clasificaciones de esta versión en los registros, de la más a la menos reciente."""
+        capacidad = self._almacen.capacidad
+        recientes: "OrderedDict[str, Tuple[Optional[str], str]]" = OrderedDict()
+        rutas = sorted(ruta for patron in registros for ruta in glob.glob(patron))
+        # Del día más reciente hacia atrás, hasta llenar la capacidad
+        for ruta in reversed(rutas):
+            try:
+                with open(ruta, encoding="utf-8") as f:
+                    lineas = f.readlines()
+            except OSError:
+                continue
+            for linea in reversed(lineas):
+                try:
+                    entrada = json.loads(linea)
+                except json.JSONDecodeError:
+                    continue
+                if entrada.get("version") != self.version or not entrada.get("mensaje"):
+                    continue
+                clave = normalizar_pregunta(entrada["mensaje"])
+                if clave not in recientes:
+                    recientes[clave] = (entrada.get("funcionalidad"), entrada.get("fuente", ""))
+                if len(recientes) >= capacidad:
+                    return recientes
+        return recientes
+
+    def calentar(self, registros: Sequence[str]) -> int:
+        """
+        Carga en memoria lo más reciente de esta versión: primero del disco y, si
+        está vacío, del registro de tráfico del clasificador (ver
+        utils/clasificador_ngramas.py), solo con entradas de la misma versión.
+
+        Args:
+            registros: Globs de los registros diarios
+
+        Returns:
+            Entradas cargadas
+        """
+        with self._lock:
+            cargadas = self._almacen.precargar(self._almacen.capacidad)
+            desde_registro = not cargadas
+            if desde_registro:
+                recientes = self._leer_registros(registros)
+                # El más reciente queda al final del LRU
+                self._almacen.guardar_varios(reversed(recientes.items()))
+                cargadas = len(recientes)
+            self._metricas["calentadas"] += cargadas
+        if cargadas:
+            print(f"[CACHE CLASIFICACION] {cargadas} clasificaciones precargadas "
+                  f"{'del registro' if desde_registro else 'del disco'}")
+        return cargadas
+
+    def limpiar(self) -> None:
+        """Vacía ambos niveles."""
+        self._almacen.limpiar()
+
+    def metricas(self) -> Dict[str, Any]:
+        """Contadores de aciertos y fallos."""
+        metricas = self._almacen.metricas()
+        with self._lock:
+            metricas.update(self._metricas)
+            metricas["version"] = self.version
+        return metricas
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import warnings
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+
+# Escrituras en disco entre dos limpiezas (caducadas y exceso sobre la capacidad)
+ESCRITURAS_POR_LIMPIEZA = 100
+
+
+class CacheDosNiveles:
+    """
+    Almacén clave -> valor con dos niveles, base de las cachés de respuestas y
+    de clasificación.
+
+    - Memoria: LRU con tamaño máximo.
+    - Disco: tabla SQLite, para que los aciertos sobrevivan a un reinicio. Al
+      superar su capacidad se borran las entradas usadas hace más tiempo.
+
+    Los valores se guardan en disco como JSON (una tupla vuelve como lista).
+    Cada entrada puede caducar (`ttl`) y lleva la versión con la que se guardó:
+    solo se devuelven las de la versión actual (ver `cambiar_version`).
+    """
+
+    def __init__(self, nombre: str, capacidad: int, ruta_disco: Optional[str], capacidad_disco: int,
+                 ttl: Optional[float] = None):
+        """
+        Args:
+            nombre: Nombre de la caché en los avisos ("respuestas", "clasificación")
+            capacidad: Entradas en memoria
+            ruta_disco: Archivo SQLite del nivel en disco, o None para usar solo memoria
+            capacidad_disco: Entradas en disco
+            ttl: Segundos que es válida una entrada, o None si no caducan
+        """
+        self.nombre = nombre
+        self.capacidad = capacidad
+        self.ruta_disco = ruta_disco
+        self.capacidad_disco = capacidad_disco
+        self.ttl = ttl
+        self.version = ""
+        self._memoria: "OrderedDict[str, Tuple[Optional[float], Any]]" = OrderedDict()  # clave -> (expira, valor)
+        self._lock = threading.Lock()
+        self._conexion: Optional[sqlite3.Connection] = None
+        self._escrituras = 0
+        self._metricas = {
+            "aciertos_memoria": 0,
+            "aciertos_disco": 0,
+            "fallos": 0,
+            "guardadas": 0,
+            "expulsadas": 0,
+        }
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """Abre el nivel en disco la primera vez. Debe llamarse con el candado tomado."""
+        if self._conexion is None and self.ruta_disco:
+            try:
+                os.makedirs(os.path.dirname(self.ruta_disco) or ".", exist_ok=True)
+                self._conexion = sqlite3.connect(self.ruta_disco, check_same_thread=False)
+                self._conexion.execute("PRAGMA journal_mode=WAL")
+                self._conexion.execute(
+                    "CREATE TABLE IF NOT EXISTS entradas ("
+                    "clave TEXT PRIMARY KEY, valor TEXT NOT NULL, version TEXT NOT NULL, "
+                    "expira REAL, ultimo_uso REAL NOT NULL)"
+                )
+                self._conexion.commit()
+            except sqlite3.Error as e:
+                warnings.warn(f"No se pudo abrir la caché de {self.nombre} en {self.ruta_disco}: {str(e)}")
+                self.ruta_disco = None
+                self._conexion = None
+        return self._conexion
+
+    def _guardar_memoria(self, clave: str, expira: Optional[float], valor: Any) -> None:
+        self._memoria[clave] = (expira, valor)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.capacidad:
+            self._memoria.popitem(last=False)
+            self._metricas["expulsadas"] += 1
+
+    def _guardar_disco(self, filas: List[Tuple[str, Any]], expira: Optional[float], ahora: float) -> None:
+        """Debe llamarse con el candado tomado."""
+        db = self._db()
+        if db is None:
+            return
+        try:
+            db.executemany(
+                "INSERT OR REPLACE INTO entradas (clave, valor, version, expira, ultimo_uso) VALUES (?, ?, ?, ?, ?)",
+                [(clave, json.dumps(valor, ensure_ascii=False), self.version, expira, ahora) for clave, valor in filas],
+            )
+            self._escrituras += len(filas)
+            # Limpieza del disco cada cierto número de escrituras, no en cada una
+            if self._escrituras >= ESCRITURAS_POR_LIMPIEZA:
+                self._escrituras = 0
+                db.execute("DELETE FROM entradas WHERE expira <= ?", (ahora,))
+                db.execute(
+                    "DELETE FROM entradas WHERE clave IN ("
+                    "SELECT clave FROM entradas ORDER BY ultimo_uso DESC LIMIT -1 OFFSET ?)",
+                    (self.capacidad_disco,),
+                )
+            db.commit()
+        except sqlite3.Error as e:
+            warnings.warn(f"Error guardando en la caché de {self.nombre}: {str(e)}")
+
+    def obtener(self, clave: str) -> Optional[Any]:
+        """Valor guardado para la clave, o None si no existe, caducó o es de otra versión."""
+        ahora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None:
+                if entrada[0] is None or entrada[0] > ahora:
+                    self._memoria.move_to_end(clave)
+                    self._metricas["aciertos_memoria"] += 1
+                    return entrada[1]
+                del self._memoria[clave]
+
+            db = self._db()
+            if db is not None:
+                try:
+                    fila = db.execute(
+                        "SELECT valor, expira FROM entradas WHERE clave = ? AND version = ? "
+                        "AND (expira IS NULL OR expira > ?)",
+                        (clave, self.version, ahora),
+                    ).fetchone()
+                    if fila is not None:
+                        db.execute("UPDATE entradas SET ultimo_uso = ? WHERE clave = ?", (ahora, clave))
+                        db.commit()
+                        valor = json.loads(fila[0])
+                        self._guardar_memoria(clave, fila[1], valor)
+                        self._metricas["aciertos_disco"] += 1
+                        return valor
+                except (sqlite3.Error, ValueError) as e:
+                    warnings.warn(f"Error leyendo la caché de {self.nombre}: {str(e)}")
+
+            self._metricas["fallos"] += 1
+            return None
+
+    def guardar(self, clave: str, valor: Any) -> None:
+        """Guarda un valor en memoria y en disco."""
+        self.guardar_varios([(clave, valor)])
+
+    def guardar_varios(self, filas: Iterable[Tuple[str, Any]]) -> None:
+        """
+        Guarda varios valores con una sola escritura en disco.
+        El último de `filas` queda como el más reciente del LRU.
+        """
+        filas = list(filas)
+        ahora = time.time()
+        expira = ahora + self.ttl if self.ttl is not None else None
+        with self._lock:
+            for clave, valor in filas:
+                self._guardar_memoria(clave, expira, valor)
+            self._metricas["guardadas"] += len(filas)
+            if filas:
+                self._guardar_disco(filas, expira, ahora)
+
+    def precargar(self, limite: int) -> int:
+        """
+        Pasa a memoria las entradas vigentes del disco usadas más recientemente,
+        sin volver a escribirlas ni contarlas como guardadas.
+
+        Returns:
+            Entradas cargadas
+        """
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return 0
+            try:
+                filas = db.execute(
+                    "SELECT clave, valor, expira FROM entradas WHERE version = ? "
+                    "AND (expira IS NULL OR expira > ?) ORDER BY ultimo_uso DESC LIMIT ?",
+                    (self.version, time.time(), min(limite, self.capacidad)),
+                ).fetchall()
+                # La más reciente queda al final del LRU
+                for clave, valor, expira in reversed(filas):
+                    self._guardar_memoria(clave, expira, json.loads(valor))
+                return len(filas)
+            except (sqlite3.Error, ValueError) as e:
+                warnings.warn(f"Error leyendo la caché de {self.nombre}: {str(e)}")
+                return 0
+
+    def cambiar_version(self, version: str) -> bool:
+        """
+        Fija la versión de las entradas válidas. Si cambia, vacía la memoria y
+        borra del disco las entradas de otras versiones.
+
+        Returns:
+            True si la versión cambió
+        """
+        with self._lock:
+            if version == self.version:
+                return False
+            self.version = version
+            self._memoria.clear()
+            db = self._db()
+            if db is not None:
+                try:
+                    db.execute("DELETE FROM entradas WHERE version != ?", (version,))
+                    db.commit()
+                except sqlite3.Error as e:
+                    warnings.warn(f"Error invalidando la caché de {self.nombre}: {str(e)}")
+            return True
+
+    def limpiar(self) -> None:
+        """Vacía ambos niveles."""
+        with self._lock:
+            self._memoria.clear()
+            db = self._db()
+            if db is not None:
+                try:
+                    db.execute("DELETE FROM entradas")
+                    db.commit()
+                except sqlite3.Error as e:
+                    warnings.warn(f"Error vaciando la caché de {self.nombre}: {str(e)}")
+
+    def metricas(self) -> Dict[str, Any]:
+        """Contadores de aciertos y fallos."""
+        with self._lock:
+            metricas = dict(self._metricas)
+            metricas["entradas_memoria"] = len(self._memoria)
+        aciertos = metricas["aciertos_memoria"] + metricas["aciertos_disco"]
+        consultas = aciertos + metricas["fallos"]
+        metricas["tasa_aciertos"] = aciertos / consultas if consultas else 0.0
+        return metricas
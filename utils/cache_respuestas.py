@@ -0,0 +1,81 @@
+import os
+import re
+import json
+import hashlib
+import unicodedata
+from typing import Optional, Dict, Any
+
+from utils.cache_dos_niveles import CacheDosNiveles
+
+# Respuestas en memoria y en disco, y cuánto tiempo son válidas (segundos)
+CAPACIDAD = int(os.getenv("CACHE_RESPUESTAS_CAPACIDAD", 512))
+CAPACIDAD_DISCO = int(os.getenv("CACHE_RESPUESTAS_CAPACIDAD_DISCO", 20000))
+TTL = float(os.getenv("CACHE_RESPUESTAS_TTL", 7 * 24 * 3600))
+# Archivo SQLite del nivel en disco. Vacío para usar solo memoria.
+RUTA_DISCO = os.getenv("CACHE_RESPUESTAS_DB", os.path.join("cache", "respuestas.sqlite3"))
+
+
+def normalizar_pregunta(texto: str) -> str:
+    """
+    Forma canónica de una pregunta: minúsculas, sin tildes, sin signos de
+    puntuación y con los espacios colapsados.
+    "¿Qué es la Diabetes?" y "que es la diabetes" dan la misma clave.
+    """
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+class CacheRespuestas:
+    """
+    Caché de respuestas exactas del LLM con dos niveles (ver utils/cache_dos_niveles.py).
+
+    - Memoria: LRU con tamaño máximo y TTL.
+    - Disco: tabla SQLite con el mismo TTL, para que los aciertos sobrevivan a
+      un reinicio. Al superar su capacidad se borran las menos usadas.
+
+    La clave combina la pregunta normalizada, un hash del prompt del agente y
+    del modelo, y los parámetros de muestreo (ver `clave`).
+    """
+
+    def __init__(self, capacidad: int = CAPACIDAD, ttl: float = TTL,
+                 ruta_disco: Optional[str] = RUTA_DISCO, capacidad_disco: int = CAPACIDAD_DISCO):
+        self._almacen = CacheDosNiveles("respuestas", capacidad, ruta_disco, capacidad_disco, ttl=ttl)
+
+    @staticmethod
+    def clave(pregunta: str, contexto: str, params: Dict[str, Any]) -> str:
+        """
+        Args:
+            pregunta: Pregunta del usuario (se normaliza)
+            contexto: Texto que determina la respuesta además de la pregunta
+                      (prompt del agente, identificador del modelo)
+            params: Parámetros de muestreo
+        """
+        contenido = json.dumps(
+            [normalizar_pregunta(pregunta), hashlib.sha256(contexto.encode("utf-8")).hexdigest(), params],
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+    def obtener(self, clave: str) -> Optional[str]:
+        """Respuesta guardada para la clave, o None si no existe o caducó."""
+        return self._almacen.obtener(clave)
+
+    def guardar(self, clave: str, respuesta: str) -> None:
+        """Guarda una respuesta en memoria y en disco."""
+        self._almacen.guardar(clave, respuesta)
+
+    def limpiar(self) -> None:
+        """Vacía ambos niveles (p. ej. tras cambiar prompts o modelo a mano)."""
+        self._almacen.limpiar()
+
+    def metricas(self) -> Dict[str, Any]:
+        """Contadores de aciertos y fallos."""
+        return self._almacen.metricas()
+
+
+# Instancia global del proceso
+cache_respuestas = CacheRespuestas()
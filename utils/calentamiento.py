@@ -0,0 +1,154 @@
+import time
+import threading
+from typing import Callable, Any, Dict, List, Optional
+
+from utils.memoria import gestor_memoria
+
+PENDIENTE = "pendiente"
+CARGANDO = "cargando"
+LISTO = "listo"
+ERROR = "error"
+
+
+class Componente:
+    """
+    Recurso pesado que se carga una sola vez (modelo, tokenizador, ...).
+
+    Quien lo pide mientras se está cargando espera a esa carga en lugar de
+    lanzar otra; si la carga falla, la siguiente petición lo vuelve a intentar.
+    """
+
+    def __init__(self, nombre: str, cargar: Callable[[], Any], prioridad: int = 0, requerido: bool = False):
+        self.nombre = nombre
+        self.prioridad = prioridad
+        self.requerido = requerido
+        self._cargar = cargar
+        self._lock = threading.Lock()
+        self.valor = None
+        self.estado = PENDIENTE
+        self.segundos: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def obtener(self) -> Any:
+        """Devuelve el recurso, cargándolo (o esperando a que termine de cargarse) si hace falta."""
+        if self.estado == LISTO:
+            return self.valor
+        with self._lock:
+            if self.estado == LISTO:
+                return self.valor
+            self.estado = CARGANDO
+            inicio = time.perf_counter()
+            try:
+                self.valor = self._cargar()
+            except Exception as e:
+                self.estado = ERROR
+                self.error = str(e)
+                self.segundos = time.perf_counter() - inicio
+                raise
+            self.segundos = time.perf_counter() - inicio
+            self.estado = LISTO
+            self.error = None
+            print(f"[CALENTAMIENTO] {self.nombre} listo en {self.segundos:.2f}s")
+            return self.valor
+
+    def resumen(self) -> Dict[str, Any]:
+        return {
+            "estado": self.estado,
+            "prioridad": self.prioridad,
+            "requerido": self.requerido,
+            "segundos": round(self.segundos, 3) if self.segundos is not None else None,
+            "error": self.error,
+        }
+
+
+class Calentador:
+    """
+    Carga en segundo plano, por orden de prioridad, los componentes registrados.
+
+    La aplicación arranca sin esperar; `estado()` alimenta la sonda de
+    disponibilidad y las peticiones que lleguen antes de tiempo esperan al
+    componente que necesiten a través de `Componente.obtener`.
+    """
+
+    def __init__(self):
+        self._componentes: Dict[str, Componente] = {}
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+        self.inicio: Optional[float] = None
+        self.fin: Optional[float] = None
+
+    def registrar(self, nombre: str, cargar: Callable[[], Any], prioridad: int = 0,
+                  requerido: bool = False) -> Componente:
+        """
+        Registra un componente. Menor prioridad = se carga antes.
+
+        Args:
+            nombre: Identificador del componente
+            cargar: Función sin argumentos que lo carga y lo devuelve
+            prioridad: Orden de carga
+            requerido: Si la aplicación no está lista hasta que cargue
+        """
+        with self._lock:
+            componente = self._componentes.get(nombre)
+            if componente is None:
+                componente = self._componentes[nombre] = Componente(nombre, cargar, prioridad, requerido)
+            return componente
+
+    def agregar(self, componente: Componente, prioridad: Optional[int] = None,
+                requerido: Optional[bool] = None) -> Componente:
+        """Registra un componente ya creado por otro módulo (p. ej. un agente)."""
+        if prioridad is not None:
+            componente.prioridad = prioridad
+        if requerido is not None:
+            componente.requerido = requerido
+        with self._lock:
+            self._componentes[componente.nombre] = componente
+        return componente
+
+    def componente(self, nombre: str) -> Optional[Componente]:
+        return self._componentes.get(nombre)
+
+    def iniciar(self) -> None:
+        """Arranca la carga en segundo plano (solo la primera vez)."""
+        with self._lock:
+            if self._hilo is not None:
+                return
+            self.inicio = time.time()
+            self._hilo = threading.Thread(target=self._calentar, name="calentamiento", daemon=True)
+            self._hilo.start()
+
+    def _calentar(self) -> None:
+        with self._lock:
+            componentes = sorted(self._componentes.values(), key=lambda c: c.prioridad)
+        for componente in componentes:
+            # Sin memoria para todo: lo opcional se carga cuando se pida
+            if not componente.requerido and gestor_memoria.excedido():
+                print(f"[CALENTAMIENTO] {componente.nombre} se omite: presupuesto de memoria superado")
+                continue
+            try:
+                componente.obtener()
+            except Exception as e:
+                print(f"[CALENTAMIENTO] Error cargando {componente.nombre}: {str(e)}")
+        self.fin = time.time()
+        print(f"[CALENTAMIENTO] Terminado en {self.fin - self.inicio:.2f}s")
+
+    def listo(self) -> bool:
+        """True cuando todos los componentes requeridos han cargado."""
+        with self._lock:
+            componentes: List[Componente] = list(self._componentes.values())
+        return all(c.estado == LISTO for c in componentes if c.requerido)
+
+    def estado(self) -> Dict[str, Any]:
+        """Estado y tiempo de carga de cada componente."""
+        with self._lock:
+            componentes = sorted(self._componentes.values(), key=lambda c: c.prioridad)
+        return {
+            "listo": self.listo(),
+            "terminado": self.fin is not None,
+            "segundos_totales": round((self.fin or time.time()) - self.inicio, 3) if self.inicio else None,
+            "componentes": {c.nombre: c.resumen() for c in componentes},
+        }
+
+
+# Instancia global del proceso
+calentador = Calentador()
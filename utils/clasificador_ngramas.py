@@ -0,0 +1,338 @@
+import os
+import re
+import json
+import math
+import glob
+import time
+import zlib
+import random
+import threading
+import unicodedata
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+
+# Modelo entrenado (se crea a partir del prompt del clasificador si no existe)
+RUTA_MODELO = os.getenv("CLASIFICADOR_MODELO", os.path.join("data", "clasificador_intenciones.json"))
+# Registro diario de mensajes ya clasificados (por patrones o por el LLM). Vacío = no registrar.
+DIRECTORIO_REGISTRO = os.getenv("CLASIFICADOR_REGISTRO", "logs")
+# Probabilidad mínima para responder sin consultar al LLM
+UMBRAL = float(os.getenv("CLASIFICADOR_UMBRAL", 0.7))
+RUTA_PROMPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts", "clasificador.txt")
+
+# Etiquetas de confianza con las que se entrena: las del propio clasificador no
+FUENTES_ENTRENAMIENTO = ("manual", "patrones", "llm")
+
+_EJEMPLO = re.compile(r'^"(.+)"\s*→\s*(\w+)\s*$')
+_DESCRIPCION = re.compile(r'^-\s*(\w+):\s*(.+)$')
+_PALABRA = re.compile(r"\w+")
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas y sin tildes: "Radiografía" y "radiografia" dan los mismos n-gramas."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def caracteristicas(texto: str) -> Dict[str, int]:
+    """N-gramas de 2 a 4 caracteres dentro de cada palabra (con sus bordes) y las palabras."""
+    cuenta: Dict[str, int] = {}
+    for palabra in _PALABRA.findall(normalizar(texto)):
+        cuenta["w:" + palabra] = cuenta.get("w:" + palabra, 0) + 1
+        marcada = f" {palabra} "
+        for n in (2, 3, 4):
+            for i in range(len(marcada) - n + 1):
+                ngrama = marcada[i:i + n]
+                cuenta[ngrama] = cuenta.get(ngrama, 0) + 1
+    return cuenta
+
+
+class ClasificadorNgramas:
+    """
+    TF-IDF de n-gramas de caracteres con regresión logística multiclase.
+
+    Es el nivel intermedio del orquestador: resuelve en microsegundos y en CPU
+    los mensajes que no encajan en ningún patrón, y solo cuando su probabilidad
+    no llega al umbral se consulta al LLM clasificador. Se entrena en segundos
+    con los ejemplos del prompt y el tráfico registrado (ver `registrar`).
+    """
+
+    def __init__(self):
+        self.clases: List[str] = []
+        self.idf: Dict[str, float] = {}
+        self.pesos: Dict[str, List[float]] = {}
+        self.sesgos: List[float] = []
+        self.info: Dict[str, Any] = {}
+
+    @property
+    def entrenado(self) -> bool:
+        return bool(self.clases)
+
+    def _vector(self, texto: str) -> List[Tuple[str, float]]:
+        """TF-IDF sublineal normalizado (L2), solo con n-gramas conocidos."""
+        vector = []
+        for ngrama, tf in caracteristicas(texto).items():
+            idf = self.idf.get(ngrama)
+            if idf is not None:
+                vector.append((ngrama, (1 + math.log(tf)) * idf))
+        norma = math.sqrt(sum(v * v for _, v in vector)) or 1.0
+        return [(ngrama, v / norma) for ngrama, v in vector]
+
+    def _probabilidades(self, vector: List[Tuple[str, float]]) -> List[float]:
+        puntuaciones = list(self.sesgos)
+        for ngrama, valor in vector:
+            pesos = self.pesos.get(ngrama)
+            if pesos is not None:
+                for k, peso in enumerate(pesos):
+                    puntuaciones[k] += valor * peso
+        maximo = max(puntuaciones)
+        exp = [math.exp(p - maximo) for p in puntuaciones]
+        total = sum(exp)
+        return [e / total for e in exp]
+
+    def predecir(self, texto: str) -> Tuple[Optional[str], float]:
+        """(clase más probable, probabilidad), o (None, 0.0) si no hay modelo."""
+        if not self.entrenado:
+            return None, 0.0
+        probabilidades = self._probabilidades(self._vector(texto))
+        mejor = max(range(len(self.clases)), key=probabilidades.__getitem__)
+        return self.clases[mejor], probabilidades[mejor]
+
+    def entrenar(self, ejemplos: List[Tuple[str, str]], epocas: int = 30, tasa: float = 0.5,
+                 regularizacion: float = 1e-4, semilla: int = 0) -> "ClasificadorNgramas":
+        """
+        Ajusta el modelo con descenso por gradiente estocástico.
+
+        Args:
+            ejemplos: Pares (texto, clase)
+            epocas: Pasadas sobre los ejemplos
+            tasa: Tasa de aprendizaje inicial (decae con las épocas)
+            regularizacion: Penalización L2 de los pesos
+            semilla: Orden de los ejemplos reproducible
+        """
+        if not ejemplos:
+            raise ValueError("No hay ejemplos para entrenar el clasificador")
+        self.clases = sorted({clase for _, clase in ejemplos})
+        indice_clase = {clase: k for k, clase in enumerate(self.clases)}
+
+        documentos = {}
+        for texto, _ in ejemplos:
+            for ngrama in caracteristicas(texto):
+                documentos[ngrama] = documentos.get(ngrama, 0) + 1
+        n = len(ejemplos)
+        self.idf = {ngrama: math.log((1 + n) / (1 + df)) + 1 for ngrama, df in documentos.items()}
+
+        vectores = [(self._vector(texto), indice_clase[clase]) for texto, clase in ejemplos]
+        self.pesos = {ngrama: [0.0] * len(self.clases) for ngrama in self.idf}
+        self.sesgos = [0.0] * len(self.clases)
+        aleatorio = random.Random(semilla)
+        for epoca in range(epocas):
+            aleatorio.shuffle(vectores)
+            paso = tasa / (1 + epoca * 0.1)
+            for vector, correcta in vectores:
+                probabilidades = self._probabilidades(vector)
+                for k, p in enumerate(probabilidades):
+                    gradiente = p - (1.0 if k == correcta else 0.0)
+                    self.sesgos[k] -= paso * gradiente
+                    for ngrama, valor in vector:
+                        pesos = self.pesos[ngrama]
+                        pesos[k] -= paso * (gradiente * valor + regularizacion * pesos[k])
+
+        self.info = {"ejemplos": n, "ngramas": len(self.idf), "entrenado": datetime.now().isoformat()}
+        return self
+
+    def guardar(self, ruta: str = RUTA_MODELO) -> None:
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        datos = {
+            "clases": self.clases,
+            "sesgos": [round(s, 5) for s in self.sesgos],
+            "idf": {k: round(v, 5) for k, v in self.idf.items()},
+            "pesos": {k: [round(p, 5) for p in v] for k, v in self.pesos.items()},
+            "info": self.info,
+        }
+        temporal = f"{ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(datos, f, ensure_ascii=False)
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta: str = RUTA_MODELO) -> "ClasificadorNgramas":
+        with open(ruta, encoding="utf-8") as f:
+            datos = json.load(f)
+        modelo = cls()
+        modelo.clases = datos["clases"]
+        modelo.sesgos = datos["sesgos"]
+        modelo.idf = datos["idf"]
+        modelo.pesos = datos["pesos"]
+        modelo.info = datos.get("info", {})
+        return modelo
+
+
+def ejemplos_del_prompt(ruta: str = RUTA_PROMPT) -> List[Tuple[str, str]]:
+    """
+    Ejemplos de arranque sacados de prompts/clasificador.txt: los de la sección
+    EJEMPLOS y cada término de la descripción de las funcionalidades.
+    """
+    ejemplos = []
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.strip()
+            ejemplo = _EJEMPLO.match(linea)
+            if ejemplo:
+                ejemplos.append((ejemplo.group(1), ejemplo.group(2)))
+                continue
+            descripcion = _DESCRIPCION.match(linea)
+            if descripcion:
+                clase, terminos = descripcion.groups()
+                for termino in terminos.split(","):
+                    termino = termino.strip().strip('"').strip()
+                    if termino:
+                        ejemplos.append((termino, clase))
+    return ejemplos
+
+
+def leer_registro(patrones: Iterable[str], fuentes: Iterable[str] = FUENTES_ENTRENAMIENTO) -> List[Dict[str, Any]]:
+    """Entradas del registro de tráfico (uno o varios globs), en orden de llegada."""
+    fuentes = set(fuentes)
+    entradas = []
+    for patron in patrones:
+        for ruta in sorted(glob.glob(patron)):
+            with open(ruta, encoding="utf-8") as f:
+                for linea in f:
+                    try:
+                        entrada = json.loads(linea)
+                    except json.JSONDecodeError:
+                        continue
+                    if entrada.get("fuente") in fuentes and entrada.get("mensaje") and entrada.get("funcionalidad"):
+                        entradas.append(entrada)
+    return entradas
+
+
+def es_validacion(texto: str, fraccion: float) -> bool:
+    """Reparto estable entre entrenamiento y validación (el mismo mensaje cae siempre del mismo lado)."""
+    return (zlib.crc32(normalizar(texto).encode("utf-8")) % 1000) < fraccion * 1000
+
+
+class ClasificadorEstadistico:
+    """
+    Punto de uso desde el orquestador: carga (o crea) el modelo la primera vez,
+    aplica el umbral y registra el tráfico clasificado por los otros niveles.
+    """
+
+    def __init__(self, ruta_modelo: str = RUTA_MODELO, umbral: float = UMBRAL,
+                 directorio_registro: str = DIRECTORIO_REGISTRO):
+        self.ruta_modelo = ruta_modelo
+        self.umbral = umbral
+        self.directorio_registro = directorio_registro
+        self._modelo: Optional[ClasificadorNgramas] = None
+        self._lock = threading.Lock()
+        self._metricas = {"consultas": 0, "resueltas": 0, "delegadas": 0}
+
+    def modelo(self) -> ClasificadorNgramas:
+        if self._modelo is None:
+            with self._lock:
+                if self._modelo is None:
+                    self._modelo = self._cargar_modelo()
+        return self._modelo
+
+    def _cargar_modelo(self) -> ClasificadorNgramas:
+        if os.path.exists(self.ruta_modelo):
+            try:
+                return ClasificadorNgramas.cargar(self.ruta_modelo)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[CLASIFICADOR] Modelo de n-gramas ilegible ({str(e)}); se reentrena con el prompt")
+        inicio = time.perf_counter()
+        modelo = ClasificadorNgramas().entrenar(ejemplos_del_prompt())
+        print(f"[CLASIFICADOR] Modelo de n-gramas creado con los ejemplos del prompt "
+              f"en {time.perf_counter() - inicio:.2f}s")
+        return modelo
+
+    def clasificar(self, mensaje: str) -> Optional[str]:
+        """La funcionalidad si el modelo supera el umbral; None para consultar al LLM."""
+        funcionalidad, probabilidad = self.modelo().predecir(mensaje)
+        resuelta = funcionalidad is not None and probabilidad >= self.umbral
+        with self._lock:
+            self._metricas["consultas"] += 1
+            self._metricas["resueltas" if resuelta else "delegadas"] += 1
+        if resuelta:
+            print(f"[CLASIFICADOR N-GRAMAS] {funcionalidad} (p={probabilidad:.2f})")
+            return funcionalidad
+        return None
+
+    def registrar(self, mensaje: str, funcionalidad: str, fuente: str, version: Optional[str] = None) -> None:
+        """
+        Añade un mensaje clasificado al registro del día (datos para reentrenar
+        y para precargar la caché de clasificación, que filtra por `version`).
+        """
+        if not self.directorio_registro:
+            return
+        entrada = {"ts": time.time(), "mensaje": mensaje, "funcionalidad": funcionalidad, "fuente": fuente}
+        if version:
+            entrada["version"] = version
+        ruta = os.path.join(self.directorio_registro, f"intenciones-{datetime.now():%Y-%m-%d}.jsonl")
+        try:
+            os.makedirs(self.directorio_registro, exist_ok=True)
+            with self._lock, open(ruta, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"[CLASIFICADOR] No se pudo registrar la clasificación: {str(e)}")
+
+    def metricas(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._metricas)
+
+
+def _evaluar(modelo: ClasificadorNgramas, entradas: List[Dict[str, Any]], umbral: float) -> None:
+    if not entradas:
+        print("[EVALUACION] Sin mensajes de validación")
+        return
+    aciertos = seguros = aciertos_seguros = 0
+    tiempos = []
+    for entrada in entradas:
+        inicio = time.perf_counter()
+        prediccion, probabilidad = modelo.predecir(entrada["mensaje"])
+        tiempos.append(time.perf_counter() - inicio)
+        acierto = prediccion == entrada["funcionalidad"]
+        aciertos += acierto
+        if probabilidad >= umbral:
+            seguros += 1
+            aciertos_seguros += acierto
+    tiempos.sort()
+    n = len(entradas)
+    print(f"[EVALUACION] {n} mensajes de validación")
+    print(f"[EVALUACION] Exactitud: {aciertos / n:.1%}")
+    print(f"[EVALUACION] Con p >= {umbral}: {seguros / n:.1%} resueltos sin LLM, "
+          f"exactitud {aciertos_seguros / seguros:.1%}" if seguros else
+          f"[EVALUACION] Con p >= {umbral}: ninguno (todo iría al LLM)")
+    print(f"[EVALUACION] Latencia: media {sum(tiempos) / n * 1e6:.0f} µs, "
+          f"p50 {tiempos[n // 2] * 1e6:.0f} µs, p99 {tiempos[min(n - 1, int(n * 0.99))] * 1e6:.0f} µs")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Entrena y evalúa el clasificador de intenciones por n-gramas")
+    parser.add_argument("accion", choices=["entrenar", "evaluar"])
+    parser.add_argument("--registro", nargs="*",
+                        default=[os.path.join(DIRECTORIO_REGISTRO or "logs", "intenciones-*.jsonl")],
+                        help="Registros de tráfico (globs)")
+    parser.add_argument("--validacion", type=float, default=0.2, help="Fracción del registro reservada")
+    parser.add_argument("--modelo", default=RUTA_MODELO)
+    parser.add_argument("--umbral", type=float, default=UMBRAL)
+    args = parser.parse_args()
+
+    entradas = leer_registro(args.registro)
+    validacion = [e for e in entradas if es_validacion(e["mensaje"], args.validacion)]
+
+    if args.accion == "entrenar":
+        ejemplos = ejemplos_del_prompt()
+        ejemplos += [(e["mensaje"], e["funcionalidad"]) for e in entradas
+                     if not es_validacion(e["mensaje"], args.validacion)]
+        inicio = time.perf_counter()
+        modelo = ClasificadorNgramas().entrenar(ejemplos)
+        modelo.guardar(args.modelo)
+        print(f"[ENTRENAMIENTO] {len(ejemplos)} ejemplos ({len(entradas) - len(validacion)} del registro), "
+              f"{len(modelo.idf)} n-gramas, {time.perf_counter() - inicio:.1f}s -> {args.modelo}")
+    else:
+        modelo = ClasificadorNgramas.cargar(args.modelo)
+
+    _evaluar(modelo, validacion, args.umbral)
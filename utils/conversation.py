@@ -1,9 +1,261 @@
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from langchain_core.chat_history import InMemoryChatMessageHistory
 from langchain_community.chat_message_histories import FileChatMessageHistory
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Sequence, Tuple, Callable
 import os
 import json
+import time
+import atexit
+import threading
 import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from utils.ejecutores import obtener_ejecutor
+from utils.historial_sqlite import HistorialSQLite
+
+# Dónde se guardan los historiales: "jsonl" (un log por sesión) o "sqlite" (una base compartida)
+BACKEND = os.getenv("HISTORIAL_BACKEND", "jsonl")
+
+# Fracción de registros muertos (mensajes recortados) a partir de la cual se compacta el log
+UMBRAL_COMPACTACION = float(os.getenv("HISTORIAL_UMBRAL_COMPACTACION", 0.5))
+# Por debajo de este número de registros no merece la pena compactar
+MIN_REGISTROS_COMPACTACION = int(os.getenv("HISTORIAL_MIN_REGISTROS_COMPACTACION", 64))
+# Conversaciones vivas en memoria (0 = sin caché: cada petición lee y escribe en disco).
+# Con SQLite no hay caché por defecto: la base se comparte entre procesos trabajadores y
+# una copia en memoria de cada uno quedaría desfasada (ver CacheConversaciones)
+CAPACIDAD_CACHE = int(os.getenv("HISTORIAL_CACHE_CAPACIDAD", 0 if BACKEND == "sqlite" else 256))
+# Cada cuántos segundos se vuelcan a disco los mensajes pendientes
+INTERVALO_VOLCADO = float(os.getenv("HISTORIAL_INTERVALO_VOLCADO", 1.0))
+
+# Encabezado con el que el resumen de los turnos antiguos llega al prompt
+PREFIJO_RESUMEN = "Resumen de la conversación anterior: "
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+_compactando = set()
+
+
+def _lock_archivo(ruta: str) -> threading.Lock:
+    """Candado por archivo: cada petición crea su propio Conversation sobre el mismo log."""
+    ruta = os.path.abspath(ruta)
+    with _locks_lock:
+        lock = _locks.get(ruta)
+        if lock is None:
+            lock = _locks[ruta] = threading.Lock()
+        return lock
+
+
+# (archivo, mensajes) de la instantánea activa en este contexto (ver `instantanea_historial`)
+_instantanea: ContextVar[Optional[Tuple[str, List[BaseMessage]]]] = ContextVar("instantanea_historial", default=None)
+
+
+@contextmanager
+def instantanea_historial(file_path: str, mensajes: Sequence[BaseMessage]):
+    """
+    Mientras dura, quien pida el historial de `file_path` en este contexto (y en
+    las tareas que lo copien) recibe una copia en memoria de `mensajes`, y lo que
+    escriba en ella se descarta. Varios agentes responden así a la vez sobre el
+    mismo historial sin pisarse (ver Orquestador._procesar_intenciones).
+    """
+    token = _instantanea.set((os.path.abspath(file_path), list(mensajes)))
+    try:
+        yield
+    finally:
+        _instantanea.reset(token)
+
+
+def historial_instantaneo(file_path: str) -> Optional[InMemoryChatMessageHistory]:
+    """Copia de la instantánea activa del archivo, o None si no la hay."""
+    activa = _instantanea.get()
+    if activa is None or activa[0] != os.path.abspath(file_path):
+        return None
+    return InMemoryChatMessageHistory(messages=list(activa[1]))
+
+
+# Nombre del tokenizador por defecto (cuenta palabras)
+TOKENIZADOR_PALABRAS = "palabras"
+
+
+def _mensaje_a_dict(msg: BaseMessage, tokens: Optional[int] = None,
+                    tokenizador: Optional[str] = None) -> Dict[str, Any]:
+    datos = {"type": msg.type, "content": msg.content}
+    if tokens is not None:
+        # Recuento guardado junto al mensaje, válido mientras no cambie el tokenizador
+        datos["tokens"] = tokens
+        datos["tokenizador"] = tokenizador
+    return datos
+
+
+def leer_json_antiguo(ruta: str, encoding: str = "utf-8") -> Optional[List[Dict[str, Any]]]:
+    """Mensajes de un historial en el formato antiguo (lista JSON completa), o None si no se puede leer."""
+    try:
+        with open(ruta, 'r', encoding=encoding) as f:
+            data = json.load(f)
+        return [{"type": msg["type"], "content": msg["content"]} for msg in data]
+    except (json.JSONDecodeError, OSError, KeyError, TypeError):
+        warnings.warn(f"Historial antiguo corrupto en {ruta}; no se convierte.")
+        return None
+
+
+class HistorialJSONL:
+    """
+    Log de solo-añadir de una conversación, un registro JSON por línea:
+
+        {"op": "add", "msg": {"type": "human", "content": "...", "tokens": 12, "tokenizador": "palabras"}}
+        {"op": "trim", "n": 2}      # descarta los n mensajes más antiguos
+        {"op": "summary", "resumen": {"texto": "...", "tokens": 40, "tokenizador": "palabras"}}
+
+    Añadir un turno cuesta lo que ocupa el turno, no todo el historial. Los
+    registros de mensajes ya recortados quedan muertos en el archivo; cuando
+    superan UMBRAL_COMPACTACION se reescribe el log en segundo plano solo con
+    los mensajes vivos.
+    """
+
+    def __init__(self, file_path: str, encoding: str = "utf-8"):
+        self.file_path = file_path
+        self.encoding = encoding
+        self._lock = _lock_archivo(file_path)
+        self.registros = 0  # registros en el archivo según la última lectura/escritura
+        self.resumen: Optional[Dict[str, Any]] = None  # último resumen leído o escrito
+
+    def _reproducir(self) -> Tuple[List[Dict[str, Any]], int, int]:
+        """
+        Lee el log y aplica sus registros en orden. Debe llamarse con el candado tomado.
+        El último resumen queda en `self.resumen`.
+
+        Returns:
+            (mensajes vivos, registros válidos, registros corruptos)
+        """
+        mensajes: List[Dict[str, Any]] = []
+        self.resumen = None
+        registros = 0
+        corruptos = 0
+        with open(self.file_path, "r", encoding=self.encoding) as f:
+            for numero, linea in enumerate(f, 1):
+                if not linea.strip():
+                    continue
+                try:
+                    registro = json.loads(linea)
+                except json.JSONDecodeError:
+                    # Típicamente la última línea de una escritura interrumpida
+                    warnings.warn(f"Registro corrupto en {self.file_path}:{numero}; se ignora.")
+                    corruptos += 1
+                    continue
+                registros += 1
+                if registro.get("op") == "add":
+                    mensajes.append(registro["msg"])
+                elif registro.get("op") == "trim":
+                    del mensajes[:registro["n"]]
+                elif registro.get("op") == "summary":
+                    self.resumen = registro["resumen"]
+        return mensajes, registros, corruptos
+
+    def cargar(self) -> List[Dict[str, Any]]:
+        """
+        Mensajes vivos del log (vacío si no existe). Si no existe pero hay un
+        historial antiguo en JSON con el mismo nombre (.json), lo convierte.
+        """
+        with self._lock:
+            if not os.path.exists(self.file_path):
+                self.registros = 0
+                self.resumen = None
+                antiguo = os.path.splitext(self.file_path)[0] + ".json"
+                if antiguo == self.file_path or not os.path.exists(antiguo):
+                    return []
+                mensajes = leer_json_antiguo(antiguo, self.encoding)
+                if mensajes is None:
+                    return []
+                self._reescribir(mensajes)
+                os.remove(antiguo)
+                return mensajes
+            mensajes, self.registros, corruptos = self._reproducir()
+            # Sin reparar, el siguiente registro se escribiría a continuación del trozo roto
+            if corruptos:
+                self._reescribir(mensajes, self.resumen)
+        return mensajes
+
+    def obtener_resumen(self) -> Optional[Dict[str, Any]]:
+        """Resumen de los turnos antiguos según la última carga (ver Conversation)."""
+        return self.resumen
+
+    def agregar(self, mensajes: Sequence[Dict[str, Any]], recortados: int = 0,
+                sincronizar: bool = False, resumen: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Añade mensajes, el recorte de los más antiguos y el nuevo resumen (si los
+        hay) en una sola escritura. Con `sincronizar` espera a que el sistema
+        operativo lo lleve al disco (fsync).
+        """
+        lineas = [json.dumps({"op": "add", "msg": m}, ensure_ascii=False) for m in mensajes]
+        if recortados:
+            lineas.append(json.dumps({"op": "trim", "n": recortados}))
+        if resumen is not None:
+            lineas.append(json.dumps({"op": "summary", "resumen": resumen}, ensure_ascii=False))
+            self.resumen = resumen
+        if not lineas:
+            return
+        with self._lock:
+            with open(self.file_path, "a", encoding=self.encoding) as f:
+                f.write("\n".join(lineas) + "\n")
+                if sincronizar:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.registros += len(lineas)
+
+    def reescribir(self, mensajes: Sequence[Dict[str, Any]],
+                   resumen: Optional[Dict[str, Any]] = None) -> None:
+        """Sustituye el log por uno con solo estos mensajes (y el resumen, si lo hay)."""
+        with self._lock:
+            self._reescribir(mensajes, resumen)
+
+    def _reescribir(self, mensajes: Sequence[Dict[str, Any]],
+                    resumen: Optional[Dict[str, Any]] = None) -> None:
+        temporal = f"{self.file_path}.tmp"
+        with open(temporal, "w", encoding=self.encoding) as f:
+            if resumen is not None:
+                f.write(json.dumps({"op": "summary", "resumen": resumen}, ensure_ascii=False) + "\n")
+            for m in mensajes:
+                f.write(json.dumps({"op": "add", "msg": m}, ensure_ascii=False) + "\n")
+        os.replace(temporal, self.file_path)
+        self.resumen = resumen
+        self.registros = len(mensajes) + (resumen is not None)
+
+    def compactar(self) -> None:
+        """Reescribe el log solo con los mensajes vivos y el último resumen."""
+        with self._lock:
+            if os.path.exists(self.file_path):
+                mensajes, _, _ = self._reproducir()
+                self._reescribir(mensajes, self.resumen)
+
+    def compactar_si_conviene(self, vivos: int) -> None:
+        """Programa una compactación en segundo plano si el log tiene demasiados registros muertos."""
+        if self.registros < MIN_REGISTROS_COMPACTACION:
+            return
+        if (self.registros - vivos) / self.registros < UMBRAL_COMPACTACION:
+            return
+        ruta = os.path.abspath(self.file_path)
+        with _locks_lock:
+            if ruta in _compactando:
+                return
+            _compactando.add(ruta)
+
+        def tarea():
+            try:
+                self.compactar()
+            except Exception as e:
+                warnings.warn(f"Error compactando {self.file_path}: {str(e)}")
+            finally:
+                with _locks_lock:
+                    _compactando.discard(ruta)
+
+        try:
+            obtener_ejecutor("io").submit(tarea)
+        except RuntimeError:
+            # El proceso se está cerrando; se compactará en la próxima carga
+            with _locks_lock:
+                _compactando.discard(ruta)
+
 
 class Conversation(FileChatMessageHistory):
     def __init__(
@@ -13,48 +265,123 @@ class Conversation(FileChatMessageHistory):
         token_buffer: int = 128,
         max_messages: Optional[int] = None,
         tokenizer: Optional[callable] = None,
-        encoding: str = "utf-8"
+        encoding: str = "utf-8",
+        backend: Optional[str] = None,
+        tokenizer_name: Optional[str] = None,
+        summary_window: Optional[int] = None,
+        summarizer: Optional[Callable[[str, List[BaseMessage]], str]] = None
     ):
         """
-        Historial de conversación con reescritura completa del JSON.
-        
+        Historial de conversación persistido como log JSONL de solo-añadir
+        (ver HistorialJSONL) o en la base SQLite compartida (ver utils/historial_sqlite.py).
+
         Args:
-            file_path: Ruta del archivo JSON
+            file_path: Ruta del log (.jsonl). Si no existe y hay un historial antiguo
+                       en formato JSON con el mismo nombre (.json), se convierte.
+                       Con SQLite identifica la sesión (carpeta y nombre, sin extensión).
             max_context_tokens: Límite de tokens del modelo (n_ctx)
             token_buffer: Espacio reservado para respuestas
-            max_messages: Límite opcional de mensajes
+            max_messages: Límite opcional de mensajes (no se aplica en modo resumen)
             tokenizer: Función para contar tokens
             encoding: Codificación del archivo
+            backend: "jsonl" o "sqlite"; por defecto HISTORIAL_BACKEND
+            tokenizer_name: Identifica al tokenizador. Los recuentos guardados con el
+                            mismo nombre se reutilizan al cargar; sin nombre se recalculan.
+            summary_window: Modo resumen: mensajes recientes que se conservan literales.
+                            Los que salen de la ventana se integran en un resumen.
+            summarizer: Función (resumen previo, mensajes) -> resumen nuevo. Se llama
+                        en segundo plano, fuera de la petición (ver `_programar_resumen`).
         """
         self._file_path = file_path
         self._max_context_tokens = max_context_tokens
         self._token_buffer = token_buffer
         self._max_messages = max_messages
         self._tokenizer = tokenizer if tokenizer else lambda x: len(x.split())
+        self._tokenizer_name = tokenizer_name if tokenizer else TOKENIZADOR_PALABRAS
         self._encoding = encoding
         self._messages = []
-
-        # Crear directorio y archivo si no existen
-        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
-        if not os.path.exists(file_path):
-            self._save_messages()
+        # Tokens de cada mensaje (calculados una vez) y su suma
+        self._tokens: List[int] = []
+        self._total_tokens = 0
+        # Modo resumen: texto acumulado de los turnos antiguos, sus tokens, y la
+        # posición absoluta del primer mensaje en memoria (para ubicar los resumidos)
+        self._summary_window = summary_window
+        self._summarizer = summarizer
+        self._resumen = ""
+        self._resumen_tokens = 0
+        self._inicio = 0
+        self._resumiendo = False
+        self._borrados = 0  # veces que se ha vaciado (invalida los resúmenes en curso)
+        # Escritura diferida: la activa CacheConversaciones, que vuelca los pendientes
+        self._cache: Optional["CacheConversaciones"] = None
+        self._pendientes: List[Dict[str, Any]] = []
+        self._recortados_pendientes = 0
+        self._resumen_pendiente: Optional[Dict[str, Any]] = None
+        self._lock = threading.RLock()
+        if (backend or BACKEND) == "sqlite":
+            self._historial = HistorialSQLite(file_path)
         else:
-            self._load_messages()
+            self._historial = HistorialJSONL(file_path, encoding)
+            # Crear directorio si no existe; el log se crea con el primer mensaje
+            os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        self._load_messages()
+
+    def configurar(self, max_context_tokens: int = 2000, token_buffer: int = 128,
+                   max_messages: Optional[int] = None, tokenizer: Optional[callable] = None,
+                   tokenizer_name: Optional[str] = None, summary_window: Optional[int] = None,
+                   summarizer: Optional[Callable[[str, List[BaseMessage]], str]] = None) -> None:
+        """
+        Cambia los límites de una conversación ya cargada. Varios agentes comparten
+        el historial de una sesión, cada uno con los suyos (ver CacheConversaciones).
+        Si cambia el tokenizador se recuentan los mensajes: uno con nombre cambia
+        cuando cambia el nombre; uno sin nombre, cuando es otro objeto.
+        """
+        nombre = tokenizer_name if tokenizer else TOKENIZADOR_PALABRAS
+        with self._lock:
+            self._max_context_tokens = max_context_tokens
+            self._token_buffer = token_buffer
+            self._max_messages = max_messages
+            self._summary_window = summary_window
+            self._summarizer = summarizer
+            if nombre is None:
+                cambiado = self._tokenizer_name is not None or tokenizer is not self._tokenizer
+            else:
+                cambiado = nombre != self._tokenizer_name
+            if cambiado:
+                self._tokenizer = tokenizer if tokenizer else lambda x: len(x.split())
+                self._tokenizer_name = nombre
+                self._tokens = [self._count_tokens(msg.content) for msg in self._messages]
+                self._total_tokens = sum(self._tokens)
+                self._resumen_tokens = self._count_tokens(self._resumen) if self._resumen else 0
 
     def _load_messages(self):
-        """Carga mensajes con recreación completa del archivo si hay errores."""
+        """Carga los mensajes del almacenamiento."""
         try:
-            with open(self._file_path, 'r', encoding=self._encoding) as f:
-                data = json.load(f)
-                self._messages = [self._message_from_dict(msg) for msg in data]
-        except (json.JSONDecodeError, FileNotFoundError):
-            warnings.warn(f"Archivo corrupto o no encontrado en {self._file_path}. Se creará uno nuevo.")
-            self._messages = []
-            self._save_messages()
+            datos = self._historial.cargar()
+            self._messages = [self._message_from_dict(msg) for msg in datos]
+            self._tokens = [
+                msg["tokens"]
+                if self._tokenizer_name is not None and msg.get("tokens") is not None
+                and msg.get("tokenizador") == self._tokenizer_name
+                else self._count_tokens(msg["content"])
+                for msg in datos
+            ]
+            self._total_tokens = sum(self._tokens)
+            resumen = self._historial.obtener_resumen()
+            if resumen:
+                self._resumen = resumen["texto"]
+                self._resumen_tokens = (
+                    resumen["tokens"]
+                    if self._tokenizer_name is not None and resumen.get("tokenizador") == self._tokenizer_name
+                    else self._count_tokens(self._resumen)
+                )
         except Exception as e:
             warnings.warn(f"Error al cargar mensajes: {str(e)}. Se reiniciará el historial.")
-            self._messages = []
-            self._save_messages()
+            self._messages, self._tokens, self._total_tokens = [], [], 0
+            self._resumen, self._resumen_tokens = "", 0
+            self._historial.reescribir([])
+            return
+        self._historial.compactar_si_conviene(len(self._messages))
 
     def _message_from_dict(self, msg_dict: Dict) -> BaseMessage:
         """Convierte dict a BaseMessage."""
@@ -64,18 +391,13 @@ class Conversation(FileChatMessageHistory):
             return AIMessage(content=msg_dict['content'])
         return BaseMessage(content=msg_dict['content'])
 
-    def _save_messages(self):
-        """Guarda todos los mensajes recreando el archivo completo."""
-        try:
-            with open(self._file_path, 'w', encoding=self._encoding) as f:
-                json.dump([msg.dict() for msg in self._messages], f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            warnings.warn(f"Error crítico al guardar mensajes: {str(e)}")
-
     @property
     def messages(self) -> List[BaseMessage]:
-        """Devuelve los mensajes actuales."""
-        return self._messages.copy()
+        """Devuelve los mensajes actuales, precedidos del resumen de los antiguos si lo hay."""
+        with self._lock:
+            if self._resumen:
+                return [SystemMessage(content=PREFIJO_RESUMEN + self._resumen)] + self._messages
+            return self._messages.copy()
 
     def _count_tokens(self, text: str) -> int:
         """Cuenta tokens en un texto usando tokenizer robusto."""
@@ -88,41 +410,150 @@ class Conversation(FileChatMessageHistory):
 
 
     def _calculate_context_usage(self) -> int:
-        """Calcula tokens totales usados."""
-        return sum(self._count_tokens(msg.content) for msg in self._messages)
-
-    def _enforce_limits(self):
-        """Aplica límites eliminando mensajes antiguos."""
-        # 1. Aplicar límite de cantidad de mensajes
-        if self._max_messages and len(self._messages) > self._max_messages:
-            self._messages = self._messages[-self._max_messages:]
-
-        # 2. Aplicar límite de tokens de contexto
-        while len(self._messages) > 1:
-            total_tokens = self._calculate_context_usage()
-            available_space = self._max_context_tokens - total_tokens
-            
-            if available_space >= self._token_buffer:
-                break
-                
-            # Eliminar el mensaje más antiguo (excepto el último)
-            self._messages.pop(0)
+        """Tokens totales usados (se mantiene al añadir y recortar, sin re-tokenizar)."""
+        return self._total_tokens + self._resumen_tokens
 
-        self._save_messages()
+    def _enforce_limits(self) -> int:
+        """Aplica límites eliminando mensajes antiguos. Devuelve cuántos se eliminaron."""
+        total = len(self._messages)
+        total_tokens = self._total_tokens
+        # El resumen también ocupa contexto, pero no se recorta
+        disponible = self._max_context_tokens - self._resumen_tokens
+        recortar = 0
 
-    def add_message(self, message: BaseMessage) -> None:
-        """Añade un mensaje gestionando límites."""
-        new_tokens = self._count_tokens(message.content)
+        # 1. Aplicar límite de cantidad de mensajes. En modo resumen no: los que
+        # salen de la ventana se quitan al integrarse en el resumen (ver `_aplicar_resumen`)
+        modo_resumen = bool(self._summary_window and self._summarizer is not None)
+        if self._max_messages and not modo_resumen and total > self._max_messages:
+            recortar = total - self._max_messages
+            total_tokens -= sum(self._tokens[:recortar])
+
+        # 2. Aplicar límite de tokens de contexto, sin eliminar el último mensaje
+        while total - recortar > 1 and disponible - total_tokens < self._token_buffer:
+            total_tokens -= self._tokens[recortar]
+            recortar += 1
+
+        if recortar:
+            self._quitar_antiguos(recortar)
+        return recortar
+
+    def _quitar_antiguos(self, n: int) -> None:
+        """Elimina los n mensajes más antiguos de memoria. Debe llamarse con el candado tomado."""
+        self._total_tokens -= sum(self._tokens[:n])
+        del self._messages[:n]
+        del self._tokens[:n]
+        self._inicio += n
+
+    def _programar_resumen(self) -> None:
+        """
+        Si hay bastantes mensajes fuera de la ventana reciente, lanza en segundo
+        plano su integración en el resumen. Debe llamarse con el candado tomado.
+
+        Se resume por lotes (media ventana) para no llamar al modelo en cada turno,
+        y nunca hay más de un resumen en curso por conversación. Los mensajes
+        siguen en el prompt hasta que su resumen está listo.
+        """
+        ventana = self._summary_window
+        if not ventana or self._summarizer is None or self._resumiendo:
+            return
+        fuera = len(self._messages) - ventana
+        if fuera < max(2, ventana // 2):
+            return
+        antiguos = self._messages[:fuera]
+        resumen, resumidor, fin = self._resumen, self._summarizer, self._inicio + fuera
+        borrados = self._borrados
+        self._resumiendo = True
+
+        def tarea():
+            try:
+                nuevo = resumidor(resumen, antiguos).strip()
+            except Exception as e:
+                warnings.warn(f"Error resumiendo {self._file_path}: {str(e)}")
+                nuevo = ""
+            try:
+                if nuevo:
+                    self._aplicar_resumen(nuevo, fin, borrados)
+            finally:
+                with self._lock:
+                    self._resumiendo = False
+
+        try:
+            obtener_ejecutor("llm").submit(tarea)
+        except RuntimeError:
+            # El proceso se está cerrando; se resumirá en el próximo turno
+            self._resumiendo = False
+
+    def _aplicar_resumen(self, texto: str, fin: int, borrados: int) -> None:
+        """Sustituye el resumen y quita de memoria y del almacenamiento los mensajes resumidos."""
+        tokens = self._count_tokens(texto)
+        with self._lock:
+            if borrados != self._borrados:
+                return
+            # Alguno pudo recortarse mientras tanto por los límites
+            n = min(max(fin - self._inicio, 0), len(self._messages))
+            self._quitar_antiguos(n)
+            self._resumen, self._resumen_tokens = texto, tokens
+            resumen = {"texto": texto, "tokens": tokens, "tokenizador": self._tokenizer_name}
+            if self._cache is None:
+                self._historial.agregar([], n, resumen=resumen)
+                return
+            self._recortados_pendientes += n
+            self._resumen_pendiente = resumen
+        self._cache.marcar_pendiente(self)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Añade varios mensajes (un turno completo) con una sola escritura."""
         max_permitido = self._max_context_tokens - self._token_buffer
+        nuevos_tokens = []
+        for message in messages:
+            new_tokens = self._count_tokens(message.content)
+            if new_tokens > max_permitido:
+                raise ValueError(
+                    f"Mensaje demasiado largo ({new_tokens} tokens). "
+                    f"Máximo permitido: {max_permitido}"
+                )
+            nuevos_tokens.append(new_tokens)
 
-        if new_tokens > max_permitido:
-            raise ValueError(
-                f"Mensaje demasiado largo ({new_tokens} tokens). "
-                f"Máximo permitido: {max_permitido}"
-            )
+        with self._lock:
+            self._messages.extend(messages)
+            self._tokens.extend(nuevos_tokens)
+            self._total_tokens += sum(nuevos_tokens)
+            recortados = self._enforce_limits()
+            self._programar_resumen()
+            nuevos = [
+                _mensaje_a_dict(m, tokens, self._tokenizer_name)
+                for m, tokens in zip(messages, nuevos_tokens)
+            ]
+            if self._cache is None:
+                self._historial.agregar(nuevos, recortados)
+                self._historial.compactar_si_conviene(len(self._messages))
+                return
+            # Añadir al final y recortar del principio conmutan: todos los turnos
+            # pendientes se escriben como un único bloque de mensajes y un único recorte
+            self._pendientes.extend(nuevos)
+            self._recortados_pendientes += recortados
+        self._cache.marcar_pendiente(self)
 
-        self._messages.append(message)
-        self._enforce_limits()
+    def volcar(self, sincronizar: bool = False) -> None:
+        """Escribe en disco los mensajes pendientes (escritura diferida)."""
+        with self._lock:
+            if not self._pendientes and not self._recortados_pendientes and self._resumen_pendiente is None:
+                return
+            pendientes, recortados = self._pendientes, self._recortados_pendientes
+            resumen = self._resumen_pendiente
+            self._pendientes, self._recortados_pendientes, self._resumen_pendiente = [], 0, None
+            try:
+                self._historial.agregar(pendientes, recortados, sincronizar=sincronizar, resumen=resumen)
+            except Exception:
+                self._pendientes = pendientes + self._pendientes
+                self._recortados_pendientes += recortados
+                self._resumen_pendiente = self._resumen_pendiente or resumen
+                raise
+            self._historial.compactar_si_conviene(len(self._messages))
+
+    def add_message(self, message: BaseMessage) -> None:
+        """Añade un mensaje gestionando límites."""
+        self.add_messages([message])
 
     def add_user_message(self, message: str) -> None:
         """Añade mensaje de usuario."""
@@ -134,5 +565,192 @@ class Conversation(FileChatMessageHistory):
 
     def clear(self) -> None:
         """Limpia completamente el historial."""
-        self._messages = []
-        self._save_messages()
\ No newline at end of file
+        with self._lock:
+            self._messages, self._tokens, self._total_tokens = [], [], 0
+            self._resumen, self._resumen_tokens = "", 0
+            self._borrados += 1
+            self._pendientes, self._recortados_pendientes, self._resumen_pendiente = [], 0, None
+            self._historial.reescribir([])
+
+
+class CacheConversaciones:
+    """
+    Conversaciones vivas en memoria, una por archivo de historial, con expulsión LRU.
+
+    Cada agente pide su historial en cada invocación; con la caché, una sesión
+    activa no vuelve a leer ni a parsear su historial, y sus escrituras se
+    acumulan y se vuelcan en bloque desde un hilo en segundo plano cada
+    INTERVALO_VOLCADO segundos (con fsync), al expulsarla y al cerrar el proceso.
+
+    La caché es del proceso: con varios procesos trabajadores cada sesión debe
+    atenderse siempre en el mismo, o usar HISTORIAL_CACHE_CAPACIDAD=0 (el valor
+    por defecto con HISTORIAL_BACKEND=sqlite, que escribe directamente en la base).
+    """
+
+    def __init__(self, capacidad: int = CAPACIDAD_CACHE, intervalo: float = INTERVALO_VOLCADO):
+        self.capacidad = capacidad
+        self.intervalo = intervalo
+        self._conversaciones: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._pendientes: set = set()
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+        self._detener = threading.Event()
+        self._metricas = {"aciertos": 0, "fallos": 0, "expulsadas": 0, "volcados": 0, "errores": 0}
+
+    def obtener(self, file_path: str, **kwargs) -> Conversation:
+        """
+        Conversación del archivo con los límites indicados (mismos argumentos que Conversation).
+        """
+        if self.capacidad <= 0:
+            return Conversation(file_path=file_path, **kwargs)
+        limites = {k: kwargs[k] for k in ("max_context_tokens", "token_buffer", "max_messages",
+                                          "tokenizer", "tokenizer_name", "summary_window", "summarizer")
+                   if k in kwargs}
+        clave = os.path.abspath(file_path)
+        with self._lock:
+            conversacion = self._conversaciones.get(clave)
+            if conversacion is not None:
+                self._conversaciones.move_to_end(clave)
+                self._metricas["aciertos"] += 1
+            else:
+                self._metricas["fallos"] += 1
+        if conversacion is not None:
+            conversacion.configurar(**limites)
+            return conversacion
+
+        # La carga lee el disco: fuera del candado global, que comparten todas las sesiones
+        nueva = Conversation(file_path=file_path, **kwargs)
+        expulsadas = []
+        with self._lock:
+            conversacion = self._conversaciones.get(clave)
+            if conversacion is None:
+                conversacion = nueva
+                conversacion._cache = self
+                self._conversaciones[clave] = conversacion
+                while len(self._conversaciones) > self.capacidad:
+                    expulsadas.append(self._conversaciones.popitem(last=False)[1])
+                    self._metricas["expulsadas"] += 1
+                self._asegurar_volcador()
+            else:
+                # Otro hilo la cargó mientras tanto: se usa la suya
+                self._conversaciones.move_to_end(clave)
+
+        for expulsada in expulsadas:
+            self._volcar(expulsada, sincronizar=True)
+        if conversacion is not nueva:
+            conversacion.configurar(**limites)
+        return conversacion
+
+    def descartar(self, file_path: str) -> bool:
+        """
+        Saca de memoria la conversación de un archivo sin volcar lo pendiente
+        (la sesión se está borrando). Devuelve si estaba en la caché.
+        """
+        clave = os.path.abspath(file_path)
+        with self._lock:
+            conversacion = self._conversaciones.pop(clave, None)
+            if conversacion is None:
+                return False
+            self._pendientes.discard(conversacion)
+        with conversacion._lock:
+            conversacion._pendientes, conversacion._recortados_pendientes = [], 0
+            conversacion._resumen_pendiente = None
+            conversacion._cache = None
+        return True
+
+    def marcar_pendiente(self, conversacion: Conversation) -> None:
+        with self._lock:
+            self._pendientes.add(conversacion)
+
+    def _volcar(self, conversacion: Conversation, sincronizar: bool) -> None:
+        try:
+            conversacion.volcar(sincronizar=sincronizar)
+            self._metricas["volcados"] += 1
+        except Exception as e:
+            self._metricas["errores"] += 1
+            warnings.warn(f"Error guardando el historial {conversacion._file_path}: {str(e)}")
+            self.marcar_pendiente(conversacion)
+
+    def volcar_todo(self, sincronizar: bool = True) -> None:
+        """Escribe en disco lo pendiente de todas las conversaciones."""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, set()
+        for conversacion in pendientes:
+            self._volcar(conversacion, sincronizar)
+
+    def _asegurar_volcador(self) -> None:
+        """Arranca el hilo de volcado la primera vez. Debe llamarse con el candado tomado."""
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._volcador, name="volcado-historiales", daemon=True)
+            self._hilo.start()
+            atexit.register(self.cerrar)
+
+    def _volcador(self) -> None:
+        while not self._detener.wait(self.intervalo):
+            self.volcar_todo()
+
+    def cerrar(self) -> None:
+        """Detiene el volcado periódico y vuelca lo pendiente (al cerrar el proceso)."""
+        self._detener.set()
+        self.volcar_todo()
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            metricas = dict(self._metricas)
+            metricas["en_memoria"] = len(self._conversaciones)
+            metricas["pendientes"] = len(self._pendientes)
+        return metricas
+
+
+# Instancia global del proceso
+cache_conversaciones = CacheConversaciones()
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    # Micro-benchmark: recorte por límite de tokens con historiales largos.
+    # El tokenizador caro simula uno real (BPE) frente al conteo de palabras.
+    def tokenizador_caro(texto: str) -> int:
+        return len(texto.encode("utf-8")) // 4 + sum(1 for c in texto if c in " .,;:")
+
+    def recorte_cuadratico(mensajes, maximo, buffer):
+        # Algoritmo anterior: re-tokeniza todo el historial en cada mensaje eliminado
+        mensajes = list(mensajes)
+        while len(mensajes) > 1:
+            if maximo - sum(tokenizador_caro(m.content) for m in mensajes) >= buffer:
+                break
+            mensajes.pop(0)
+        return len(mensajes)
+
+    texto = "El paciente refiere dolor de cabeza intermitente desde hace tres días, sin fiebre. " * 4
+    with tempfile.TemporaryDirectory() as directorio:
+        for n in (200, 500, 1000):
+            mensajes = [HumanMessage(content=texto) for _ in range(n)]
+            por_mensaje = tokenizador_caro(texto)
+            # El límite obliga a descartar la mitad del historial de golpe
+            maximo, buffer = por_mensaje * n // 2 + 64, 64
+
+            inicio = time.perf_counter()
+            vivos_antes = recorte_cuadratico(mensajes, maximo, buffer)
+            t_antes = time.perf_counter() - inicio
+
+            conversacion = Conversation(
+                file_path=os.path.join(directorio, f"bench_{n}.jsonl"),
+                max_context_tokens=10 ** 9, token_buffer=buffer, tokenizer=tokenizador_caro, tokenizer_name="bench",
+            )
+            conversacion.add_messages(mensajes)
+            conversacion._max_context_tokens = maximo
+            inicio = time.perf_counter()
+            conversacion._enforce_limits()
+            t_ahora = time.perf_counter() - inicio
+            assert len(conversacion.messages) == vivos_antes
+
+            # Turnos en caliente con el historial lleno
+            inicio = time.perf_counter()
+            for _ in range(200):
+                conversacion.add_message(HumanMessage(content=texto))
+            t_turno = (time.perf_counter() - inicio) / 200
+
+            print(f"[BENCH] {n:5d} mensajes: recorte cuadrático {t_antes * 1000:9.1f} ms | "
+                  f"incremental {t_ahora * 1000:7.3f} ms | turno {t_turno * 1000:.3f} ms")
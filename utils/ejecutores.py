@@ -0,0 +1,63 @@
+import os
+import asyncio
+import functools
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+# Hilos por tipo de trabajo. Cada grupo tiene un tope propio para que una ráfaga
+# de imágenes no deje sin hilos a las consultas de texto, y viceversa.
+HILOS_POR_TIPO = {
+    # Flujos de agentes que aún son síncronos (el LLM en sí va por el planificador)
+    "llm": int(os.getenv("EJECUTOR_LLM_HILOS", 4)),
+    # Modelos de visión (TensorFlow, PyTorch, YOLO)
+    "vision": int(os.getenv("EJECUTOR_VISION_HILOS", 1)),
+    # Peticiones HTTP y lectura de archivos
+    "io": int(os.getenv("EJECUTOR_IO_HILOS", 8)),
+}
+
+_ejecutores: Dict[str, ThreadPoolExecutor] = {}
+_lock = threading.Lock()
+
+
+def obtener_ejecutor(tipo: str) -> ThreadPoolExecutor:
+    """Devuelve el pool de hilos de un tipo de trabajo, creándolo la primera vez."""
+    if tipo not in HILOS_POR_TIPO:
+        raise ValueError(f"Tipo de ejecutor desconocido: {tipo}")
+    with _lock:
+        ejecutor = _ejecutores.get(tipo)
+        if ejecutor is None:
+            ejecutor = _ejecutores[tipo] = ThreadPoolExecutor(
+                max_workers=HILOS_POR_TIPO[tipo],
+                thread_name_prefix=f"ejecutor-{tipo}"
+            )
+        return ejecutor
+
+
+async def en_ejecutor(tipo: str, funcion: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Ejecuta una función bloqueante en el pool de su tipo sin bloquear el event loop.
+
+    Args:
+        tipo: "llm", "vision" o "io"
+        funcion: Función síncrona a ejecutar
+        *args, **kwargs: Argumentos de la función
+
+    Returns:
+        El resultado de la función
+    """
+    loop = asyncio.get_running_loop()
+    # Conserva las variables de contexto (callbacks de LangChain, etc.)
+    contexto = contextvars.copy_context()
+    llamada = functools.partial(contexto.run, funcion, *args, **kwargs)
+    return await loop.run_in_executor(obtener_ejecutor(tipo), llamada)
+
+
+def cerrar_ejecutores(esperar: bool = True) -> None:
+    """Cierra todos los pools creados."""
+    with _lock:
+        ejecutores = list(_ejecutores.values())
+        _ejecutores.clear()
+    for ejecutor in ejecutores:
+        ejecutor.shutdown(wait=esperar)
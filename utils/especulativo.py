@@ -0,0 +1,215 @@
+import os
+import json
+import threading
+import warnings
+from typing import Optional, Dict, Any, Union
+
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+# Tokens que propone el borrador en cada paso si la configuración no lo indica
+TOKENS_PROPUESTOS = int(os.getenv("LLAMA_DRAFT_TOKENS", 10))
+
+
+class BorradorGGUF(LlamaDraftModel):
+    """
+    Modelo borrador pequeño (mismo vocabulario que el principal) que propone
+    los siguientes tokens con decodificación voraz. El modelo principal los
+    verifica todos en una sola pasada.
+    """
+
+    def __init__(self, model_path: str, num_pred_tokens: int = 4, n_ctx: int = 2048,
+                 n_threads: Optional[int] = None):
+        self.model_path = model_path
+        self.num_pred_tokens = num_pred_tokens
+        print(f"[ESPECULATIVO] Cargando borrador {os.path.basename(model_path)}")
+        self.llama = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            verbose=False,
+        )
+        self._eos = self.llama.token_eos()
+
+    def _logits_ultimo(self) -> np.ndarray:
+        return np.ctypeslib.as_array(self.llama._ctx.get_logits_ith(-1), shape=(self.llama.n_vocab(),))
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs: Any) -> np.ndarray:
+        ids = input_ids.tolist()
+        if len(ids) + self.num_pred_tokens >= self.llama.n_ctx():
+            return np.array([], dtype=np.intc)
+
+        # Reutiliza lo ya evaluado en la llamada anterior (misma generación)
+        comun = 0
+        limite = min(self.llama.n_tokens, len(ids) - 1)
+        previos = self.llama.input_ids
+        while comun < limite and previos[comun] == ids[comun]:
+            comun += 1
+        self.llama.n_tokens = comun
+        self.llama.eval(ids[comun:])
+
+        propuesta = []
+        for _ in range(self.num_pred_tokens):
+            token = int(np.argmax(self._logits_ultimo()))
+            if token == self._eos:
+                break
+            propuesta.append(token)
+            self.llama.eval([token])
+        return np.array(propuesta, dtype=np.intc)
+
+
+class MedidorVelocidad:
+    """Acumula tokens generados y tiempo de generación."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metricas = {"generaciones": 0, "tokens_generados": 0, "segundos": 0.0}
+
+    def registrar_generacion(self, tokens: int, segundos: float) -> None:
+        with self._lock:
+            self._metricas["generaciones"] += 1
+            self._metricas["tokens_generados"] += tokens
+            self._metricas["segundos"] += segundos
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            metricas = dict(self._metricas)
+        metricas["tokens_por_segundo"] = (
+            metricas["tokens_generados"] / metricas["segundos"] if metricas["segundos"] else 0.0
+        )
+        return metricas
+
+
+class BorradorMedido(MedidorVelocidad, LlamaDraftModel):
+    """
+    Envuelve un borrador y cuenta cuántos de sus tokens acepta el modelo principal.
+
+    En cada paso llama.cpp pasa al borrador todos los tokens confirmados; los
+    tokens de la propuesta anterior que aparecen ahí son los aceptados. La última
+    propuesta de cada generación no llega a verificarse y no se cuenta.
+    """
+
+    def __init__(self, nombre: str, borrador: LlamaDraftModel):
+        super().__init__()
+        self.nombre = nombre
+        self.borrador = borrador
+        self._ultima = None  # (posición, tokens propuestos)
+        self._metricas.update(propuestos=0, aceptados=0)
+
+    def reiniciar(self) -> None:
+        """Descarta la propuesta pendiente: empieza otra generación."""
+        self._ultima = None
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs: Any) -> np.ndarray:
+        if self._ultima is not None:
+            inicio, propuesta = self._ultima
+            confirmados = input_ids[inicio:inicio + len(propuesta)]
+            aceptados = 0
+            for propuesto, confirmado in zip(propuesta, confirmados):
+                if propuesto != confirmado:
+                    break
+                aceptados += 1
+            with self._lock:
+                self._metricas["propuestos"] += len(propuesta)
+                self._metricas["aceptados"] += aceptados
+
+        propuesta = self.borrador(input_ids, **kwargs)
+        self._ultima = (len(input_ids), propuesta.tolist()) if len(propuesta) else None
+        return propuesta
+
+    def metricas(self) -> Dict[str, Any]:
+        metricas = super().metricas()
+        metricas["tasa_aceptacion"] = (
+            metricas["aceptados"] / metricas["propuestos"] if metricas["propuestos"] else 0.0
+        )
+        return metricas
+
+
+def normalizar_config(draft_model: Union[str, Dict[str, Any], None]) -> Optional[Dict[str, Any]]:
+    """
+    Convierte `model_config["draft_model"]` en un dict.
+
+    Acepta:
+        - "prompt_lookup": decodificación por búsqueda en el prompt (sin modelo extra)
+        - "ruta/al/borrador.gguf": modelo borrador pequeño
+        - un dict con "tipo" ("prompt_lookup" o "gguf"), "model_path",
+          "num_pred_tokens" y "max_ngram_size"
+    """
+    if not draft_model:
+        return None
+    if isinstance(draft_model, str):
+        if draft_model == "prompt_lookup":
+            draft_model = {"tipo": "prompt_lookup"}
+        else:
+            draft_model = {"tipo": "gguf", "model_path": draft_model}
+    config = dict(draft_model)
+    config.setdefault("tipo", "gguf" if config.get("model_path") else "prompt_lookup")
+    if config["tipo"] == "gguf":
+        config["model_path"] = os.path.abspath(config["model_path"])
+        config.setdefault("num_pred_tokens", min(TOKENS_PROPUESTOS, 4))
+    else:
+        config.setdefault("num_pred_tokens", TOKENS_PROPUESTOS)
+        config.setdefault("max_ngram_size", 2)
+    return config
+
+
+class RegistroBorradores:
+    """Borradores compartidos por todos los agentes, uno por configuración."""
+
+    def __init__(self):
+        # None para las configuraciones que no se pudieron cargar
+        self._borradores: Dict[str, Optional[BorradorMedido]] = {}
+        self.sin_borrador = MedidorVelocidad()
+        self._lock = threading.Lock()
+
+    def obtener(self, config: Dict[str, Any], client: Llama) -> Optional[BorradorMedido]:
+        """Devuelve el borrador de una configuración ya normalizada, creándolo si no existe."""
+        clave = json.dumps(config, sort_keys=True)
+        with self._lock:
+            if clave in self._borradores:
+                return self._borradores[clave]
+
+            if config["tipo"] == "prompt_lookup":
+                interno = LlamaPromptLookupDecoding(
+                    max_ngram_size=config["max_ngram_size"],
+                    num_pred_tokens=config["num_pred_tokens"],
+                )
+                nombre = f"prompt_lookup_{config['num_pred_tokens']}"
+            else:
+                try:
+                    interno = BorradorGGUF(
+                        config["model_path"],
+                        num_pred_tokens=config["num_pred_tokens"],
+                        n_ctx=client.n_ctx(),
+                        n_threads=client.context_params.n_threads,
+                    )
+                except Exception as e:
+                    warnings.warn(f"No se pudo cargar el borrador {config['model_path']}: {str(e)}")
+                    self._borradores[clave] = None
+                    return None
+                if interno.llama.n_vocab() != client.n_vocab():
+                    warnings.warn(
+                        f"El borrador {config['model_path']} no comparte vocabulario con el modelo principal; "
+                        "se genera sin decodificación especulativa."
+                    )
+                    self._borradores[clave] = None
+                    return None
+                nombre = os.path.basename(config["model_path"])
+
+            borrador = self._borradores[clave] = BorradorMedido(nombre, interno)
+            return borrador
+
+    def estadisticas(self) -> Dict[str, Dict[str, Any]]:
+        """Tasa de aceptación y tokens/s por borrador, y tokens/s sin borrador."""
+        with self._lock:
+            borradores = [b for b in self._borradores.values() if b is not None]
+        estadisticas = {"sin_borrador": self.sin_borrador.metricas()}
+        for borrador in borradores:
+            estadisticas[borrador.nombre] = borrador.metricas()
+        return estadisticas
+
+
+# Instancia global del proceso
+registro_borradores = RegistroBorradores()
+
@@ -0,0 +1,60 @@
+import json
+import threading
+import warnings
+from typing import Dict, Any, List, Optional
+
+from llama_cpp import LlamaGrammar
+from llama_cpp.llama_grammar import json_schema_to_gbnf
+
+# La regla de llama-cpp-python 0.3.9 admite caracteres de control (saltos de línea)
+# dentro de las cadenas, que json.loads rechaza; se sustituye por una que los excluye
+REGLA_CHAR = 'char ::= [^"\\\\]'
+REGLA_CHAR_ESTRICTA = 'char ::= [^"\\\\\\x7F\\x00-\\x1F]'
+
+
+def gramatica_opciones(opciones: List[str]) -> str:
+    """
+    Gramática GBNF que solo admite una de las opciones, exactamente.
+    Se permite un espacio inicial porque muchos modelos lo emiten tras "Respuesta:".
+    """
+    alternativas = " | ".join(json.dumps(opcion, ensure_ascii=False) for opcion in opciones)
+    return f'root ::= " "? ({alternativas})\n'
+
+
+def gramatica_json(esquema: Dict[str, Any]) -> str:
+    """Gramática GBNF que solo admite JSON válido según un esquema JSON."""
+    gbnf = json_schema_to_gbnf(json.dumps(esquema, ensure_ascii=False))
+    if REGLA_CHAR in gbnf:
+        return gbnf.replace(REGLA_CHAR, REGLA_CHAR_ESTRICTA)
+    if REGLA_CHAR_ESTRICTA not in gbnf:
+        warnings.warn(
+            "[GRAMATICA] La regla 'char' generada por llama-cpp-python cambió; "
+            "las cadenas pueden admitir caracteres de control que json.loads rechaza"
+        )
+    return gbnf
+
+
+class CacheGramaticas:
+    """
+    Gramáticas compiladas, una por texto GBNF.
+
+    Compilar una gramática cuesta más que muestrear con ella; los agentes
+    repiten siempre las mismas, así que se compilan una vez por proceso.
+    """
+
+    def __init__(self):
+        self._gramaticas: Dict[str, LlamaGrammar] = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, gbnf: Optional[str]) -> Optional[LlamaGrammar]:
+        if not gbnf:
+            return None
+        with self._lock:
+            gramatica = self._gramaticas.get(gbnf)
+            if gramatica is None:
+                gramatica = self._gramaticas[gbnf] = LlamaGrammar.from_string(gbnf, verbose=False)
+            return gramatica
+
+
+# Instancia global del proceso
+cache_gramaticas = CacheGramaticas()
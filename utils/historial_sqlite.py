@@ -0,0 +1,309 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+from typing import Optional, List, Dict, Any, Sequence, Tuple
+
+# Base de datos compartida por todas las sesiones (y todos los procesos trabajadores)
+RUTA_DB = os.getenv("HISTORIAL_DB", os.path.join("historiales", "historiales.sqlite3"))
+# Segundos que un escritor espera a que otro proceso suelte la base
+ESPERA_BLOQUEO = float(os.getenv("HISTORIAL_DB_ESPERA", 30))
+
+_locales: Dict[str, threading.local] = {}
+_iniciadas = set()
+_lock = threading.Lock()
+
+
+def clave_historial(file_path: str) -> Tuple[str, str]:
+    """
+    (colección, session_id) a partir de la ruta que usa cada agente:
+    "historiales/006.jsonl" -> ("historiales", "006"),
+    "pdf_analysis/session_006.jsonl" -> ("pdf_analysis", "session_006").
+    """
+    coleccion = os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+    session_id = os.path.splitext(os.path.basename(file_path))[0]
+    return coleccion, session_id
+
+
+def _conexion(ruta: str) -> sqlite3.Connection:
+    """Una conexión por hilo y base: en WAL los lectores no se bloquean entre sí ni con el escritor."""
+    ruta = os.path.abspath(ruta)
+    with _lock:
+        local = _locales.setdefault(ruta, threading.local())
+    conexion = getattr(local, "conexion", None)
+    if conexion is not None:
+        return conexion
+
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    # Transacciones explícitas (BEGIN IMMEDIATE en las escrituras)
+    conexion = sqlite3.connect(ruta, timeout=ESPERA_BLOQUEO, isolation_level=None)
+    conexion.execute("PRAGMA journal_mode=WAL")
+    conexion.execute("PRAGMA synchronous=NORMAL")
+    with _lock:
+        if ruta not in _iniciadas:
+            conexion.executescript(
+                "CREATE TABLE IF NOT EXISTS mensajes ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "coleccion TEXT NOT NULL, "
+                "session_id TEXT NOT NULL, "
+                "creado REAL NOT NULL, "
+                "tipo TEXT NOT NULL, "
+                "contenido TEXT NOT NULL, "
+                "tokens INTEGER, "
+                "tokenizador TEXT);"
+                "CREATE INDEX IF NOT EXISTS idx_mensajes_sesion "
+                "ON mensajes (coleccion, session_id, creado);"
+                "CREATE TABLE IF NOT EXISTS resumenes ("
+                "coleccion TEXT NOT NULL, "
+                "session_id TEXT NOT NULL, "
+                "texto TEXT NOT NULL, "
+                "tokens INTEGER, "
+                "tokenizador TEXT, "
+                "PRIMARY KEY (coleccion, session_id));"
+                # Estado de enrutamiento por sesión compartido entre procesos (ver utils/sesiones.py)
+                "CREATE TABLE IF NOT EXISTS sesiones ("
+                "espacio TEXT NOT NULL, "
+                "session_id TEXT NOT NULL, "
+                "datos TEXT NOT NULL, "
+                "vence REAL NOT NULL, "
+                "PRIMARY KEY (espacio, session_id));"
+                "CREATE INDEX IF NOT EXISTS idx_sesiones_vence ON sesiones (espacio, vence);"
+            )
+            # Bases creadas antes de guardar el recuento de tokens de cada mensaje
+            columnas = {fila[1] for fila in conexion.execute("PRAGMA table_info(mensajes)")}
+            for columna, tipo in (("tokens", "INTEGER"), ("tokenizador", "TEXT")):
+                if columna not in columnas:
+                    conexion.execute(f"ALTER TABLE mensajes ADD COLUMN {columna} {tipo}")
+            _iniciadas.add(ruta)
+    local.conexion = conexion
+    return conexion
+
+
+class HistorialSQLite:
+    """
+    Historial de una sesión guardado en la base SQLite compartida.
+
+    Misma interfaz que HistorialJSONL (cargar, agregar, reescribir). Cada turno
+    se escribe en una sola transacción: los mensajes nuevos y, si hubo recorte,
+    el borrado de los más antiguos (y el resumen que los sustituye, si lo hay).
+    Varios procesos pueden usar la misma base; SQLite serializa las escrituras
+    y los lectores no esperan.
+    """
+
+    def __init__(self, file_path: str, ruta_db: Optional[str] = None):
+        self.coleccion, self.session_id = clave_historial(file_path)
+        self.ruta_db = ruta_db or RUTA_DB
+
+    def _escribir(self, operaciones) -> None:
+        conexion = _conexion(self.ruta_db)
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            operaciones(conexion)
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+        conexion.execute("COMMIT")
+
+    def _insertar(self, conexion: sqlite3.Connection, mensajes: Sequence[Dict[str, Any]],
+                  creado: Optional[float] = None) -> None:
+        creado = creado if creado is not None else time.time()
+        conexion.executemany(
+            "INSERT INTO mensajes (coleccion, session_id, creado, tipo, contenido, tokens, tokenizador) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(self.coleccion, self.session_id, creado, m["type"], m["content"],
+              m.get("tokens"), m.get("tokenizador")) for m in mensajes],
+        )
+
+    def cargar(self) -> List[Dict[str, Any]]:
+        filas = _conexion(self.ruta_db).execute(
+            "SELECT tipo, contenido, tokens, tokenizador FROM mensajes "
+            "WHERE coleccion = ? AND session_id = ? ORDER BY creado, id",
+            (self.coleccion, self.session_id),
+        ).fetchall()
+        return [
+            {"type": tipo, "content": contenido, "tokens": tokens, "tokenizador": tokenizador}
+            for tipo, contenido, tokens, tokenizador in filas
+        ]
+
+    def obtener_resumen(self) -> Optional[Dict[str, Any]]:
+        fila = _conexion(self.ruta_db).execute(
+            "SELECT texto, tokens, tokenizador FROM resumenes WHERE coleccion = ? AND session_id = ?",
+            (self.coleccion, self.session_id),
+        ).fetchone()
+        if fila is None:
+            return None
+        return {"texto": fila[0], "tokens": fila[1], "tokenizador": fila[2]}
+
+    def _guardar_resumen(self, conexion: sqlite3.Connection, resumen: Dict[str, Any]) -> None:
+        conexion.execute(
+            "INSERT OR REPLACE INTO resumenes (coleccion, session_id, texto, tokens, tokenizador) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (self.coleccion, self.session_id, resumen["texto"], resumen.get("tokens"), resumen.get("tokenizador")),
+        )
+
+    def agregar(self, mensajes: Sequence[Dict[str, Any]], recortados: int = 0,
+                sincronizar: bool = False, resumen: Optional[Dict[str, Any]] = None) -> None:
+        # En WAL cada COMMIT ya es duradero frente a una caída del proceso; `sincronizar`
+        # (fsync por volcado) no añade nada aquí
+        def operaciones(conexion):
+            self._insertar(conexion, mensajes)
+            if recortados:
+                conexion.execute(
+                    "DELETE FROM mensajes WHERE id IN ("
+                    "SELECT id FROM mensajes WHERE coleccion = ? AND session_id = ? "
+                    "ORDER BY creado, id LIMIT ?)",
+                    (self.coleccion, self.session_id, recortados),
+                )
+            if resumen is not None:
+                self._guardar_resumen(conexion, resumen)
+
+        if mensajes or recortados or resumen is not None:
+            self._escribir(operaciones)
+
+    def reescribir(self, mensajes: Sequence[Dict[str, Any]], creado: Optional[float] = None,
+                   resumen: Optional[Dict[str, Any]] = None) -> None:
+        def operaciones(conexion):
+            for tabla in ("mensajes", "resumenes"):
+                conexion.execute(
+                    f"DELETE FROM {tabla} WHERE coleccion = ? AND session_id = ?",
+                    (self.coleccion, self.session_id),
+                )
+            self._insertar(conexion, mensajes, creado)
+            if resumen is not None:
+                self._guardar_resumen(conexion, resumen)
+
+        self._escribir(operaciones)
+
+    def borrar(self) -> int:
+        """Elimina la sesión (mensajes y resumen). Devuelve cuántos mensajes tenía."""
+        borrados = []
+
+        def operaciones(conexion):
+            cursor = conexion.execute(
+                "DELETE FROM mensajes WHERE coleccion = ? AND session_id = ?",
+                (self.coleccion, self.session_id),
+            )
+            borrados.append(cursor.rowcount)
+            conexion.execute(
+                "DELETE FROM resumenes WHERE coleccion = ? AND session_id = ?",
+                (self.coleccion, self.session_id),
+            )
+
+        self._escribir(operaciones)
+        return borrados[0]
+
+    def existe(self) -> bool:
+        return _conexion(self.ruta_db).execute(
+            "SELECT 1 FROM mensajes WHERE coleccion = ? AND session_id = ? LIMIT 1",
+            (self.coleccion, self.session_id),
+        ).fetchone() is not None
+
+    def compactar_si_conviene(self, vivos: int) -> None:
+        """Los recortes ya borran filas; no hay nada que compactar."""
+
+
+def purgar_inactivas(coleccion: str, antes_de: float, ruta_db: str = RUTA_DB,
+                     sesiones: Optional[Sequence[str]] = None) -> Tuple[List[str], int]:
+    """
+    Elimina las sesiones de una colección sin mensajes posteriores a `antes_de`.
+
+    Args:
+        coleccion: "historiales" o "pdf_analysis"
+        antes_de: Marca de tiempo (time.time()) del último mensaje admitido
+        ruta_db: Base a purgar
+        sesiones: Limitar a estas sesiones (p. ej. las temporales)
+
+    Returns:
+        (session_id eliminados, mensajes eliminados)
+    """
+    conexion = _conexion(ruta_db)
+    filtro, parametros = "", [coleccion]
+    if sesiones is not None:
+        if not sesiones:
+            return [], 0
+        filtro = f" AND session_id IN ({', '.join('?' * len(sesiones))})"
+        parametros += list(sesiones)
+    conexion.execute("BEGIN IMMEDIATE")
+    try:
+        viejas = [fila[0] for fila in conexion.execute(
+            f"SELECT session_id FROM mensajes WHERE coleccion = ?{filtro} "
+            "GROUP BY session_id HAVING MAX(creado) < ?",
+            parametros + [antes_de],
+        )]
+        mensajes = 0
+        for session_id in viejas:
+            mensajes += conexion.execute(
+                "DELETE FROM mensajes WHERE coleccion = ? AND session_id = ?", (coleccion, session_id)
+            ).rowcount
+            conexion.execute(
+                "DELETE FROM resumenes WHERE coleccion = ? AND session_id = ?", (coleccion, session_id)
+            )
+    except BaseException:
+        conexion.execute("ROLLBACK")
+        raise
+    conexion.execute("COMMIT")
+    return viejas, mensajes
+
+
+def migrar(directorios: List[str], ruta_db: str = RUTA_DB, reemplazar: bool = False,
+           borrar: bool = False) -> Dict[str, int]:
+    """
+    Importa a SQLite los historiales en archivos (JSON antiguo o log JSONL).
+
+    Args:
+        directorios: Carpetas con historiales (p. ej. historiales, pdf_analysis)
+        ruta_db: Base de destino
+        reemplazar: Sobrescribir las sesiones que ya estén en la base
+        borrar: Eliminar cada archivo tras importarlo
+
+    Returns:
+        Contadores de sesiones importadas, omitidas y con error, y mensajes importados
+    """
+    from utils.conversation import HistorialJSONL, leer_json_antiguo
+
+    resumen = {"importadas": 0, "omitidas": 0, "errores": 0, "mensajes": 0}
+    for directorio in directorios:
+        for nombre in sorted(os.listdir(directorio)):
+            ruta = os.path.join(directorio, nombre)
+            if not (nombre.endswith(".json") or nombre.endswith(".jsonl")):
+                continue
+            destino = HistorialSQLite(ruta, ruta_db)
+            if destino.existe() and not reemplazar:
+                resumen["omitidas"] += 1
+                continue
+            resumen_sesion = None
+            if nombre.endswith(".jsonl"):
+                origen = HistorialJSONL(ruta)
+                mensajes = origen.cargar()
+                resumen_sesion = origen.obtener_resumen()
+            else:
+                mensajes = leer_json_antiguo(ruta)
+            if mensajes is None:
+                resumen["errores"] += 1
+                continue
+            # La fecha del archivo conserva el orden aproximado entre sesiones
+            destino.reescribir(mensajes, creado=os.path.getmtime(ruta), resumen=resumen_sesion)
+            resumen["importadas"] += 1
+            resumen["mensajes"] += len(mensajes)
+            if borrar:
+                os.remove(ruta)
+    return resumen
+
+
+if __name__ == "__main__":
+    import argparse
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    parser = argparse.ArgumentParser(description="Importa historiales en archivos a la base SQLite")
+    parser.add_argument("directorios", nargs="*", default=["historiales", "pdf_analysis"])
+    parser.add_argument("--db", default=RUTA_DB, help="Base de destino")
+    parser.add_argument("--reemplazar", action="store_true", help="Sobrescribir sesiones ya importadas")
+    parser.add_argument("--borrar", action="store_true", help="Eliminar los archivos importados")
+    args = parser.parse_args()
+
+    directorios = [d for d in args.directorios if os.path.isdir(d)]
+    resumen = migrar(directorios, args.db, reemplazar=args.reemplazar, borrar=args.borrar)
+    print(f"[MIGRACION] {resumen['importadas']} sesiones importadas ({resumen['mensajes']} mensajes), "
+          f"{resumen['omitidas']} ya existían, {resumen['errores']} con error -> {args.db}")
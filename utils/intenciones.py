@@ -0,0 +1,233 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# `.*` entre dos partes de un patrón: "A y después B en el mensaje"
+_CONJUNCION = re.compile(r'(?<!\\)\.\*')
+# Comienzo de palabra: los patrones indexados solo pueden empezar ahí
+_INICIO_PALABRA = re.compile(r'\b\w')
+_METACARACTERES = set("\\?*+{}()[]|.^$")
+
+
+@dataclass
+class Coincidencia:
+    """Intención encontrada en un mensaje."""
+    intencion: str
+    puntuacion: int
+    inicio: int                       # posición de su primera coincidencia
+    patrones: List[str] = field(default_factory=list)
+
+
+def _sin_consumir_resto(partes: List[str]) -> str:
+    """
+    `A.*B.*C` -> `A(?=.*?B(?=.*?C))`: la coincidencia solo consume A, así que
+    el resto del mensaje sigue disponible para los demás patrones.
+    """
+    expresion = partes[-1]
+    for parte in reversed(partes[1:-1]):
+        expresion = f"{parte}(?=.*?{expresion})"
+    if len(partes) > 1:
+        expresion = f"{partes[0]}(?=.*?{expresion})"
+    return expresion
+
+
+def _palabras_iniciales(patron: str) -> Optional[List[str]]:
+    """
+    Prefijos literales con los que puede empezar un patrón `\\b(alt1|alt2|...)...`:
+    "\\b(rayos?\\s*x|tac)" -> ["rayo", "tac"]. None si no tiene esa forma.
+    """
+    if not patron.startswith(r"\b("):
+        return None
+    alternativas, actual, nivel = [], "", 0
+    for caracter in patron[3:]:
+        if caracter == "(":
+            nivel += 1
+        elif caracter == ")":
+            if nivel == 0:
+                break
+            nivel -= 1
+        elif caracter == "|" and nivel == 0:
+            alternativas.append(actual)
+            actual = ""
+            continue
+        actual += caracter
+    else:
+        return None
+    alternativas.append(actual)
+
+    palabras = []
+    for alternativa in alternativas:
+        literal = ""
+        for caracter in alternativa:
+            if caracter in _METACARACTERES:
+                # "rayos?" -> "rayo": el cuantificador afecta al último carácter
+                if caracter in "?*{":
+                    literal = literal[:-1]
+                break
+            literal += caracter
+        if not literal:
+            return None
+        palabras.append(literal.lower())
+    return palabras
+
+
+class ClasificadorIntenciones:
+    """
+    Clasificador por palabras clave que recorre el mensaje una sola vez y
+    devuelve todas las intenciones presentes, no solo la primera del diccionario.
+
+    Cada patrón se indexa por las dos primeras letras de las palabras con las
+    que puede empezar; el mensaje se recorre por comienzos de palabra y en cada
+    uno solo se prueban (anclados en esa posición) los patrones de su índice.
+    Los patrones sin esa forma se buscan en todo el mensaje.
+
+    Cada patrón distinto que aparece suma a su intención tantos puntos como
+    partes tiene (`A.*B` vale 2: es más específico que una palabra suelta).
+    A igual puntuación gana la intención que aparece antes en el mensaje.
+    """
+
+    def __init__(self, patrones: Dict[str, List[str]]):
+        self._patrones: List[Tuple[str, str, int]] = []  # (intención, patrón, peso)
+        self._indice: Dict[str, List[Tuple[int, "re.Pattern"]]] = {}
+        self._sin_indice: List[Tuple[int, "re.Pattern"]] = []
+        for intencion, lista in patrones.items():
+            for patron in lista:
+                numero = len(self._patrones)
+                partes = _CONJUNCION.split(patron)
+                self._patrones.append((intencion, patron, len(partes)))
+                palabras = _palabras_iniciales(patron)
+                if palabras is None:
+                    self._sin_indice.append((numero, re.compile(_sin_consumir_resto(partes), re.IGNORECASE)))
+                    continue
+                # Anclado al comienzo de palabra que lo dispara: sobra el \b inicial
+                compilado = re.compile(_sin_consumir_resto(partes)[2:], re.IGNORECASE)
+                for clave in {palabra[:2] for palabra in palabras}:
+                    self._indice.setdefault(clave, []).append((numero, compilado))
+
+    def clasificar(self, mensaje: str) -> List[Coincidencia]:
+        """
+        Intenciones presentes en el mensaje, de mayor a menor puntuación.
+
+        Args:
+            mensaje: Mensaje del usuario
+
+        Returns:
+            Lista de Coincidencia (vacía si ningún patrón aparece)
+        """
+        texto = mensaje.lower()
+        inicios: Dict[int, int] = {}  # patrón -> primera posición
+        indice = self._indice
+        for palabra in _INICIO_PALABRA.finditer(texto):
+            posicion = palabra.start()
+            for clave in (texto[posicion:posicion + 2], texto[posicion]):
+                for numero, compilado in indice.get(clave, ()):
+                    if numero not in inicios and compilado.match(texto, posicion):
+                        inicios[numero] = posicion
+        for numero, compilado in self._sin_indice:
+            m = compilado.search(texto)
+            if m:
+                inicios[numero] = m.start()
+
+        encontradas: Dict[str, Coincidencia] = {}
+        for numero, posicion in sorted(inicios.items(), key=lambda item: item[1]):
+            intencion, patron, peso = self._patrones[numero]
+            coincidencia = encontradas.get(intencion)
+            if coincidencia is None:
+                coincidencia = encontradas[intencion] = Coincidencia(intencion, 0, posicion)
+            coincidencia.puntuacion += peso
+            coincidencia.patrones.append(patron)
+        return sorted(encontradas.values(), key=lambda c: (-c.puntuacion, c.inicio))
+
+    def mejor(self, mensaje: str) -> Optional[str]:
+        """La intención con más puntuación, o None."""
+        coincidencias = self.clasificar(mensaje)
+        return coincidencias[0].intencion if coincidencias else None
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import json
+    import glob
+    import time
+    import random
+    import argparse
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from agents.orquestador import PATRONES_CLASIFICACION as patrones
+
+    parser = argparse.ArgumentParser(description="Benchmark del clasificador por patrones")
+    parser.add_argument("--corpus", nargs="*", default=["historiales/*.json*"],
+                        help="Historiales (.json/.jsonl) o textos con un mensaje por línea")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    def mensajes_de(ruta: str) -> List[str]:
+        with open(ruta, encoding="utf-8") as f:
+            if ruta.endswith(".jsonl"):
+                registros = [json.loads(l) for l in f if l.strip()]
+                return [r["msg"]["content"] for r in registros
+                        if r.get("op") == "add" and r["msg"].get("type") == "human"]
+            if ruta.endswith(".json"):
+                return [m["content"] for m in json.load(f) if m.get("type") == "human"]
+            return [l.strip() for l in f if l.strip()]
+
+    corpus = []
+    for patron in args.corpus:
+        for ruta in glob.glob(patron):
+            try:
+                corpus.extend(mensajes_de(ruta))
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+
+    if not corpus:
+        # Sin historiales: mensajes sintéticos con el estilo de los reales
+        random.seed(0)
+        frases = [
+            "hola, desde hace tres días tengo dolor de cabeza y fiebre", "me duele el pecho al respirar",
+            "tengo los resultados del hemograma, ¿qué significa la hemoglobina baja?",
+            "¿qué es la diabetes tipo 2?", "explícame cómo funciona la insulina",
+            "necesito un hospital cerca de mi casa", "¿dónde hay una clínica abierta ahora?",
+            "quiero hablar con un médico lo antes posible", "es urgente, mi hijo se cayó",
+            "te envío la radiografía de tórax", "¿puedes revisar esta resonancia?",
+            "mis valores de referencia de colesterol salieron altos", "gracias, y ¿qué más debo hacer?",
+            "buscar un doctor especialista en cardiología", "quiero una cita para mañana",
+            "tengo tos seca y cansancio", "¿la creatinina alta es grave?", "ok", "entendido",
+        ]
+        relleno = "la verdad no sé muy bien cómo explicarlo pero llevo varios días así y estoy preocupado".split()
+        for _ in range(20000):
+            partes = random.sample(frases, random.randint(1, 3))
+            corpus.append(". ".join(partes) + " " + " ".join(random.sample(relleno, random.randint(0, 8))))
+
+    def anterior(mensaje: str) -> Optional[str]:
+        # Implementación previa de Orquestador._clasificar_por_patrones
+        mensaje_lower = mensaje.lower()
+        for funcionalidad, lista in patrones.items():
+            for patron in lista:
+                if re.search(patron, mensaje_lower, re.IGNORECASE):
+                    return funcionalidad
+        return None
+
+    def anterior_todas(mensaje: str) -> List[str]:
+        # El bucle previo, si tuviera que devolver todas las intenciones
+        mensaje_lower = mensaje.lower()
+        return [f for f, lista in patrones.items() if any(re.search(p, mensaje_lower, re.IGNORECASE) for p in lista)]
+
+    clasificador = ClasificadorIntenciones(patrones)
+    print(f"[BENCH] {len(corpus)} mensajes, {sum(len(l) for l in patrones.values())} patrones")
+
+    for nombre, funcion in (("bucle (primera)", anterior), ("bucle (todas)", anterior_todas),
+                            ("índice (todas)", clasificador.clasificar)):
+        mejor_tiempo = float("inf")
+        for _ in range(args.repeticiones):
+            inicio = time.perf_counter()
+            for mensaje in corpus:
+                funcion(mensaje)
+            mejor_tiempo = min(mejor_tiempo, time.perf_counter() - inicio)
+        print(f"[BENCH] {nombre:16s} {mejor_tiempo * 1000:8.1f} ms  "
+              f"({mejor_tiempo / len(corpus) * 1e6:.1f} µs/mensaje)")
+
+    distintos = sum(1 for m in corpus if anterior(m) != clasificador.mejor(m))
+    multiples = sum(1 for m in corpus if len(clasificador.clasificar(m)) > 1)
+    print(f"[BENCH] {multiples} mensajes con varias intenciones; "
+          f"{distintos} cambian de intención al puntuar en lugar de tomar la primera")
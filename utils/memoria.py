@@ -0,0 +1,165 @@
+import os
+import gc
+import sys
+import time
+import ctypes
+import threading
+import warnings
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Callable
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Memoria residente máxima del proceso en MB. 0 = sin límite.
+PRESUPUESTO_MB = float(os.getenv("MEMORIA_PRESUPUESTO_MB", 0))
+
+MB = 1024 * 1024
+
+
+def rss_actual() -> int:
+    """Memoria residente (RSS) del proceso en bytes."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    # Último recurso: el pico, no el valor actual (KB en Linux, bytes en macOS)
+    import resource
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if sys.platform == "darwin" else pico * 1024
+
+
+def _devolver_memoria_al_so() -> None:
+    """Tras liberar un modelo, pide a glibc que devuelva al sistema la memoria libre."""
+    gc.collect()
+    if sys.platform.startswith("linux"):
+        try:
+            ctypes.CDLL("libc.so.6").malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+
+@dataclass
+class Recurso:
+    """
+    Modelo que se puede descargar y volver a cargar bajo demanda.
+
+    Quien lo registra aporta las funciones para consultarlo; el propio recurso
+    se encarga de recargarse la próxima vez que se use.
+    """
+    nombre: str
+    descargar: Callable[[], None]
+    cargado: Callable[[], bool]
+    ultimo_uso: Callable[[], float]           # time.monotonic() del último uso
+    tamano: Callable[[], Optional[int]]       # bytes estimados, None si no se sabe
+
+
+class GestorMemoria:
+    """
+    Lleva la cuenta de los modelos cargados en el proceso (LLM, visión) y
+    mantiene la memoria residente por debajo de un presupuesto.
+
+    Cuando el RSS supera MEMORIA_PRESUPUESTO_MB, `ajustar` descarga los modelos
+    usados hace más tiempo hasta volver a entrar en el presupuesto (o quedarse
+    sin candidatos). Cada modelo se recarga solo la próxima vez que se pida.
+    """
+
+    def __init__(self, presupuesto_mb: float = PRESUPUESTO_MB):
+        self.presupuesto = int(presupuesto_mb * MB) if presupuesto_mb > 0 else None
+        self._recursos: Dict[str, Recurso] = {}
+        self._lock = threading.Lock()
+        # Un solo ajuste a la vez; quien llega durante otro no espera (ver `ajustar`)
+        self._ajuste = threading.Lock()
+        self._metricas = {"descargas": 0, "bytes_liberados": 0}
+
+    def registrar(self, recurso: Recurso) -> Recurso:
+        with self._lock:
+            self._recursos[recurso.nombre] = recurso
+        return recurso
+
+    def quitar(self, nombre: str) -> None:
+        with self._lock:
+            self._recursos.pop(nombre, None)
+
+    def excedido(self) -> bool:
+        """True si hay presupuesto y el proceso lo supera."""
+        return self.presupuesto is not None and rss_actual() > self.presupuesto
+
+    def ajustar(self, excepto: Optional[str] = None) -> List[str]:
+        """
+        Descarga modelos por orden de último uso hasta cumplir el presupuesto.
+
+        Se llama después de cargar o usar un modelo. Si ya hay otro ajuste en
+        curso se vuelve sin hacer nada: quien ajusta puede estar esperando a que
+        termine una generación, y esa generación puede ser la que llama aquí.
+
+        Args:
+            excepto: Recurso que no se debe descargar (el que se acaba de cargar)
+
+        Returns:
+            Nombres de los recursos descargados
+        """
+        if self.presupuesto is None or not self._ajuste.acquire(blocking=False):
+            return []
+        descargados = []
+        try:
+            rss = rss_actual()
+            while rss > self.presupuesto:
+                with self._lock:
+                    candidatos = [
+                        r for r in self._recursos.values()
+                        if r.nombre != excepto and r.nombre not in descargados and r.cargado()
+                    ]
+                if not candidatos:
+                    warnings.warn(
+                        f"Memoria residente {rss / MB:.0f} MB por encima del presupuesto "
+                        f"({self.presupuesto / MB:.0f} MB) sin más modelos que descargar"
+                    )
+                    break
+                recurso = min(candidatos, key=lambda r: r.ultimo_uso())
+                print(f"[MEMORIA] Descargando {recurso.nombre} (RSS {rss / MB:.0f} MB)")
+                try:
+                    recurso.descargar()
+                except Exception as e:
+                    print(f"[MEMORIA] Error descargando {recurso.nombre}: {str(e)}")
+                descargados.append(recurso.nombre)
+                _devolver_memoria_al_so()
+                anterior, rss = rss, rss_actual()
+                self._metricas["descargas"] += 1
+                self._metricas["bytes_liberados"] += max(anterior - rss, 0)
+        finally:
+            self._ajuste.release()
+        return descargados
+
+    def uso(self) -> Dict[str, Any]:
+        """Memoria del proceso y estado de cada modelo registrado."""
+        ahora = time.monotonic()
+        with self._lock:
+            recursos = list(self._recursos.values())
+        detalle = {}
+        for recurso in recursos:
+            cargado = recurso.cargado()
+            tamano = recurso.tamano() if cargado else None
+            ultimo_uso = recurso.ultimo_uso() if cargado else None
+            detalle[recurso.nombre] = {
+                "cargado": cargado,
+                "tamano_mb": round(tamano / MB, 1) if tamano else None,
+                "inactivo_s": round(ahora - ultimo_uso, 1) if ultimo_uso else None,
+            }
+        metricas = dict(self._metricas)
+        return {
+            "rss_mb": round(rss_actual() / MB, 1),
+            "presupuesto_mb": round(self.presupuesto / MB, 1) if self.presupuesto else None,
+            "descargas": metricas["descargas"],
+            "liberados_mb": round(metricas["bytes_liberados"] / MB, 1),
+            "recursos": detalle,
+        }
+
+
+# Instancia global del proceso
+gestor_memoria = GestorMemoria()
@@ -0,0 +1,468 @@
+import os
+import time
+import asyncio
+import threading
+import warnings
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, List, Iterator, AsyncIterator, Tuple, Callable
+
+from langchain_core.callbacks import CallbackManagerForLLMRun, AsyncCallbackManagerForLLMRun
+from langchain_core.outputs import GenerationChunk
+from langchain_community.llms import LlamaCpp
+from pydantic import PrivateAttr
+
+from utils.prefijos import PrefijoKV
+from utils.planificador import PlanificadorInferencia
+from utils.especulativo import MedidorVelocidad, normalizar_config, registro_borradores
+from utils.memoria import Recurso, gestor_memoria
+from utils.gramaticas import cache_gramaticas
+from utils.ejecutores import obtener_ejecutor
+
+# Parámetros de muestreo: cambian el texto generado
+PARAMETROS_MUESTREO = ("temperature", "max_tokens", "stop", "top_p", "top_k", "repeat_penalty")
+
+# Parámetros de generación que cada agente envía en cada llamada
+PARAMETROS_GENERACION = PARAMETROS_MUESTREO + ("draft_model",)
+
+STOP_POR_DEFECTO = ["Usuario:", "Paciente:", "Human:", "AI:", "Asistente:"]
+
+# Campos de LlamaCpp que se pasan a Llama al cargar el modelo (como en LlamaCpp.validate_environment)
+PARAMETROS_CARGA = (
+    "rope_freq_scale", "rope_freq_base", "lora_path", "lora_base", "n_ctx", "n_parts", "seed",
+    "f16_kv", "logits_all", "vocab_only", "use_mlock", "n_threads", "n_batch", "use_mmap",
+    "last_n_tokens_size", "verbose",
+)
+
+
+class LlamaCppCompartido(LlamaCpp):
+    """
+    LlamaCpp con una cola de peticiones propia.
+
+    llama.cpp no es seguro entre hilos: una misma instancia se comparte entre
+    todos los agentes y sesiones, así que cada generación pasa por el planificador
+    del modelo (ver utils/planificador.py), que las ejecuta en orden en un único
+    hilo trabajador y devuelve el resultado a cada llamante.
+
+    Acepta por llamada:
+    - `prefijo_kv`: el texto estático con el que empieza el prompt del agente.
+      Su estado se restaura antes de generar (ver utils/prefijos.py).
+    - `draft_model`: configuración de decodificación especulativa del agente
+      (ver utils/especulativo.py). Requiere un modelo cargado con logits_all.
+    - `gramatica`: texto GBNF que restringe los tokens que se pueden generar
+      (ver utils/gramaticas.py). La generación termina al cerrarse la estructura.
+    - `al_encolar`: función sin argumentos que se llama en cuanto la petición
+      está en la cola del modelo (p. ej. para encolar detrás un prellenado).
+
+    El gestor de memoria puede descargar los pesos (`descargar`); la siguiente
+    generación los vuelve a cargar.
+    """
+
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+    _prefijos: Dict[str, PrefijoKV] = PrivateAttr(default_factory=dict)
+    _planificador: Optional[PlanificadorInferencia] = PrivateAttr(default=None)
+    _ultimo_uso: float = PrivateAttr(default_factory=time.monotonic)
+
+    @property
+    def nombre_recurso(self) -> str:
+        return f"llm:{os.path.basename(self.model_path)}:{self.n_ctx}"
+
+    @property
+    def cargado(self) -> bool:
+        return self.client is not None
+
+    @property
+    def ultimo_uso(self) -> float:
+        return self._ultimo_uso
+
+    def descargar(self) -> None:
+        """Libera los pesos y el contexto. Espera a que termine la generación en curso."""
+        with self._lock:
+            if self.client is None:
+                return
+            self.client.close()
+            self.client = None
+
+    def _asegurar_cliente(self) -> None:
+        """Vuelve a cargar el modelo si se descargó. Debe llamarse con el candado tomado."""
+        self._ultimo_uso = time.monotonic()
+        if self.client is not None:
+            return
+        from llama_cpp import Llama
+
+        print(f"[MODELOS] Recargando {os.path.basename(self.model_path)}")
+        params = {nombre: getattr(self, nombre) for nombre in PARAMETROS_CARGA}
+        if self.n_gpu_layers is not None:
+            params["n_gpu_layers"] = self.n_gpu_layers
+        params.update(self.model_kwargs)
+        self.client = Llama(self.model_path, **params)
+        # El ajuste puede descargar otros modelos (tomando su candado): se hace
+        # fuera, cuando este hilo ya no tiene el candado de este modelo
+        try:
+            obtener_ejecutor("io").submit(gestor_memoria.ajustar, excepto=self.nombre_recurso)
+        except RuntimeError:
+            # Intérprete cerrándose
+            pass
+
+    def tamano_estimado(self) -> int:
+        """Tamaño de los pesos (el archivo GGUF); no incluye la caché KV."""
+        return os.path.getsize(self.model_path)
+
+    @property
+    def planificador(self) -> PlanificadorInferencia:
+        if self._planificador is None:
+            with self._lock:
+                if self._planificador is None:
+                    self._planificador = PlanificadorInferencia(os.path.basename(self.model_path))
+        return self._planificador
+
+    def _restaurar_prefijo(self, prefijo_kv: Optional[str]) -> None:
+        if not prefijo_kv:
+            return
+        prefijo = self._prefijos.get(prefijo_kv)
+        if prefijo is None:
+            prefijo = self._prefijos[prefijo_kv] = PrefijoKV(prefijo_kv)
+        prefijo.restaurar(self.client)
+
+    def precargar_prefijo(self, prefijo_kv: str) -> None:
+        """Deja listo el estado de un prefijo (evaluándolo o leyéndolo de disco) sin generar."""
+        def trabajo():
+            with self._lock:
+                self._asegurar_cliente()
+                self._restaurar_prefijo(prefijo_kv)
+
+        self.planificador.enviar(trabajo, prefijo=prefijo_kv).result()
+
+    def prellenar(self, texto: str, prefijo_kv: Optional[str] = None, session_id: Optional[str] = None) -> Future:
+        """
+        Encola la evaluación de `texto` (el comienzo de un prompt) sin generar.
+        Si la siguiente petición empieza por ese texto, llama.cpp reconoce los
+        tokens ya evaluados y solo procesa el resto.
+
+        Returns:
+            Future con {"tokens": evaluados, "inicio": ..., "fin": ...} (time.monotonic)
+        """
+        def trabajo():
+            with self._lock:
+                inicio = time.monotonic()
+                self._asegurar_cliente()
+                self._restaurar_prefijo(prefijo_kv)
+                client = self.client
+                # Igual que Llama al crear una completion: BOS + texto con tokens especiales
+                tokens = client.tokenize(texto.encode("utf-8"), add_bos=True, special=True)
+                if len(tokens) >= client.n_ctx():
+                    return {"tokens": 0, "inicio": inicio, "fin": time.monotonic()}
+                comunes = 0
+                for evaluado, token in zip(client._input_ids, tokens):
+                    if evaluado != token:
+                        break
+                    comunes += 1
+                client.n_tokens = comunes
+                client.eval(tokens[comunes:])
+                return {"tokens": len(tokens) - comunes, "inicio": inicio, "fin": time.monotonic()}
+
+        return self.planificador.enviar(trabajo, prefijo=prefijo_kv, session_id=session_id)
+
+    def _preparar(self, prefijo_kv: Optional[str], draft_model: Any) -> MedidorVelocidad:
+        """
+        Deja el contexto listo para generar y devuelve dónde medir la generación.
+        Debe llamarse con el candado tomado.
+        """
+        self._asegurar_cliente()
+        self._restaurar_prefijo(prefijo_kv)
+
+        borrador = None
+        config = normalizar_config(draft_model)
+        if config and not self.logits_all:
+            warnings.warn("Decodificación especulativa pedida sobre un modelo cargado sin logits_all; se ignora.")
+        elif config:
+            borrador = registro_borradores.obtener(config, self.client)
+        if borrador is not None:
+            borrador.reiniciar()
+        self.client.draft_model = borrador
+        return borrador or registro_borradores.sin_borrador
+
+    @staticmethod
+    def _parametros_llama(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Traduce los parámetros propios de la llamada a los de Llama (la gramática, ya compilada)."""
+        kwargs = dict(kwargs)
+        gramatica = kwargs.pop("gramatica", None)
+        if gramatica:
+            kwargs["grammar"] = cache_gramaticas.obtener(gramatica)
+        return kwargs
+
+    def _generar(self, prompt: str, stop: Optional[List[str]], prefijo_kv: Optional[str],
+                 draft_model: Any, kwargs: Dict[str, Any]) -> str:
+        with self._lock:
+            medidor = self._preparar(prefijo_kv, draft_model)
+            inicio = time.perf_counter()
+            texto = super()._call(prompt, stop=stop, **self._parametros_llama(kwargs))
+            tokens = len(self.client.tokenize(texto.encode("utf-8"), add_bos=False))
+            medidor.registrar_generacion(tokens, time.perf_counter() - inicio)
+            return texto
+
+    def _generar_stream(self, prompt: str, stop: Optional[List[str]], prefijo_kv: Optional[str],
+                        draft_model: Any, kwargs: Dict[str, Any]) -> Iterator[GenerationChunk]:
+        with self._lock:
+            medidor = self._preparar(prefijo_kv, draft_model)
+            inicio = time.perf_counter()
+            tokens = 0
+            try:
+                # Los callbacks se avisan desde el hilo que consume, no desde el trabajador
+                for chunk in super()._stream(prompt, stop=stop, **self._parametros_llama(kwargs)):
+                    tokens += 1
+                    yield chunk
+            finally:
+                medidor.registrar_generacion(tokens, time.perf_counter() - inicio)
+
+    @staticmethod
+    def _session_id(run_manager) -> Optional[str]:
+        # RunnableWithMessageHistory deja el session_id en los metadatos de la ejecución
+        if run_manager is None:
+            return None
+        return (run_manager.metadata or {}).get("session_id")
+
+    def _clave_coalescencia(self, prompt, stop, prefijo_kv, draft_model, kwargs) -> Optional[Tuple]:
+        """
+        Clave para compartir el resultado entre peticiones idénticas en cola, o
+        None si la generación no es determinista: con temperatura > 0 y sin
+        semilla fija por llamada, dos peticiones iguales deben dar textos distintos.
+        """
+        temperatura = kwargs.get("temperature", self.temperature)
+        semilla = kwargs.get("seed")
+        if (temperatura is None or temperatura > 0) and semilla in (None, -1):
+            return None
+        return (prompt, prefijo_kv, repr(draft_model), repr(stop), repr(sorted(kwargs.items())))
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        prefijo_kv: Optional[str] = None,
+        draft_model: Any = None,
+        al_encolar: Optional[Callable[[], Any]] = None,
+        **kwargs: Any,
+    ) -> str:
+        futuro = self.planificador.enviar(
+            lambda: self._generar(prompt, stop, prefijo_kv, draft_model, kwargs),
+            prefijo=prefijo_kv,
+            session_id=self._session_id(run_manager),
+            clave=self._clave_coalescencia(prompt, stop, prefijo_kv, draft_model, kwargs),
+        )
+        if al_encolar is not None:
+            al_encolar()
+        return futuro.result()
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        prefijo_kv: Optional[str] = None,
+        draft_model: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        for chunk in self.planificador.enviar_stream(
+            lambda: self._generar_stream(prompt, stop, prefijo_kv, draft_model, kwargs),
+            prefijo=prefijo_kv,
+            session_id=self._session_id(run_manager),
+        ):
+            if run_manager:
+                run_manager.on_llm_new_token(
+                    token=chunk.text,
+                    verbose=self.verbose,
+                    log_probs=(chunk.generation_info or {}).get("logprobs"),
+                )
+            yield chunk
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        prefijo_kv: Optional[str] = None,
+        draft_model: Any = None,
+        al_encolar: Optional[Callable[[], Any]] = None,
+        **kwargs: Any,
+    ) -> str:
+        # Se espera el Future del planificador sin ocupar un hilo del event loop
+        futuro = self.planificador.enviar(
+            lambda: self._generar(prompt, stop, prefijo_kv, draft_model, kwargs),
+            prefijo=prefijo_kv,
+            session_id=self._session_id(run_manager),
+            clave=self._clave_coalescencia(prompt, stop, prefijo_kv, draft_model, kwargs),
+        )
+        if al_encolar is not None:
+            al_encolar()
+        return await asyncio.wrap_future(futuro)
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        prefijo_kv: Optional[str] = None,
+        draft_model: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        async for chunk in self.planificador.enviar_stream_async(
+            lambda: self._generar_stream(prompt, stop, prefijo_kv, draft_model, kwargs),
+            prefijo=prefijo_kv,
+            session_id=self._session_id(run_manager),
+        ):
+            if run_manager:
+                await run_manager.on_llm_new_token(
+                    token=chunk.text,
+                    verbose=self.verbose,
+                    log_probs=(chunk.generation_info or {}).get("logprobs"),
+                )
+            yield chunk
+
+
+class RegistroModelos:
+    """
+    Registro de modelos GGUF a nivel de proceso.
+
+    Todos los agentes piden su modelo aquí en lugar de crear su propio LlamaCpp.
+    Un modelo ya cargado se reutiliza para cualquier petición con la misma ruta
+    y un contexto (n_ctx) menor o igual, de modo que los siete agentes comparten
+    una sola copia de los pesos. La temperatura, max_tokens y las palabras de
+    parada se envían en cada llamada (ver `parametros_generacion`).
+
+    Los modelos se cargan con al menos LLAMA_N_CTX de contexto para que un agente
+    con contexto pequeño (el clasificador usa 1024) no obligue a cargar una
+    segunda copia cuando luego lo pide un agente con contexto mayor.
+
+    Un agente con `draft_model` necesita un modelo cargado con logits_all, que
+    también sirve a los agentes sin él. Con LLAMA_ESPECULATIVO=1 todos los
+    modelos se cargan así desde el principio y se evita una segunda copia.
+    """
+
+    def __init__(self, n_ctx_minimo: Optional[int] = None, especulativo: Optional[bool] = None):
+        if n_ctx_minimo is None:
+            n_ctx_minimo = int(os.getenv("LLAMA_N_CTX", 0))
+        if especulativo is None:
+            especulativo = os.getenv("LLAMA_ESPECULATIVO", "0").lower() in ("1", "true", "si", "sí")
+        self.n_ctx_minimo = n_ctx_minimo
+        self.especulativo = especulativo
+        self._modelos: Dict[Tuple, LlamaCppCompartido] = {}
+        self._lock = threading.Lock()
+        self._cargando: Dict[str, threading.Lock] = {}
+
+    def _clave(self, model_config: Dict[str, Any]) -> Tuple:
+        model_path = model_config.get("model_path")
+        if not model_path:
+            raise ValueError("model_config no define 'model_path' (revise MODEL_PATH en .env)")
+        return (
+            os.path.abspath(model_path),
+            max(model_config.get("n_ctx", 768), self.n_ctx_minimo),
+            model_config.get("n_gpu_layers"),
+            self.especulativo or bool(model_config.get("draft_model")),
+        )
+
+    def _buscar(self, clave: Tuple) -> Optional[LlamaCppCompartido]:
+        """Busca un modelo cargado compatible: misma ruta, contexto suficiente y logits_all si hace falta."""
+        ruta, n_ctx, n_gpu_layers, especulativo = clave
+        candidatos = [
+            (k, modelo) for k, modelo in self._modelos.items()
+            if k[0] == ruta and k[2] == n_gpu_layers and k[1] >= n_ctx and k[3] >= especulativo
+        ]
+        if not candidatos:
+            return None
+        # El de menor contexto suficiente
+        return min(candidatos, key=lambda item: item[0][1])[1]
+
+    def obtener(self, model_config: Dict[str, Any]) -> LlamaCppCompartido:
+        """
+        Devuelve el modelo compartido para esta configuración, cargándolo si no existe.
+
+        Args:
+            model_config: Configuración del agente (model_path, n_ctx, n_threads, ...)
+
+        Returns:
+            Instancia compartida y segura entre hilos de LlamaCpp
+        """
+        clave = self._clave(model_config)
+        with self._lock:
+            modelo = self._buscar(clave)
+            if modelo is not None:
+                return modelo
+            carga_lock = self._cargando.setdefault(clave[0], threading.Lock())
+
+        # Un solo hilo carga cada archivo; los demás esperan y reutilizan el resultado
+        with carga_lock:
+            with self._lock:
+                modelo = self._buscar(clave)
+                if modelo is not None:
+                    return modelo
+
+            print(f"[MODELOS] Cargando {os.path.basename(clave[0])} (n_ctx={clave[1]}, especulativo={clave[3]})")
+            modelo = LlamaCppCompartido(
+                model_path=model_config.get("model_path"),
+                n_ctx=clave[1],
+                n_threads=model_config.get("n_threads", 8),
+                n_batch=model_config.get("n_batch", 256),
+                n_gpu_layers=clave[2],
+                # La decodificación especulativa verifica los tokens propuestos con los logits de cada posición
+                logits_all=clave[3],
+                # El streaming lo decide cada llamada (invoke o stream), no la instancia
+                streaming=False,
+                verbose=model_config.get("verbose", True),
+            )
+            with self._lock:
+                self._modelos[clave] = modelo
+            gestor_memoria.registrar(Recurso(
+                nombre=modelo.nombre_recurso,
+                descargar=modelo.descargar,
+                cargado=lambda: modelo.cargado,
+                ultimo_uso=lambda: modelo.ultimo_uso,
+                tamano=modelo.tamano_estimado,
+            ))
+            gestor_memoria.ajustar(excepto=modelo.nombre_recurso)
+            return modelo
+
+    def descargar(self, model_path: str) -> int:
+        """Libera todas las instancias cargadas de un archivo. Devuelve cuántas se liberaron."""
+        ruta = os.path.abspath(model_path)
+        with self._lock:
+            claves = [k for k in self._modelos if k[0] == ruta]
+            for clave in claves:
+                gestor_memoria.quitar(self._modelos.pop(clave).nombre_recurso)
+        return len(claves)
+
+    def modelos_cargados(self) -> List[Dict[str, Any]]:
+        """Lista los modelos residentes en el proceso."""
+        with self._lock:
+            return [
+                {
+                    "model_path": k[0],
+                    "n_ctx": k[1],
+                    "n_gpu_layers": k[2],
+                    "especulativo": k[3],
+                    "cargado": modelo.cargado,
+                    "planificador": modelo.planificador.metricas(),
+                }
+                for k, modelo in self._modelos.items()
+            ]
+
+
+def parametros_generacion(model_config: Dict[str, Any], **por_defecto) -> Dict[str, Any]:
+    """
+    Extrae los parámetros de muestreo de un model_config para enviarlos por llamada.
+
+    Args:
+        model_config: Configuración del agente
+        **por_defecto: Valores a usar cuando el agente no define el parámetro
+
+    Returns:
+        Dict listo para `llm.bind(**params)`
+    """
+    params = dict(por_defecto)
+    for nombre in PARAMETROS_GENERACION:
+        if model_config.get(nombre) is not None:
+            params[nombre] = model_config[nombre]
+    return params
+
+
+# Instancia global del proceso
+registro_modelos = RegistroModelos()
@@ -0,0 +1,242 @@
+import os
+import queue
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Callable, Iterator, AsyncIterator, Hashable
+
+# Peticiones seguidas con el mismo prefijo que pueden adelantarse a otras más antiguas
+MAX_AFINIDAD = int(os.getenv("PLANIFICADOR_MAX_AFINIDAD", 4))
+
+_FIN = object()
+
+
+@dataclass
+class Solicitud:
+    """Petición encolada para el modelo."""
+    trabajo: Callable[[], Any]
+    prefijo: Optional[str] = None
+    session_id: Optional[str] = None
+    clave: Optional[Hashable] = None
+    futuros: List[Future] = field(default_factory=list)
+    creada: float = field(default_factory=time.monotonic)
+
+
+class PlanificadorInferencia:
+    """
+    Cola que serializa las generaciones de un modelo compartido.
+
+    Todas las sesiones y agentes encolan aquí sus generaciones y reciben un Future;
+    un hilo trabajador por modelo las ejecuta de una en una, porque el contexto de
+    llama.cpp solo admite una secuencia. No agrupa secuencias en un mismo lote de
+    decodificación: varias peticiones a la vez esperan su turno, no se generan en
+    paralelo. El orden es FIFO entre sesiones, con dos excepciones:
+
+    - Afinidad de prefijo: si hay peticiones en cola con el mismo prefijo estático
+      que acaba de usarse (mismo agente), se atienden primero, hasta MAX_AFINIDAD
+      seguidas, para que el prefijo siga en la caché KV y no haya que restaurarlo.
+    - Coalescencia: una petición idéntica a otra que aún espera en cola (mismo
+      prompt y mismos parámetros) no se vuelve a generar; comparte el resultado.
+    """
+
+    def __init__(self, nombre: str = "modelo", max_afinidad: int = MAX_AFINIDAD):
+        self.nombre = nombre
+        self.max_afinidad = max_afinidad
+        self._pendientes: List[Solicitud] = []
+        self._por_clave: Dict[Hashable, Solicitud] = {}
+        self._cond = threading.Condition()
+        self._hilo: Optional[threading.Thread] = None
+        self._hilo_actual: Optional[int] = None
+        self._ultimo_prefijo: Optional[str] = None
+        self._racha = 0
+        self._metricas = {
+            "atendidas": 0,
+            "coalescidas": 0,
+            "por_afinidad": 0,
+            "errores": 0,
+            "espera_total": 0.0,
+            "espera_max": 0.0,
+        }
+
+    def enviar(
+        self,
+        trabajo: Callable[[], Any],
+        prefijo: Optional[str] = None,
+        session_id: Optional[str] = None,
+        clave: Optional[Hashable] = None,
+    ) -> Future:
+        """
+        Encola un trabajo para el modelo.
+
+        Args:
+            trabajo: Función sin argumentos que ejecuta la generación
+            prefijo: Prefijo estático del prompt (para agrupar peticiones del mismo agente)
+            session_id: Sesión que hace la petición (solo para métricas y trazas)
+            clave: Si se indica, peticiones pendientes con la misma clave comparten resultado
+
+        Returns:
+            Future con el resultado del trabajo
+        """
+        futuro = Future()
+
+        # Llamada hecha desde el propio trabajador (p. ej. un trabajo que genera
+        # otra vez): se ejecuta en el acto para no bloquearse esperándose a sí mismo
+        if threading.get_ident() == self._hilo_actual:
+            try:
+                futuro.set_result(trabajo())
+            except BaseException as e:
+                futuro.set_exception(e)
+            return futuro
+
+        with self._cond:
+            if clave is not None and clave in self._por_clave:
+                self._por_clave[clave].futuros.append(futuro)
+                self._metricas["coalescidas"] += 1
+                return futuro
+
+            solicitud = Solicitud(trabajo, prefijo, session_id, clave, [futuro])
+            self._pendientes.append(solicitud)
+            if clave is not None:
+                self._por_clave[clave] = solicitud
+            self._asegurar_trabajador()
+            self._cond.notify()
+        return futuro
+
+    def enviar_stream(
+        self,
+        generador: Callable[[], Iterator[Any]],
+        prefijo: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> Iterator[Any]:
+        """
+        Encola un trabajo que produce fragmentos y los devuelve según se generan.
+
+        Si quien consume deja de iterar, la generación se corta en el siguiente fragmento.
+        """
+        if threading.get_ident() == self._hilo_actual:
+            yield from generador()
+            return
+
+        fragmentos: "queue.Queue" = queue.Queue()
+        cancelado = threading.Event()
+
+        def trabajo():
+            try:
+                for fragmento in generador():
+                    if cancelado.is_set():
+                        break
+                    fragmentos.put(fragmento)
+            finally:
+                fragmentos.put(_FIN)
+
+        futuro = self.enviar(trabajo, prefijo=prefijo, session_id=session_id)
+        try:
+            while True:
+                fragmento = fragmentos.get()
+                if fragmento is _FIN:
+                    break
+                yield fragmento
+            # Propaga la excepción del trabajo, si la hubo
+            futuro.result()
+        finally:
+            cancelado.set()
+
+    async def enviar_stream_async(
+        self,
+        generador: Callable[[], Iterator[Any]],
+        prefijo: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> AsyncIterator[Any]:
+        """Igual que `enviar_stream`, pero se consume desde un event loop sin bloquearlo."""
+        loop = asyncio.get_running_loop()
+        fragmentos: "asyncio.Queue" = asyncio.Queue()
+        cancelado = threading.Event()
+
+        def trabajo():
+            try:
+                for fragmento in generador():
+                    if cancelado.is_set():
+                        break
+                    loop.call_soon_threadsafe(fragmentos.put_nowait, fragmento)
+            finally:
+                loop.call_soon_threadsafe(fragmentos.put_nowait, _FIN)
+
+        futuro = self.enviar(trabajo, prefijo=prefijo, session_id=session_id)
+        try:
+            while True:
+                fragmento = await fragmentos.get()
+                if fragmento is _FIN:
+                    break
+                yield fragmento
+            await asyncio.wrap_future(futuro)
+        finally:
+            cancelado.set()
+
+    def _asegurar_trabajador(self) -> None:
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(
+                target=self._trabajar, name=f"planificador-{self.nombre}", daemon=True
+            )
+            self._hilo.start()
+
+    def _siguiente(self) -> Solicitud:
+        """Elige la próxima petición. Debe llamarse con la condición tomada."""
+        elegida = 0
+        if self._ultimo_prefijo is not None and self._racha < self.max_afinidad:
+            for i, solicitud in enumerate(self._pendientes):
+                if solicitud.prefijo == self._ultimo_prefijo:
+                    elegida = i
+                    break
+        solicitud = self._pendientes.pop(elegida)
+        if elegida > 0:
+            self._metricas["por_afinidad"] += 1
+
+        if solicitud.prefijo is not None and solicitud.prefijo == self._ultimo_prefijo:
+            self._racha += 1
+        else:
+            self._racha = 1 if solicitud.prefijo is not None else 0
+        self._ultimo_prefijo = solicitud.prefijo
+        if solicitud.clave is not None:
+            self._por_clave.pop(solicitud.clave, None)
+        return solicitud
+
+    def _trabajar(self) -> None:
+        self._hilo_actual = threading.get_ident()
+        while True:
+            with self._cond:
+                while not self._pendientes:
+                    self._cond.wait()
+                solicitud = self._siguiente()
+                espera = time.monotonic() - solicitud.creada
+                self._metricas["espera_total"] += espera
+                self._metricas["espera_max"] = max(self._metricas["espera_max"], espera)
+
+            futuros = [f for f in solicitud.futuros if f.set_running_or_notify_cancel()]
+            if not futuros:
+                continue
+            error = None
+            try:
+                resultado = solicitud.trabajo()
+            except BaseException as e:
+                error = e
+            # Los contadores se actualizan antes de avisar, para que quien espera el resultado ya los vea
+            with self._cond:
+                self._metricas["atendidas"] += 1
+                if error is not None:
+                    self._metricas["errores"] += 1
+            for futuro in futuros:
+                if error is not None:
+                    futuro.set_exception(error)
+                else:
+                    futuro.set_result(resultado)
+
+    def metricas(self) -> Dict[str, Any]:
+        """Contadores de la cola: peticiones atendidas, coalescidas, esperas, etc."""
+        with self._cond:
+            metricas = dict(self._metricas)
+            metricas["en_cola"] = len(self._pendientes)
+        atendidas = metricas["atendidas"]
+        metricas["espera_media"] = metricas["espera_total"] / atendidas if atendidas else 0.0
+        return metricas
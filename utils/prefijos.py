@@ -0,0 +1,131 @@
+import os
+import pickle
+import hashlib
+import threading
+import warnings
+from collections import OrderedDict
+from typing import Optional, List
+
+# Estados de prefijo que se mantienen en RAM además de en disco
+PREFIJOS_EN_MEMORIA = int(os.getenv("KV_PREFIJOS_EN_MEMORIA", 2))
+
+
+class PrefijoKV:
+    """
+    Estado de llama.cpp tras evaluar el prefijo estático del prompt de un agente
+    (prompt de sistema y encabezado del historial).
+
+    El prefijo se evalúa una sola vez; el estado resultante se guarda en disco junto
+    al modelo, identificado por un hash del prefijo, y se restaura antes de cada
+    petición. llama.cpp reconoce el prefijo ya evaluado y solo procesa el resto
+    del prompt.
+    """
+
+    def __init__(self, texto: str):
+        self.texto = texto
+        self._tokens: Optional[List[int]] = None
+
+    def _tokenizar(self, client) -> List[int]:
+        if self._tokens is None:
+            # Igual que Llama al crear una completion: BOS + texto con tokens especiales
+            self._tokens = client.tokenize(self.texto.encode("utf-8"), add_bos=True, special=True)
+        return self._tokens
+
+    def _clave(self, client) -> str:
+        """Hash del prefijo y del modelo/contexto con el que se evaluó."""
+        import llama_cpp
+
+        ruta = os.path.abspath(client.model_path)
+        try:
+            stat = os.stat(ruta)
+            firma_modelo = f"{ruta}:{stat.st_size}:{int(stat.st_mtime)}"
+        except OSError:
+            firma_modelo = ruta
+        contenido = (
+            f"{firma_modelo}|{client.n_ctx()}|{client.context_params.logits_all}|"
+            f"{llama_cpp.__version__}|{self.texto}"
+        )
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()[:32]
+
+    def _ruta_disco(self, client, clave: str) -> str:
+        directorio = os.getenv("KV_PREFIJOS_DIR") or os.path.join(
+            os.path.dirname(os.path.abspath(client.model_path)), ".kv_prefijos"
+        )
+        return os.path.join(directorio, f"{clave}.state")
+
+    def restaurar(self, client) -> None:
+        """
+        Deja el contexto de `client` con el prefijo ya evaluado.
+        Debe llamarse con el candado del modelo tomado.
+        """
+        tokens = self._tokenizar(client)
+        if len(tokens) >= client.n_ctx():
+            return
+
+        # El contexto ya empieza por este prefijo (la última petición fue del mismo agente)
+        if client.n_tokens >= len(tokens) and list(client.input_ids[:len(tokens)]) == tokens:
+            return
+
+        clave = self._clave(client)
+        estado = _estados.obtener(clave)
+        if estado is None:
+            estado = self._cargar_disco(client, clave)
+        if estado is None:
+            client.reset()
+            client.eval(tokens)
+            estado = client.save_state()
+            self._guardar_disco(client, clave, estado)
+        else:
+            client.load_state(estado)
+        _estados.guardar(clave, estado)
+
+    def _cargar_disco(self, client, clave: str):
+        ruta = self._ruta_disco(client, clave)
+        if not os.path.exists(ruta):
+            return None
+        try:
+            with open(ruta, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            warnings.warn(f"Estado de prefijo corrupto en {ruta}: {str(e)}. Se volverá a evaluar.")
+            return None
+
+    def _guardar_disco(self, client, clave: str, estado) -> None:
+        ruta = self._ruta_disco(client, clave)
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            temporal = f"{ruta}.{os.getpid()}.tmp"
+            with open(temporal, "wb") as f:
+                pickle.dump(estado, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporal, ruta)
+            print(f"[PREFIJOS] Prefijo de {len(self._tokens)} tokens guardado en {ruta}")
+        except Exception as e:
+            warnings.warn(f"No se pudo guardar el estado del prefijo en {ruta}: {str(e)}")
+
+
+class _EstadosEnMemoria:
+    """LRU pequeño de estados de prefijo ya cargados."""
+
+    def __init__(self, capacidad: int):
+        self._capacidad = capacidad
+        self._estados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: str):
+        with self._lock:
+            estado = self._estados.get(clave)
+            if estado is not None:
+                self._estados.move_to_end(clave)
+            return estado
+
+    def guardar(self, clave: str, estado) -> None:
+        if self._capacidad <= 0:
+            return
+        with self._lock:
+            self._estados[clave] = estado
+            self._estados.move_to_end(clave)
+            while len(self._estados) > self._capacidad:
+                self._estados.popitem(last=False)
+
+
+_estados = _EstadosEnMemoria(PREFIJOS_EN_MEMORIA)
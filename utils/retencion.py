@@ -0,0 +1,276 @@
+import os
+import sys
+import time
+import fnmatch
+import threading
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple
+
+from utils.conversation import cache_conversaciones
+from utils import historial_sqlite
+
+DIA = 24 * 3600
+MB = 1024 * 1024
+
+# Historiales compartidos que usaban el clasificador y la extracción de datos antes de
+# `Agente.preguntar_sin_historial`; se siguen limpiando si quedan en disco
+SESIONES_TEMPORALES = ("clasificador_temp", "extraccion_temp")
+
+# Tope del tamaño total de los artefactos en MB (0 = sin tope). Al superarlo se
+# borran los más antiguos, aunque no hayan caducado.
+TAMANO_MAXIMO_MB = float(os.getenv("RETENCION_TAMANO_MAX_MB", 0))
+# Minutos entre barridos
+INTERVALO_MIN = float(os.getenv("RETENCION_INTERVALO_MIN", 60))
+# Cada cuántos archivos borrados el barrido cede la CPU y el disco
+LOTE = 100
+PAUSA = 0.05
+
+
+@dataclass
+class TipoArtefacto:
+    """
+    Archivos de un directorio con la misma caducidad (segundos sin modificarse; 0 = nunca).
+    Con `sqlite`, las sesiones de la colección del mismo nombre que el directorio
+    (solo `sesiones`, si se indican) caducan igual en la base compartida.
+    """
+    nombre: str
+    directorio: str
+    patrones: Tuple[str, ...]
+    ttl: float
+    sqlite: bool = False
+    sesiones: Optional[Tuple[str, ...]] = None
+
+
+def _ttl(variable: str, defecto: float, unidad: float) -> float:
+    return float(os.getenv(variable, defecto)) * unidad
+
+
+# En orden: cada archivo pertenece al primer tipo cuyo patrón coincide
+TIPOS_POR_DEFECTO = [
+    TipoArtefacto(
+        "temporales", "historiales",
+        tuple(f"{s}.json*" for s in SESIONES_TEMPORALES) + ("*.tmp",),
+        _ttl("RETENCION_TEMPORALES_HORAS", 24, 3600),
+        sqlite=True, sesiones=SESIONES_TEMPORALES,
+    ),
+    TipoArtefacto(
+        "historiales", "historiales", ("*.json", "*.jsonl"), _ttl("RETENCION_HISTORIALES_DIAS", 30, DIA),
+        sqlite=True,
+    ),
+    TipoArtefacto("pdf_temporales", "pdf_analysis", ("*.tmp",), _ttl("RETENCION_TEMPORALES_HORAS", 24, 3600)),
+    TipoArtefacto(
+        "pdf_sesiones", "pdf_analysis", ("session_*.json", "session_*.jsonl"),
+        _ttl("RETENCION_PDF_SESIONES_DIAS", 30, DIA), sqlite=True,
+    ),
+    TipoArtefacto("pdf_analisis", "pdf_analysis", ("analysis_*.json",), _ttl("RETENCION_PDF_ANALISIS_DIAS", 90, DIA)),
+    # Mensajes clasificados para reentrenar el clasificador de n-gramas
+    TipoArtefacto("registro_intenciones", "logs", ("intenciones-*.jsonl",), _ttl("RETENCION_REGISTRO_DIAS", 180, DIA)),
+]
+
+
+class Retencion:
+    """
+    Borra los artefactos de sesiones antiguas (historiales, análisis de PDFs).
+
+    Un hilo de baja prioridad barre los directorios cada INTERVALO_MIN minutos:
+    primero lo caducado según el TTL de cada tipo y después, si el total sigue
+    por encima de RETENCION_TAMANO_MAX_MB, lo más antiguo. Con el backend SQLite
+    purga también las sesiones inactivas de la base. Las conversaciones borradas
+    se sacan de la caché sin volcar (ver CacheConversaciones.descartar).
+    """
+
+    def __init__(self, tipos: Optional[List[TipoArtefacto]] = None,
+                 tamano_maximo_mb: float = TAMANO_MAXIMO_MB, intervalo_min: float = INTERVALO_MIN):
+        self.tipos = tipos if tipos is not None else TIPOS_POR_DEFECTO
+        self.tamano_maximo = int(tamano_maximo_mb * MB) if tamano_maximo_mb > 0 else None
+        self.intervalo = intervalo_min * 60
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+        self._detener = threading.Event()
+        self._metricas = {
+            "barridos": 0, "archivos_borrados": 0, "bytes_liberados": 0, "sesiones_borradas": 0,
+            "mensajes_sqlite_borrados": 0, "errores": 0, "ultimo_barrido": None, "segundos_ultimo_barrido": None,
+        }
+
+    def _tipo(self, directorio: str, nombre: str) -> Optional[TipoArtefacto]:
+        for tipo in self.tipos:
+            if tipo.directorio == directorio and any(fnmatch.fnmatch(nombre, p) for p in tipo.patrones):
+                return tipo
+        return None
+
+    def _listar(self) -> List[Tuple[float, int, str, TipoArtefacto]]:
+        """(mtime, tamaño, ruta, tipo) de cada artefacto reconocido."""
+        archivos = []
+        for directorio in sorted({t.directorio for t in self.tipos}):
+            if not os.path.isdir(directorio):
+                continue
+            with os.scandir(directorio) as entradas:
+                for entrada in entradas:
+                    tipo = self._tipo(directorio, entrada.name)
+                    if tipo is None or not entrada.is_file(follow_symlinks=False):
+                        continue
+                    try:
+                        info = entrada.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    archivos.append((info.st_mtime, info.st_size, entrada.path, tipo))
+        return archivos
+
+    def _borrar_archivo(self, ruta: str) -> int:
+        """Borra un artefacto y devuelve los bytes liberados (0 si ya no existía)."""
+        cache_conversaciones.descartar(ruta)
+        try:
+            tamano = os.path.getsize(ruta)
+            os.remove(ruta)
+        except FileNotFoundError:
+            return 0
+        return tamano
+
+    def _contar(self, clave: str, cantidad: int = 1) -> None:
+        with self._lock:
+            self._metricas[clave] += cantidad
+
+    def barrer(self) -> Dict[str, int]:
+        """
+        Un barrido completo. Se puede llamar a mano (p. ej. desde cron con
+        `python -m utils.retencion`).
+
+        Returns:
+            Archivos y bytes borrados por caducidad y por tope de tamaño, y mensajes borrados de SQLite
+        """
+        inicio = time.perf_counter()
+        ahora = time.time()
+        resumen = {"caducados": 0, "por_tamano": 0, "bytes": 0, "mensajes_sqlite": 0}
+        borrados_lote = 0
+
+        def borrar(ruta: str, motivo: str) -> None:
+            nonlocal borrados_lote
+            try:
+                liberados = self._borrar_archivo(ruta)
+            except OSError as e:
+                self._contar("errores")
+                print(f"[RETENCION] Error borrando {ruta}: {str(e)}")
+                return
+            resumen[motivo] += 1
+            resumen["bytes"] += liberados
+            borrados_lote += 1
+            if borrados_lote % LOTE == 0:
+                time.sleep(PAUSA)
+
+        # 1. Caducidad por tipo
+        vivos = []
+        for mtime, tamano, ruta, tipo in self._listar():
+            if tipo.ttl > 0 and ahora - mtime > tipo.ttl:
+                borrar(ruta, "caducados")
+            else:
+                vivos.append((mtime, tamano, ruta))
+
+        # 2. Tope de tamaño: los más antiguos primero
+        if self.tamano_maximo is not None:
+            total = sum(tamano for _, tamano, _ in vivos)
+            for mtime, tamano, ruta in sorted(vivos):
+                if total <= self.tamano_maximo:
+                    break
+                borrar(ruta, "por_tamano")
+                total -= tamano
+
+        # 3. Sesiones inactivas en la base SQLite
+        if os.path.exists(historial_sqlite.RUTA_DB):
+            for tipo in self.tipos:
+                if not tipo.sqlite or tipo.ttl <= 0:
+                    continue
+                try:
+                    sesiones, mensajes = historial_sqlite.purgar_inactivas(
+                        tipo.directorio, ahora - tipo.ttl, historial_sqlite.RUTA_DB, sesiones=tipo.sesiones
+                    )
+                except Exception as e:
+                    self._contar("errores")
+                    print(f"[RETENCION] Error purgando SQLite ({tipo.nombre}): {str(e)}")
+                    continue
+                for session_id in sesiones:
+                    cache_conversaciones.descartar(os.path.join(tipo.directorio, f"{session_id}.jsonl"))
+                resumen["mensajes_sqlite"] += mensajes
+
+        segundos = time.perf_counter() - inicio
+        with self._lock:
+            self._metricas["barridos"] += 1
+            self._metricas["archivos_borrados"] += resumen["caducados"] + resumen["por_tamano"]
+            self._metricas["bytes_liberados"] += resumen["bytes"]
+            self._metricas["mensajes_sqlite_borrados"] += resumen["mensajes_sqlite"]
+            self._metricas["ultimo_barrido"] = ahora
+            self._metricas["segundos_ultimo_barrido"] = round(segundos, 3)
+        if resumen["caducados"] or resumen["por_tamano"] or resumen["mensajes_sqlite"]:
+            print(f"[RETENCION] {resumen['caducados']} caducados y {resumen['por_tamano']} por tamaño "
+                  f"({resumen['bytes'] / MB:.1f} MB), {resumen['mensajes_sqlite']} mensajes de SQLite "
+                  f"en {segundos:.2f}s")
+        return resumen
+
+    def borrar_sesion(self, session_id: str) -> int:
+        """
+        Borra todo lo guardado de una sesión (historial de los agentes y del
+        análisis de PDFs, en archivos y en SQLite). Se llama al expirar la sesión.
+
+        Returns:
+            Bytes liberados en disco
+        """
+        liberados = 0
+        for ruta in (
+            os.path.join("historiales", f"{session_id}.jsonl"),
+            os.path.join("historiales", f"{session_id}.json"),
+            os.path.join("pdf_analysis", f"session_{session_id}.jsonl"),
+            os.path.join("pdf_analysis", f"session_{session_id}.json"),
+        ):
+            try:
+                liberados += self._borrar_archivo(ruta)
+                if os.path.exists(historial_sqlite.RUTA_DB) and ruta.endswith(".jsonl"):
+                    self._contar("mensajes_sqlite_borrados", historial_sqlite.HistorialSQLite(ruta).borrar())
+            except Exception as e:
+                self._contar("errores")
+                print(f"[RETENCION] Error borrando {ruta}: {str(e)}")
+        with self._lock:
+            self._metricas["sesiones_borradas"] += 1
+            self._metricas["bytes_liberados"] += liberados
+        return liberados
+
+    def iniciar(self) -> None:
+        """Arranca el barrido periódico en segundo plano (solo la primera vez)."""
+        with self._lock:
+            if self._hilo is not None or self.intervalo <= 0:
+                return
+            self._hilo = threading.Thread(target=self._barredor, name="retencion", daemon=True)
+            self._hilo.start()
+
+    def _barredor(self) -> None:
+        # En Linux la prioridad es por hilo: solo baja la del barredor
+        if sys.platform.startswith("linux"):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except (OSError, AttributeError):
+                pass
+        while True:
+            try:
+                self.barrer()
+            except Exception as e:
+                self._contar("errores")
+                print(f"[RETENCION] Error en el barrido: {str(e)}")
+            if self._detener.wait(self.intervalo):
+                return
+
+    def detener(self) -> None:
+        self._detener.set()
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            metricas = dict(self._metricas)
+        metricas["mb_liberados"] = round(metricas["bytes_liberados"] / MB, 2)
+        metricas["tamano_maximo_mb"] = round(self.tamano_maximo / MB, 1) if self.tamano_maximo else None
+        return metricas
+
+
+# Instancia global del proceso
+retencion = Retencion()
+
+
+if __name__ == "__main__":
+    resumen = retencion.barrer()
+    print(f"[RETENCION] {resumen}")
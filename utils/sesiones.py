@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import heapq
+import threading
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+from utils.ejecutores import obtener_ejecutor
+from utils import historial_sqlite
+
+# "memoria" (un proceso) o "sqlite" (la base de historiales, compartida por todos los procesos)
+BACKEND = os.getenv("SESIONES_BACKEND", "memoria")
+# Segundos sin actividad tras los que una sesión caduca
+TTL = float(os.getenv("SESIONES_TTL", 3600))
+# Máximo de sesiones caducadas que se procesan por acceso; el resto queda para los siguientes
+LOTE = 64
+
+
+class SesionesMemoria:
+    """
+    Sesiones en un diccionario con un montículo de vencimientos.
+
+    Renovar una sesión apila un vencimiento nuevo sin buscar el anterior; los
+    que quedan obsoletos se descartan al salir del montículo (su vencimiento ya
+    no coincide con el de la sesión) o al reconstruirlo cuando acumula demasiados.
+    """
+
+    def __init__(self):
+        self._datos: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        self._vencimientos: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def leer(self, session_id: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        with self._lock:
+            return self._datos.get(session_id)
+
+    def escribir(self, session_id: str, datos: Dict[str, Any], vence: float) -> None:
+        with self._lock:
+            self._datos[session_id] = (datos, vence)
+            heapq.heappush(self._vencimientos, (vence, session_id))
+            if len(self._vencimientos) > 2 * len(self._datos) + LOTE:
+                self._vencimientos = [(v, s) for s, (_, v) in self._datos.items()]
+                heapq.heapify(self._vencimientos)
+
+    def borrar(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entrada = self._datos.pop(session_id, None)
+        return entrada[0] if entrada else None
+
+    def caducadas(self, ahora: float, limite: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """Saca del almacén hasta `limite` sesiones vencidas, de la más antigua a la más reciente."""
+        caducadas = []
+        with self._lock:
+            vencimientos = self._vencimientos
+            while vencimientos and vencimientos[0][0] <= ahora and len(caducadas) < limite:
+                vence, session_id = heapq.heappop(vencimientos)
+                entrada = self._datos.get(session_id)
+                if entrada is not None and entrada[1] == vence:
+                    del self._datos[session_id]
+                    caducadas.append((session_id, entrada[0]))
+        return caducadas
+
+    def ids(self, ahora: float) -> List[str]:
+        with self._lock:
+            return [s for s, (_, vence) in self._datos.items() if vence > ahora]
+
+
+class SesionesSQLite:
+    """
+    Sesiones en la tabla `sesiones` de la base de historiales, indexada por
+    (espacio, vence). Los procesos trabajadores comparten el enrutamiento y cada
+    sesión caducada la recoge un único proceso (transacción BEGIN IMMEDIATE).
+    """
+
+    def __init__(self, espacio: str, ruta_db: Optional[str] = None):
+        self.espacio = espacio
+        self.ruta_db = ruta_db or historial_sqlite.RUTA_DB
+
+    def _conexion(self):
+        return historial_sqlite._conexion(self.ruta_db)
+
+    def leer(self, session_id: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        fila = self._conexion().execute(
+            "SELECT datos, vence FROM sesiones WHERE espacio = ? AND session_id = ?",
+            (self.espacio, session_id),
+        ).fetchone()
+        return (json.loads(fila[0]), fila[1]) if fila else None
+
+    def escribir(self, session_id: str, datos: Dict[str, Any], vence: float) -> None:
+        self._conexion().execute(
+            "INSERT OR REPLACE INTO sesiones (espacio, session_id, datos, vence) VALUES (?, ?, ?, ?)",
+            (self.espacio, session_id, json.dumps(datos, ensure_ascii=False), vence),
+        )
+
+    def borrar(self, session_id: str) -> Optional[Dict[str, Any]]:
+        conexion = self._conexion()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            fila = conexion.execute(
+                "SELECT datos FROM sesiones WHERE espacio = ? AND session_id = ?", (self.espacio, session_id)
+            ).fetchone()
+            conexion.execute("DELETE FROM sesiones WHERE espacio = ? AND session_id = ?", (self.espacio, session_id))
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+        conexion.execute("COMMIT")
+        return json.loads(fila[0]) if fila else None
+
+    def caducadas(self, ahora: float, limite: int) -> List[Tuple[str, Dict[str, Any]]]:
+        conexion = self._conexion()
+        # Consulta barata por el índice antes de tomar el candado de escritura
+        if conexion.execute(
+            "SELECT 1 FROM sesiones WHERE espacio = ? AND vence <= ? LIMIT 1", (self.espacio, ahora)
+        ).fetchone() is None:
+            return []
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            filas = conexion.execute(
+                "SELECT session_id, datos FROM sesiones WHERE espacio = ? AND vence <= ? ORDER BY vence LIMIT ?",
+                (self.espacio, ahora, limite),
+            ).fetchall()
+            conexion.executemany(
+                "DELETE FROM sesiones WHERE espacio = ? AND session_id = ?",
+                [(self.espacio, session_id) for session_id, _ in filas],
+            )
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+        conexion.execute("COMMIT")
+        return [(session_id, json.loads(datos)) for session_id, datos in filas]
+
+    def ids(self, ahora: float) -> List[str]:
+        return [fila[0] for fila in self._conexion().execute(
+            "SELECT session_id FROM sesiones WHERE espacio = ? AND vence > ?", (self.espacio, ahora)
+        )]
+
+
+class AlmacenSesiones:
+    """
+    Estado por sesión que caduca tras `ttl` segundos sin actividad.
+
+    Se usa como un diccionario (`in`, `[]`, `get`, `del`). Cada escritura renueva
+    el vencimiento. Las sesiones caducadas se retiran en lotes de como mucho
+    LOTE en cada acceso (O(log n) por sesión, sin recorrer las vivas), y el
+    trabajo asociado (`al_expirar`, p. ej. borrar su historial en disco) corre
+    en el pool "io", fuera de la petición.
+
+    Los datos se guardan por valor: tras modificar un dict obtenido del almacén
+    hay que volver a asignarlo para que el cambio llegue al backend SQLite.
+    """
+
+    def __init__(self, espacio: str, ttl: float = TTL, backend: Optional[str] = None,
+                 al_expirar: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 ruta_db: Optional[str] = None):
+        """
+        Args:
+            espacio: Nombre del almacén (separa orquestador, contacto médico...)
+            ttl: Segundos de inactividad hasta que la sesión caduca
+            backend: "memoria" o "sqlite"; por defecto SESIONES_BACKEND
+            al_expirar: Función (session_id, datos) que se ejecuta al caducar cada sesión
+            ruta_db: Base SQLite (por defecto la de los historiales)
+        """
+        self.espacio = espacio
+        self.ttl = ttl
+        self.al_expirar = al_expirar
+        if (backend or BACKEND) == "sqlite":
+            self._backend = SesionesSQLite(espacio, ruta_db)
+        else:
+            self._backend = SesionesMemoria()
+
+    def expirar(self, limite: int = LOTE) -> List[str]:
+        """Retira un lote de sesiones caducadas y programa su `al_expirar`. Devuelve sus IDs."""
+        caducadas = self._backend.caducadas(time.time(), limite)
+        for session_id, datos in caducadas:
+            print(f"[SESION] Sesión expirada ({self.espacio}): {session_id}")
+            if self.al_expirar is not None:
+                try:
+                    obtener_ejecutor("io").submit(self.al_expirar, session_id, datos)
+                except RuntimeError:
+                    # Intérprete cerrándose
+                    pass
+        return [session_id for session_id, _ in caducadas]
+
+    def get(self, session_id: str, defecto: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        self.expirar()
+        entrada = self._backend.leer(session_id)
+        # Vencida pero aún no retirada (más de LOTE caducadas a la vez)
+        if entrada is None or entrada[1] <= time.time():
+            return defecto
+        return entrada[0]
+
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        datos = self.get(session_id)
+        if datos is None:
+            raise KeyError(session_id)
+        return datos
+
+    def __setitem__(self, session_id: str, datos: Dict[str, Any]) -> None:
+        self._backend.escribir(session_id, datos, time.time() + self.ttl)
+
+    def __delitem__(self, session_id: str) -> None:
+        if self._backend.borrar(session_id) is None:
+            raise KeyError(session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def pop(self, session_id: str, defecto: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        datos = self._backend.borrar(session_id)
+        return defecto if datos is None else datos
+
+    def ids(self) -> List[str]:
+        """IDs de las sesiones vivas."""
+        return self._backend.ids(time.time())
+
+    def __len__(self) -> int:
+        return len(self.ids())
+
+
+if __name__ == "__main__":
+    # Comparación con el recorrido completo del diccionario en cada consulta
+    import random
+
+    n, consultas = 20000, 20000
+    sesiones = {f"s{i}": {"funcionalidad": "diagnostico", "timestamp": time.time()} for i in range(n)}
+
+    inicio = time.perf_counter()
+    for _ in range(consultas):
+        ahora = time.time()
+        expiradas = [s for s, info in sesiones.items() if ahora - info["timestamp"] > TTL]
+        for s in expiradas:
+            del sesiones[s]
+        sesiones.get(f"s{random.randrange(n)}")
+    recorrido = time.perf_counter() - inicio
+
+    almacen = AlmacenSesiones("bench", backend="memoria")
+    for i in range(n):
+        almacen[f"s{i}"] = {"funcionalidad": "diagnostico"}
+    inicio = time.perf_counter()
+    for _ in range(consultas):
+        almacen.get(f"s{random.randrange(n)}")
+    monticulo = time.perf_counter() - inicio
+
+    print(f"[BENCH] {n} sesiones, {consultas} consultas")
+    print(f"[BENCH] recorrido completo: {recorrido / consultas * 1e6:8.1f} µs/consulta")
+    print(f"[BENCH] montículo:          {monticulo / consultas * 1e6:8.1f} µs/consulta")
@@ -0,0 +1,146 @@
+import os
+import math
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+from utils.ejecutores import obtener_ejecutor
+
+# Textos cuyo recuento se recuerda por tokenizador
+CAPACIDAD_CACHE = int(os.getenv("TOKENS_CACHE_CAPACIDAD", 4096))
+# Caracteres por token de partida para estimar (texto clínico en español con
+# vocabularios tipo Llama/Mistral); se corrige con cada recuento exacto
+CARACTERES_POR_TOKEN = 3.2
+# La estimación redondea hacia arriba: quedarse corto desborda n_ctx
+MARGEN_ESTIMACION = 1.1
+
+
+class TokenizadorGGUF:
+    """
+    Cuenta tokens con el vocabulario del propio modelo GGUF a través de llama.cpp.
+
+    Carga solo el vocabulario (`vocab_only`), sin pesos: unos pocos MB que no
+    dependen del LLM compartido, así que contar no espera a una generación en
+    curso ni se ve afectado si el gestor de memoria descarga el modelo.
+
+    Mientras el vocabulario no está cargado (el arranque, en segundo plano) se
+    devuelve una estimación por caracteres, calibrada con los recuentos exactos
+    que ya se han hecho. Los recuentos exactos se memorizan por texto.
+
+    `nombre` distingue ambos casos ("estimado:gguf:<archivo>" hasta que carga el
+    vocabulario): los recuentos guardados con la estimación no se reutilizan
+    como exactos, y Conversation.configurar recuenta al cambiar el nombre.
+    """
+
+    def __init__(self, model_path: str, capacidad: int = CAPACIDAD_CACHE):
+        self.model_path = model_path
+        self.nombre_exacto = f"gguf:{os.path.basename(model_path)}"
+        self.capacidad = capacidad
+        self._vocab = None
+        self._cargando = False
+        self._error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        # Calibración del estimador: caracteres y tokens vistos en recuentos exactos
+        self._caracteres = 0
+        self._tokens = 0
+        self._metricas = {"aciertos": 0, "exactos": 0, "estimados": 0}
+
+    @property
+    def cargado(self) -> bool:
+        return self._vocab is not None
+
+    @property
+    def nombre(self) -> str:
+        """Nombre con el que se guardan los recuentos: cambia al cargar el vocabulario."""
+        return self.nombre_exacto if self._vocab is not None else f"estimado:{self.nombre_exacto}"
+
+    def cargar(self) -> "TokenizadorGGUF":
+        """Carga el vocabulario (bloqueante). Se puede llamar varias veces."""
+        if self._vocab is not None:
+            return self
+        from llama_cpp import Llama
+
+        vocab = Llama(self.model_path, vocab_only=True, n_ctx=64, verbose=False)
+        with self._lock:
+            if self._vocab is None:
+                self._vocab = vocab
+                self._error = None
+            self._cargando = False
+        print(f"[TOKENS] Vocabulario de {os.path.basename(self.model_path)} cargado")
+        return self
+
+    def _cargar_en_segundo_plano(self) -> None:
+        """Lanza la carga una sola vez. Debe llamarse con el candado tomado."""
+        if self._cargando or self._vocab is not None or self._error is not None:
+            return
+        self._cargando = True
+
+        def trabajo():
+            try:
+                self.cargar()
+            except Exception as e:
+                with self._lock:
+                    self._error = str(e)
+                    self._cargando = False
+                print(f"[TOKENS] No se pudo cargar el vocabulario: {str(e)}. Se estimará.")
+
+        try:
+            obtener_ejecutor("io").submit(trabajo)
+        except RuntimeError:
+            # Intérprete cerrándose
+            self._cargando = False
+
+    def estimar(self, texto: str) -> int:
+        """Estimación rápida por caracteres, por encima del valor real en la mayoría de textos."""
+        ratio = self._caracteres / self._tokens if self._tokens else CARACTERES_POR_TOKEN
+        return math.ceil(len(texto) * MARGEN_ESTIMACION / ratio) if texto else 0
+
+    def contar(self, texto: str) -> int:
+        """Tokens del texto según el modelo (o su estimación si aún no hay vocabulario)."""
+        with self._lock:
+            tokens = self._cache.get(texto)
+            if tokens is not None:
+                self._cache.move_to_end(texto)
+                self._metricas["aciertos"] += 1
+                return tokens
+            vocab = self._vocab
+            if vocab is None:
+                self._cargar_en_segundo_plano()
+                self._metricas["estimados"] += 1
+                return self.estimar(texto)
+
+            tokens = len(vocab.tokenize(texto.encode("utf-8"), add_bos=False, special=False))
+            self._cache[texto] = tokens
+            if len(self._cache) > self.capacidad:
+                self._cache.popitem(last=False)
+            self._caracteres += len(texto)
+            self._tokens += tokens
+            self._metricas["exactos"] += 1
+            return tokens
+
+    __call__ = contar
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            metricas = dict(self._metricas)
+            metricas["cargado"] = self._vocab is not None
+            metricas["en_cache"] = len(self._cache)
+            metricas["caracteres_por_token"] = (
+                round(self._caracteres / self._tokens, 2) if self._tokens else CARACTERES_POR_TOKEN
+            )
+        return metricas
+
+
+_tokenizadores: Dict[str, TokenizadorGGUF] = {}
+_lock = threading.Lock()
+
+
+def obtener_tokenizador(model_path: str) -> TokenizadorGGUF:
+    """Tokenizador compartido de un archivo GGUF (uno por proceso y archivo)."""
+    ruta = os.path.abspath(model_path)
+    with _lock:
+        tokenizador = _tokenizadores.get(ruta)
+        if tokenizador is None:
+            tokenizador = _tokenizadores[ruta] = TokenizadorGGUF(ruta)
+        return tokenizador
@@ -1,5 +1,11 @@
 from ultralytics import YOLO
 import os
+import threading
+import time
+
+_model = None
+_last_used = 0.0
+_model_lock = threading.Lock()
 
 
 def load_yolo_model():
@@ -7,8 +13,30 @@ def load_yolo_model():
     model = YOLO(model_path)
     return model
 
+def get_model():
+    # Se carga una sola vez; las llamadas simultáneas esperan a esa carga
+    global _model, _last_used
+    with _model_lock:
+        if _model is None:
+            _model = load_yolo_model()
+        _last_used = time.monotonic()
+    return _model
+
+def unload_model():
+    # Libera el modelo; la siguiente llamada a get_model() lo vuelve a cargar
+    global _model
+    with _model_lock:
+        _model = None
+
+def model_info():
+    # None si no está cargado; si no, último uso (time.monotonic()) y tamaño de los pesos en bytes
+    with _model_lock:
+        if _model is None:
+            return None
+        return {"last_used": _last_used, "bytes": int(sum(p.numel() * p.element_size() for p in _model.model.parameters()))}
+
 def workflow(image_path):
-    model = load_yolo_model()
+    model = get_model()
     return model(image_path)
 
     # El resultado es un iterable con:
@@ -1,3 +1,6 @@
+import os
+import threading
+import time
 import torch
 import torch.nn as nn
 from torchvision import transforms
@@ -23,6 +26,32 @@ def load_model(path='model.pt'):
 
     return model
 
+_model = None
+_last_used = 0.0
+_model_lock = threading.Lock()
+
+def get_model():
+    # Se carga una sola vez; las llamadas simultáneas esperan a esa carga
+    global _model, _last_used
+    with _model_lock:
+        if _model is None:
+            _model = load_model(os.path.join(os.path.dirname(__file__), 'model.pt'))
+        _last_used = time.monotonic()
+    return _model
+
+def unload_model():
+    # Libera el modelo; la siguiente llamada a get_model() lo vuelve a cargar
+    global _model
+    with _model_lock:
+        _model = None
+
+def model_info():
+    # None si no está cargado; si no, último uso (time.monotonic()) y tamaño de los pesos en bytes
+    with _model_lock:
+        if _model is None:
+            return None
+        return {"last_used": _last_used, "bytes": int(sum(p.numel() * p.element_size() for p in _model.parameters()))}
+
 def preprocess_image(image_path):
     image = Image.open(image_path).convert('RGB')
     return transform(image).unsqueeze(0)
@@ -30,7 +59,7 @@ def preprocess_image(image_path):
 
 def workflow(image_path, class_names=["Grado 1", "Grado 2", "Grado 3"]):
 
-    model = load_model()
+    model = get_model()
     input_tensor = preprocess_image(image_path)
 
     with torch.no_grad():
@@ -5,6 +5,8 @@ from keras.layers import GlobalAveragePooling2D, Dense, Dropout
 from keras.models import Sequential
 from keras.preprocessing.image import load_img, img_to_array
 import os
+import threading
+import time
 
 IMG_SIZE = (128, 128)
 WEIGHTS_PATH = os.path.join(os.path.dirname(__file__), 'model.hdf5')
@@ -27,10 +29,22 @@ def get_class_names(csv_path, min_cases=MIN_CASES):
             valid.append(lab)
     return sorted(valid)
 
-CLASS_NAMES = get_class_names(CSV_PATH)
+_class_names = None
+_model = None
+_last_used = 0.0
+_model_lock = threading.RLock()
+
+def get_class_names_cached():
+    global _class_names
+    with _model_lock:
+        if _class_names is None:
+            _class_names = get_class_names(CSV_PATH)
+    return _class_names
 
 # === 2. Reconstruir el modelo ===
-def build_model(num_classes=len(CLASS_NAMES)-1):
+def build_model(num_classes=None):
+    if num_classes is None:
+        num_classes = len(get_class_names_cached()) - 1
     base = MobileNet(input_shape=IMG_SIZE + (1,),
                      include_top=False,
                      weights=None)
@@ -45,11 +59,35 @@ def build_model(num_classes=len(CLASS_NAMES)-1):
     return model
 
 # === 3. Cargar pesos y compilar ===
-model = build_model()
-model.load_weights(WEIGHTS_PATH)
-model.compile(optimizer='adam',
-              loss='binary_crossentropy',
-              metrics=['binary_accuracy'])
+def load_model():
+    model = build_model()
+    model.load_weights(WEIGHTS_PATH)
+    model.compile(optimizer='adam',
+                  loss='binary_crossentropy',
+                  metrics=['binary_accuracy'])
+    return model
+
+def get_model():
+    # Se carga una sola vez (antes se hacía al importar el módulo)
+    global _model, _last_used
+    with _model_lock:
+        if _model is None:
+            _model = load_model()
+        _last_used = time.monotonic()
+    return _model
+
+def unload_model():
+    # Libera el modelo; la siguiente llamada a get_model() lo vuelve a cargar
+    global _model
+    with _model_lock:
+        _model = None
+
+def model_info():
+    # None si no está cargado; si no, último uso (time.monotonic()) y tamaño de los pesos en bytes
+    with _model_lock:
+        if _model is None:
+            return None
+        return {"last_used": _last_used, "bytes": int(sum(w.nbytes for w in _model.get_weights()))}
 
 
 def preprocess_image(path):
@@ -62,9 +100,9 @@ def preprocess_image(path):
 # === 5. Función de inferencia ===
 def infer_image(path):
     x = preprocess_image(path)
-    preds = model.predict(x)[0]          # vector de probabilidades
+    preds = get_model().predict(x)[0]    # vector de probabilidades
     # emparejamos cada clase con su score
-    results = list(zip(CLASS_NAMES, preds))
+    results = list(zip(get_class_names_cached(), preds))
     # orden descendente por probabilidad
     results.sort(key=lambda x: x[1], reverse=True)
     return results
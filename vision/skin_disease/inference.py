@@ -1,3 +1,6 @@
+import os
+import threading
+import time
 import numpy as np
 from tensorflow.keras.models import load_model
 from cv2 import imread, resize
@@ -14,6 +17,32 @@ classes = {
     3: ('df', 'dermatofibroma')
 }
 
+_model = None
+_last_used = 0.0
+_model_lock = threading.Lock()
+
+def get_model():
+    # Se carga una sola vez; las llamadas simultáneas esperan a esa carga
+    global _model, _last_used
+    with _model_lock:
+        if _model is None:
+            _model = load_model(os.path.join(os.path.dirname(__file__), 'model.h5'))
+        _last_used = time.monotonic()
+    return _model
+
+def unload_model():
+    # Libera el modelo; la siguiente llamada a get_model() lo vuelve a cargar
+    global _model
+    with _model_lock:
+        _model = None
+
+def model_info():
+    # None si no está cargado; si no, último uso (time.monotonic()) y tamaño de los pesos en bytes
+    with _model_lock:
+        if _model is None:
+            return None
+        return {"last_used": _last_used, "bytes": int(sum(w.nbytes for w in _model.get_weights()))}
+
 def preprocess_image(img_path):
     img = imread(img_path)
     img = resize(img, TARGET_SIZE)
@@ -21,7 +50,7 @@ def preprocess_image(img_path):
 
 def workflow(image_path):
 
-    model = load_model('model.h5')
+    model = get_model()
 
     img_preprocessed = preprocess_image(image_path)
     pred = model.predict(img_preprocessed)